@@ -1,15 +1,16 @@
 import argparse
 import json
-import librosa
 import numpy as np
 import os
-import time
 import yaml
-from factory import dataset_factory, model_factory
-from flask import Flask, jsonify, request, send_from_directory, send_file
-from log import get_logger
+from factory import voogle_factory
+from flask import (
+    Flask, Response, jsonify, request, send_from_directory, send_file,
+    stream_with_context)
+from log import get_logger, tracing
+from query_archiver import QueryArchiver
+from search_batcher import SearchBatcher
 from timeit import default_timer as timer
-from voogle import Voogle
 from werkzeug.exceptions import BadRequest
 
 logger = get_logger('root')
@@ -33,43 +34,33 @@ def retrieve():
         raise BadRequest('Audio file {} cannot be found'.format(filename))
 
 
+@app.route('/metrics')
+def metrics():
+    # Stage durations of all server processes in the Prometheus text format
+    return Response(
+        tracing.prometheus_text(),
+        mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/search', methods=['POST'])
 def search():
     start = timer()
     logger.debug('Retrieved search request')
 
-    # fetch user's query
-    query_file = request.files['query']
-    sampling_rate = request.form['sampling_rate']
-    text_input = request.form['text_input']
+    with tracing.trace() as timings:
+        # fetch user's query
+        with tracing.span('read_query'):
+            query, sampling_rate, text_input = _read_query()
+
+        if query is not None:
+            # run a similarity search between the query and the audio dataset
+            searcher = app.config.get('searcher')
+            with tracing.span('search'):
+                display_names, ranked_matches, text_matches, \
+                    similarity_scores = searcher.search(
+                        query, sampling_rate, text_input)
 
-    if query_file:
-        # Upack file stream and read bytes into numpy array
-        query = np.frombuffer(query_file.read(), dtype=np.float32)
-        logger.debug('Retrieved user query')
-
-        # Decode sampling_rate from string
-        try:
-            sampling_rate = int(sampling_rate)
-        except ValueError:
-            logger.warning('Couldn\'t decode sampling rate. Attempting search\
-                            with a sampling rate of 48000 Hz.')
-            sampling_rate = 48000
-
-        # write query to disk
-        query_filepath = os.path.join(
-            app.config.get('query_directory'),
-            str(int(time.time())) + '_' + text_input + '.wav')
-        save_start = timer()
-        librosa.output.write_wav(query_filepath, query, sampling_rate)
-        save_end = timer()
-
-        logger.info('Saved query in {} seconds'.format(save_end - save_start))
-
-        # run a similarity search between the query and the audio dataset
-        voogle = app.config.get('voogle')
-        display_names, ranked_matches, text_matches, similarity_scores = (
-            voogle.search(query, sampling_rate, text_input))
+    if query is not None:
         logger.info('Produced matches {} with text-match array {}\
                     '.format(ranked_matches, text_matches))
 
@@ -79,24 +70,191 @@ def search():
         end = timer()
         logger.info(
             'Completed search request in {} seconds'.format(end - start))
+        logger.debug('Search request stage timings {}'.format(timings))
 
-        return jsonify({
+        response = {
             'display_names': display_names,
             'matches': ranked_matches,
             'text_matches': text_matches,
             'similarity_scores': similarity_scores
-        })
+        }
+
+        # Optionally report the duration of each stage in seconds
+        if request.form.get('timings', '').lower() in ('1', 'true'):
+            response['timings'] = timings
+
+        return jsonify(response)
     else:
         # User did not provide a query
         logger.warning('A search was attempted with no query')
         return jsonify({'matches': [], 'text_matches': []})
 
+
+@app.route('/search/stream', methods=['POST'])
+def search_stream():
+    start = timer()
+    logger.debug('Retrieved streaming search request')
+
+    # Optional number of seconds after which the best matches so far are
+    # final. Validated first, so that a rejected request saves no query.
+    time_budget = request.form.get('time_budget')
+    try:
+        time_budget = float(time_budget) if time_budget else None
+    except ValueError:
+        raise BadRequest('Invalid time budget {}'.format(time_budget))
+
+    # fetch user's query
+    query, sampling_rate, text_input = _read_query()
+
+    if query is None:
+        # User did not provide a query
+        logger.warning('A search was attempted with no query')
+        return jsonify({'matches': [], 'text_matches': []})
+
+    voogle = app.config.get('voogle')
+
+    def events():
+        # Send the current best matches as a server-sent event after each
+        # batch of the dataset
+        results = voogle.search_progressive(
+            query, sampling_rate, text_input, time_budget)
+        for (display_names, ranked_matches, text_matches,
+                similarity_scores), done in results:
+            event = json.dumps({
+                'display_names': display_names,
+                'matches': ranked_matches,
+                'text_matches': text_matches,
+                'similarity_scores': similarity_scores,
+                'done': done
+            })
+            yield 'data: {}\n\n'.format(event)
+
+        end = timer()
+        logger.info('Completed streaming search request in {} seconds'.format(
+            end - start))
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache'})
+
+
+def _read_query():
+    '''
+    Reads the user's query from a search request and queues it to be saved
+    to the query directory.
+
+    Returns:
+        A tuple of
+            - A 1D numpy array or None. The vocal query, or None if the
+                request has no query.
+            - An integer. The sampling rate of the query.
+            - A string. The user's text query.
+    '''
+    query_file = request.files['query']
+    sampling_rate = request.form['sampling_rate']
+    text_input = request.form['text_input']
+
+    if not query_file:
+        return None, None, text_input
+
+    # Upack file stream and read bytes into numpy array
+    query = np.frombuffer(query_file.read(), dtype=np.float32)
+    logger.debug('Retrieved user query')
+
+    # Decode sampling_rate from string
+    try:
+        sampling_rate = int(sampling_rate)
+    except ValueError:
+        logger.warning('Couldn\'t decode sampling rate. Attempting search\
+                        with a sampling rate of 48000 Hz.')
+        sampling_rate = 48000
+
+    # Queue the query to be written to disk in the background
+    app.config.get('query_archiver').save(query, sampling_rate, text_input)
+
+    return query, sampling_rate, text_input
+
+
+def create_app(config_file=None):
+    '''
+    Sets up the model and dataset described by a config file and attaches the
+    resulting query-by-voice system to the Flask app. When serving with a
+    multi-worker WSGI server, call this once, before the workers fork (e.g.,
+    with gunicorn's preload_app), so that they share the memory-mapped
+    representations and, for fork-safe models, the model weights. Other models
+    are loaded on first use in each worker.
+
+    Arguments:
+        config_file: A string or None. The path of the .yaml config file. If
+            None, config.yaml next to this file is used.
+
+    Returns:
+        The Flask app.
+    '''
+    # Load the config file
+    parent_directory = os.path.dirname(os.path.abspath(__file__))
+    if config_file is None:
+        config_file = os.path.join(parent_directory, 'config.yaml')
+    config = yaml.safe_load(open(config_file))
+
+    # Share the stage metrics between the server processes. The metrics of a
+    # previous run of the server are not carried over.
+    if config.get('metrics_directory'):
+        metrics_directory = os.path.join(
+            parent_directory, config.get('metrics_directory'))
+        tracing.clear_metrics_directory(metrics_directory)
+        tracing.set_metrics_directory(metrics_directory)
+
+    # Setup the model and dataset on the server
+    voogle = voogle_factory(config, parent_directory)
+    voogle.dataset.preload()
+    if voogle.model.fork_safe:
+        voogle.model.load()
+
+    # Save the metrics of the representation build before the workers fork
+    tracing.flush()
+
+    # Search concurrent queries together. Searches the model cannot share a
+    # dataset scan for run in the request threads, in parallel.
+    searcher = voogle
+    if (config.get('search_batch_wait') is not None and
+            voogle.batches_queries()):
+        searcher = SearchBatcher(
+            voogle,
+            config.get('search_batch_wait'),
+            config.get('search_batch_size', 16))
+
+    # Save queries to disk in the background
+    query_directory = os.path.join(parent_directory, 'data', 'queries')
+    query_archiver = QueryArchiver(
+        query_directory,
+        config.get('query_archive_queue_size', 64),
+        config.get('query_archive_num_workers', 1),
+        config.get('query_archive_drop_policy', 'drop_newest'),
+        raw=config.get('query_archive_raw', False))
+
+    app.config.update(config)
+    app.config.update({'voogle': voogle})
+    app.config.update({'searcher': searcher})
+    app.config.update(
+        {'dataset_directory': voogle.dataset.dataset_directory})
+    app.config.update({'query_directory': query_directory})
+    app.config.update({'query_archiver': query_archiver})
+
+    return app
+
+
 if __name__ == '__main__':
     # set up parser to grab optional inputs:
     #   -c specifies the .yaml config file
     #   -d specifies debug mode on/off
     #   -t specifies threading on/off
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-c', '--config',
+        help='The .yaml config file.',
+        default=None)
     parser.add_argument(
         '-d', '--debug',
         help='Run Flask with the debug flag enabled.',
@@ -107,46 +265,4 @@ if __name__ == '__main__':
         action='store_true')
     args = parser.parse_args()
 
-    # Load the config file
-    parent_directory = os.path.dirname(__file__)
-    config_file = os.path.join(parent_directory, 'config.yaml')
-    config = yaml.safe_load(open(config_file))
-
-    # Setup the model on the server
-    model_filepath = os.path.join(
-        parent_directory, 'model', 'weights', config.get('model_filepath'))
-    model = model_factory(
-        config.get('model_name'), os.path.abspath(model_filepath))
-
-    # Setup the dataset
-    dataset_directory = os.path.join(
-        parent_directory, 'data', 'audio', config.get('dataset_name'))
-    representation_directory = os.path.join(
-        parent_directory,
-        'data',
-        config.get('representation_directory'),
-        config.get('dataset_name'),
-        config.get('model_name'))
-    dataset = dataset_factory(
-        config.get('dataset_name'),
-        dataset_directory,
-        representation_directory,
-        config.get('measure_similarity_batch_size'),
-        config.get('construct_representation_batch_size'),
-        model)
-
-    voogle = Voogle(model, dataset, config.get('require_text_match'))
-
-    query_directory = os.path.join(parent_directory, 'data', 'queries')
-
-    # Make the query directory if it doesn't exist
-    try:
-        os.makedirs(query_directory)
-    except OSError:
-        pass
-
-    app.config.update(config)
-    app.config.update({'voogle': voogle})
-    app.config.update({'dataset_directory': dataset_directory})
-    app.config.update({'query_directory': query_directory})
-    app.run(debug=args.debug, threaded=args.threaded)
+    create_app(args.config).run(debug=args.debug, threaded=args.threaded)
@@ -0,0 +1,307 @@
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import os
+import resource
+import shutil
+import tempfile
+from scipy.io import wavfile
+from timeit import default_timer as timer
+
+
+# Weight files of each model relative to the model/weight directory
+DEFAULT_MODEL_FILEPATHS = {
+    'mcft': 'mcft_filter_bank.pkl',
+    'siamese-style': 'siamese_style.h5',
+    'VGGish-embedding': 'vggish_pretrained_convs.pth',
+    'VGGish-embedding-int8': 'vggish_pretrained_convs.pth'
+}
+
+
+def synthesize_audio(random, duration, sampling_rate):
+    '''
+    Generates a synthetic sound: a few decaying harmonic tones with random
+    pitch glides over a noise floor.
+
+    Arguments:
+        random: A numpy RandomState. The source of randomness.
+        duration: A float. The length of the sound in seconds.
+        sampling_rate: An integer. The sampling rate of the sound.
+
+    Returns:
+        A 1D float32 numpy array.
+    '''
+    num_samples = int(duration * sampling_rate)
+    t = np.arange(num_samples) / sampling_rate
+    audio = 0.01 * random.randn(num_samples)
+    for _ in range(random.randint(1, 4)):
+        onset = random.uniform(0, duration / 2)
+        start_frequency = random.uniform(80, 2000)
+        end_frequency = start_frequency * random.uniform(0.5, 2)
+        frequency = np.linspace(start_frequency, end_frequency, num_samples)
+        phase = 2 * np.pi * np.cumsum(frequency) / sampling_rate
+        envelope = np.exp(-random.uniform(0.5, 4) * np.maximum(t - onset, 0))
+        envelope[t < onset] = 0
+        for harmonic in range(1, random.randint(2, 6)):
+            audio += envelope * np.sin(harmonic * phase) / harmonic
+    return (audio / np.max(np.abs(audio))).astype('float32')
+
+
+def synthesize_corpus(
+    directory, num_files, min_duration, max_duration, sampling_rate, seed):
+    '''
+    Writes a corpus of synthetic WAV files.
+
+    Arguments:
+        directory: A string. The directory the files are written to.
+        num_files: An integer. The number of files.
+        min_duration: A float. The minimum file length in seconds.
+        max_duration: A float. The maximum file length in seconds.
+        sampling_rate: An integer. The sampling rate of the files.
+        seed: An integer. The random seed.
+
+    Returns:
+        A python list of the written filenames.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    random = np.random.RandomState(seed)
+    filenames = []
+    for i in range(num_files):
+        filename = 'synthetic_{:06d}.wav'.format(i)
+        duration = random.uniform(min_duration, max_duration)
+        wavfile.write(
+            os.path.join(directory, filename),
+            sampling_rate,
+            synthesize_audio(random, duration, sampling_rate))
+        filenames.append(filename)
+    return filenames
+
+
+def summarize(durations, num_items=None):
+    '''
+    Summarizes the durations of repeated calls.
+
+    Arguments:
+        durations: A python list of floats. The duration of each call in
+            seconds.
+        num_items: An integer or None. The total number of items processed by
+            the calls. Defaults to one item per call.
+
+    Returns:
+        A dict of latency percentiles in milliseconds and the throughput in
+            items per second.
+    '''
+    if not durations:
+        return {'calls': 0}
+
+    durations = np.array(durations)
+    num_items = len(durations) if num_items is None else num_items
+    return {
+        'calls': len(durations),
+        'p50_ms': float(np.percentile(durations, 50) * 1000),
+        'p95_ms': float(np.percentile(durations, 95) * 1000),
+        'p99_ms': float(np.percentile(durations, 99) * 1000),
+        'mean_ms': float(durations.mean() * 1000),
+        'throughput_per_s': float(num_items / durations.sum())
+    }
+
+
+def peak_rss_mb():
+    '''
+    Returns the peak resident set size of this process in megabytes.
+    '''
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if os.uname().sysname == 'Darwin':
+        peak /= 1024
+    return peak / 1024
+
+
+def benchmark_model(task):
+    '''
+    Benchmarks one model on a synthetic corpus. Runs in its own process, so
+    that the reported peak memory belongs to this model alone.
+
+    Arguments:
+        task: A tuple of the model name, the model weight file, the corpus
+            directory, the query directory and the parsed command-line
+            arguments.
+
+    Returns:
+        A dict. The timings and peak memory of each stage.
+    '''
+    # Imported here so that each model loads its framework in its own process
+    import librosa
+    from data.TestDataset import TestDataset
+    from factory import model_factory
+    from model.text.ContainsText import ContainsText
+    from voogle import Voogle
+
+    model_name, model_filepath, corpus_directory, query_directory, args = task
+    report = {}
+
+    start = timer()
+    model = model_factory(model_name, model_filepath)
+    model.load()
+    report['load_model_s'] = timer() - start
+
+    queries = [
+        librosa.load(os.path.join(query_directory, f), sr=None)
+        for f in sorted(os.listdir(query_directory))]
+
+    # Representation construction, one query at a time and in batches
+    durations = []
+    for query, sampling_rate in queries:
+        start = timer()
+        model.construct_representation(
+            [query], [sampling_rate], is_query=True)
+        durations.append(timer() - start)
+    report['construct_representation_query'] = summarize(durations)
+
+    batch = queries[:args.batch_size]
+    durations = []
+    for _ in range(args.repeats):
+        start = timer()
+        model.construct_representation(
+            [q for q, _ in batch], [s for _, s in batch], is_query=False)
+        durations.append(timer() - start)
+    report['construct_representation_batch'] = summarize(
+        durations, len(batch) * len(durations))
+
+    # Building the representations of the whole corpus
+    representation_directory = tempfile.mkdtemp()
+    try:
+        start = timer()
+        dataset = TestDataset(
+            corpus_directory,
+            representation_directory,
+            model,
+            args.measure_similarity_batch_size,
+            args.construct_representation_batch_size,
+            build_num_workers=args.build_num_workers)
+        duration = timer() - start
+        report['build_representations'] = summarize(
+            [duration], args.num_files)
+
+        # Similarity of a query against every batch of the dataset
+        text_handler = ContainsText()
+        text_handler.set_query_text('')
+        query = model.construct_representation(
+            [queries[0][0]], [queries[0][1]], is_query=True)
+        durations = []
+        num_items = 0
+        for batch_query, batch_items, _ in dataset.data_generator(
+                query, text_handler, False):
+            start = timer()
+            model.measure_similarity(batch_query, batch_items)
+            durations.append(timer() - start)
+            num_items += len(batch_items)
+        report['measure_similarity_batch'] = summarize(durations, num_items)
+
+        # End-to-end search
+        voogle = Voogle(model, dataset, False)
+        durations = []
+        for _ in range(args.repeats):
+            for query, sampling_rate in queries:
+                start = timer()
+                voogle.search(query, sampling_rate)
+                durations.append(timer() - start)
+        report['search'] = summarize(durations)
+    finally:
+        shutil.rmtree(representation_directory)
+
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the models on a synthetic corpus and print the \
+            results as JSON.')
+    parser.add_argument(
+        '-m', '--models',
+        nargs='+',
+        default=sorted(DEFAULT_MODEL_FILEPATHS),
+        help='The names of the models to benchmark.')
+    parser.add_argument(
+        '-w', '--weights',
+        nargs='+',
+        default=[],
+        metavar='MODEL=FILE',
+        help='Weight files relative to model/weights, overriding the defaults.')
+    parser.add_argument(
+        '-n', '--num-files', type=int, default=200,
+        help='The number of files in the synthetic corpus.')
+    parser.add_argument(
+        '-q', '--num-queries', type=int, default=20,
+        help='The number of synthetic queries.')
+    parser.add_argument(
+        '--min-duration', type=float, default=1.0,
+        help='The minimum length of a synthetic file in seconds.')
+    parser.add_argument(
+        '--max-duration', type=float, default=8.0,
+        help='The maximum length of a synthetic file in seconds.')
+    parser.add_argument(
+        '--sampling-rate', type=int, default=44100,
+        help='The sampling rate of the synthetic files.')
+    parser.add_argument(
+        '--batch-size', type=int, default=8,
+        help='The number of files per timed construct_representation batch.')
+    parser.add_argument(
+        '--repeats', type=int, default=3,
+        help='The number of times each timed operation is repeated.')
+    parser.add_argument(
+        '--construct-representation-batch-size', type=int, default=None)
+    parser.add_argument(
+        '--measure-similarity-batch-size', type=int, default=None)
+    parser.add_argument(
+        '--build-num-workers', type=int, default=None)
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='The random seed of the synthetic corpus.')
+    parser.add_argument(
+        '-o', '--output',
+        help='Write the report to this file instead of standard output.')
+    args = parser.parse_args()
+
+    model_filepaths = dict(DEFAULT_MODEL_FILEPATHS)
+    model_filepaths.update(w.split('=', 1) for w in args.weights)
+    weight_directory = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'model', 'weights')
+
+    directory = tempfile.mkdtemp()
+    try:
+        corpus_directory = os.path.join(directory, 'corpus')
+        query_directory = os.path.join(directory, 'queries')
+        synthesize_corpus(
+            corpus_directory, args.num_files, args.min_duration,
+            args.max_duration, args.sampling_rate, args.seed)
+        synthesize_corpus(
+            query_directory, args.num_queries, 1.0, 4.0, args.sampling_rate,
+            args.seed + 1)
+
+        report = {
+            'config': vars(args),
+            'models': {}
+        }
+        context = multiprocessing.get_context('spawn')
+        for model_name in args.models:
+            task = (
+                model_name,
+                os.path.join(weight_directory, model_filepaths[model_name]),
+                corpus_directory,
+                query_directory,
+                args)
+            with context.Pool(1) as pool:
+                report['models'][model_name] = pool.apply(
+                    benchmark_model, (task,))
+    finally:
+        shutil.rmtree(directory)
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+
+
+class DatasetManifest(object):
+    '''
+    A record of the size, modification time and content hash of every audio
+    file whose representation was constructed. Comparing the manifest against
+    the dataset directory identifies the files that were added, changed or
+    deleted since representations were last built.
+    '''
+
+    def __init__(self, directory, name='manifest'):
+        '''
+        DatasetManifest constructor.
+
+        Arguments:
+            directory: A string. The directory containing the manifest file.
+            name: A string. The filename prefix of the manifest file.
+        '''
+        self.filename = os.path.join(directory, name + '.json')
+
+    def exists(self):
+        '''
+        Returns True if a manifest is available on disk.
+        '''
+        return os.path.isfile(self.filename)
+
+    def load(self):
+        '''
+        Loads the manifest.
+
+        Returns:
+            A dict. Maps audio filenames to a dict with keys 'size', 'mtime'
+                and 'hash'.
+        '''
+        with open(self.filename, 'r') as file:
+            return json.load(file)
+
+    def save(self, entries):
+        '''
+        Saves the manifest.
+
+        Arguments:
+            entries: A dict. The manifest entries, as returned by scan.
+        '''
+        temporary_filename = self.filename + '.tmp'
+        with open(temporary_filename, 'w') as file:
+            json.dump(entries, file)
+        os.replace(temporary_filename, self.filename)
+
+    def remove(self):
+        '''
+        Deletes the manifest file, if any.
+        '''
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    def scan(self, dataset_directory, filenames, previous=None):
+        '''
+        Builds manifest entries for the current state of the dataset. Files
+        are only hashed if they are new or their size or modification time
+        changed since the previous manifest.
+
+        Arguments:
+            dataset_directory: A string. The directory containing the dataset.
+            filenames: A python list. The audio filenames relative to
+                dataset_directory.
+            previous: A dict or None. The entries of the previous manifest.
+
+        Returns:
+            A dict. Maps audio filenames to a dict with keys 'size', 'mtime'
+                and 'hash'.
+        '''
+        previous = previous or {}
+        entries = {}
+        for filename in filenames:
+            filepath = os.path.join(dataset_directory, filename)
+            status = os.stat(filepath)
+            entry = previous.get(filename)
+            if (entry is None or entry['size'] != status.st_size or
+                    entry['mtime'] != status.st_mtime):
+                entry = {
+                    'size': status.st_size,
+                    'mtime': status.st_mtime,
+                    'hash': self._hash(filepath)
+                }
+            entries[filename] = entry
+        return entries
+
+    def diff(self, previous, current):
+        '''
+        Compares two sets of manifest entries.
+
+        Arguments:
+            previous: A dict. The entries of the previous manifest.
+            current: A dict. The entries describing the dataset now.
+
+        Returns:
+            A tuple of two python lists. The filenames that were added or whose
+                contents changed, and the filenames that were deleted.
+        '''
+        changed = [
+            f for f in current
+            if f not in previous or previous[f]['hash'] != current[f]['hash']]
+        deleted = [f for f in previous if f not in current]
+        return changed, deleted
+
+    def _hash(self, filepath):
+        digest = hashlib.sha1()
+        with open(filepath, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
@@ -0,0 +1,159 @@
+import numpy as np
+import os
+
+
+class IVFIndex(object):
+    '''
+    An inverted-file (IVF) approximate nearest-neighbour index over a matrix
+    of unit-norm embeddings. The embeddings are clustered with spherical
+    k-means and each cluster keeps the rows assigned to it. A search scores
+    the query against the cluster centroids and returns the rows of the
+    num_probes closest clusters as candidates, which are then ranked exactly
+    by the model.
+    '''
+
+    def __init__(
+        self,
+        directory,
+        num_lists,
+        num_probes,
+        dtype='float32',
+        name='ivf_index',
+        num_iterations=10,
+        training_points_per_list=64,
+        batch_size=4096):
+        '''
+        IVFIndex constructor.
+
+        Arguments:
+            directory: A string. The directory containing the index file.
+            num_lists: An int. The number of clusters.
+            num_probes: An int. The number of clusters scanned per search.
+                Higher values trade latency for recall.
+            dtype: A string. The type the indexed representations are stored
+                as. An index built over another type is rebuilt.
+            name: A string. The filename prefix of the index file.
+            num_iterations: An int. The number of k-means iterations.
+            training_points_per_list: An int. The number of embeddings sampled
+                per cluster to train the centroids.
+            batch_size: An int. The number of embeddings assigned to clusters
+                at once.
+        '''
+        self.filename = os.path.join(directory, name + '.npz')
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self.dtype = np.dtype(dtype).name
+        self.num_iterations = num_iterations
+        self.training_points_per_list = training_points_per_list
+        self.batch_size = batch_size
+
+        self.centroids = None
+        self.list_offsets = None
+        self.list_rows = None
+
+    def exists(self):
+        '''
+        Returns True if an index built with the same number of clusters over
+        representations of the same type is available on disk.
+        '''
+        if not os.path.isfile(self.filename):
+            return False
+
+        with np.load(self.filename) as index:
+            if 'num_lists' not in index or 'dtype' not in index:
+                return False
+            return (int(index['num_lists']) == self.num_lists and
+                    str(index['dtype']) == self.dtype)
+
+    def build(self, matrix):
+        '''
+        Clusters the embeddings and saves the index to disk.
+
+        Arguments:
+            matrix: A 2D numpy array. One unit-norm embedding per row. May be
+                memory-mapped.
+        '''
+        num_rows = len(matrix)
+        num_lists = max(1, min(self.num_lists, num_rows))
+
+        # Train the centroids on a sample of the embeddings
+        random = np.random.RandomState(0)
+        num_samples = min(num_rows, num_lists * self.training_points_per_list)
+        sample = np.sort(random.choice(num_rows, num_samples, replace=False))
+        sample = np.asarray(matrix[sample], dtype='float32').reshape(
+            num_samples, -1)
+
+        centroids = sample[
+            random.choice(num_samples, num_lists, replace=False)]
+        for _ in range(self.num_iterations):
+            assignments = np.argmax(sample.dot(centroids.T), axis=1)
+            for i in range(num_lists):
+                members = sample[assignments == i]
+                if len(members):
+                    centroids[i] = members.sum(axis=0)
+                else:
+                    # Restart empty clusters from a random embedding
+                    centroids[i] = sample[random.randint(num_samples)]
+            centroids = self._normalize(centroids)
+
+        # Assign every embedding to its closest centroid
+        assignments = np.empty(num_rows, dtype='int64')
+        for start in range(0, num_rows, self.batch_size):
+            batch = np.asarray(
+                matrix[start:start + self.batch_size], dtype='float32')
+            batch = batch.reshape(len(batch), -1)
+            assignments[start:start + len(batch)] = np.argmax(
+                batch.dot(centroids.T), axis=1)
+
+        self.centroids = centroids
+        self.list_rows = np.argsort(assignments, kind='mergesort')
+        self.list_offsets = np.concatenate(([0], np.cumsum(
+            np.bincount(assignments, minlength=num_lists))))
+
+        temporary_filename = self.filename + '.tmp.npz'
+        np.savez(
+            temporary_filename,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_rows=self.list_rows,
+            num_lists=self.num_lists,
+            dtype=self.dtype)
+        os.replace(temporary_filename, self.filename)
+
+    def search(self, query):
+        '''
+        Retrieves the candidate rows for a query.
+
+        Arguments:
+            query: A numpy array. A single unit-norm embedding.
+
+        Returns:
+            A sorted 1D numpy array of ints. The rows of the indexed matrix
+                belonging to the num_probes clusters closest to the query.
+        '''
+        if self.centroids is None:
+            self.load()
+
+        query = np.asarray(query, dtype='float32').reshape(-1)
+        scores = self.centroids.dot(query)
+
+        num_probes = min(self.num_probes, len(scores))
+        probes = np.argpartition(-scores, num_probes - 1)[:num_probes]
+
+        rows = [self.list_rows[self.list_offsets[p]:self.list_offsets[p + 1]]
+                for p in probes]
+        return np.sort(np.concatenate(rows))
+
+    def load(self):
+        '''
+        Loads the index from disk.
+        '''
+        with np.load(self.filename) as index:
+            self.centroids = index['centroids']
+            self.list_offsets = index['list_offsets']
+            self.list_rows = index['list_rows']
+
+    def _normalize(self, x):
+        norm = np.linalg.norm(x, axis=1, keepdims=True)
+        norm[norm == 0] = 1
+        return x / norm
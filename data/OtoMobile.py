@@ -1,7 +1,6 @@
 import numpy as np
 import os
 import pandas as pd
-import pickle
 from data.QueryByVoiceDataset import QueryByVoiceDataset
 
 class OtoMobile(QueryByVoiceDataset):
@@ -14,7 +13,11 @@ class OtoMobile(QueryByVoiceDataset):
                  representation_directory,
                  model,
                  measure_similarity_batch_size=None,
-                 construct_representation_batch_size=None):
+                 construct_representation_batch_size=None,
+                 ann_num_lists=None,
+                 ann_num_probes=None,
+                 build_num_workers=None,
+                 representation_dtype='float32'):
         '''
         OtoMobile constructor.
 
@@ -32,10 +35,18 @@ class OtoMobile(QueryByVoiceDataset):
             construct_representation_batch_size: An integer or None. The maximum
                 number of audio files to load during one batch of representation
                 construction.
+            ann_num_lists: An integer or None. The number of clusters of the
+                approximate nearest-neighbour index used to search models that
+                do not use windowing. If None, every query scans the full
+                dataset.
+            ann_num_probes: An integer or None. The number of index clusters
+                searched per query. Higher values trade latency for recall.
+            build_num_workers: An integer or None. The number of processes
+                decoding and resampling audio during representation
+                construction. If None, audio is decoded in this process.
+            representation_dtype: A string. The type representations are
+                stored as: float32, float16, or int8 with a scale per row.
         '''
-        self.binary_filename = os.path.join(
-            representation_directory, 'otomobile.pickle')
-        self.data_dict = None
         self.csv = pd.read_csv(
             os.path.join(dataset_directory, 'otomobile.csv'))
 
@@ -44,7 +55,11 @@ class OtoMobile(QueryByVoiceDataset):
             representation_directory,
             model,
             measure_similarity_batch_size,
-            construct_representation_batch_size)
+            construct_representation_batch_size,
+            ann_num_lists,
+            ann_num_probes,
+            build_num_workers,
+            representation_dtype)
 
     def data_generator(self, query, text_handler, require_text_match):
         '''
@@ -154,10 +169,8 @@ class OtoMobile(QueryByVoiceDataset):
             A python list. Representations should be in the same order as the
                 handles
         '''
-        if not self.data_dict:
-            with open(self.binary_filename, 'rb') as file:
-                self.data_dict = pickle.load(file)
-        return [self.data_dict[os.path.basename(h)] for h in handles]
+        filenames = [self.handle_to_filename(h) for h in handles]
+        return self.store.load(filenames)
 
     def _save_representations(self, representations, filenames):
         '''
@@ -171,7 +184,4 @@ class OtoMobile(QueryByVoiceDataset):
                     representations[i] is the audio representation of
                     filenames[i]).
         '''
-        pairs = zip(filenames, representations)
-        self.data_dict = {os.path.basename(f): r for (f, r) in pairs}
-        with open(self.binary_filename, 'wb') as file:
-            pickle.dump(self.data_dict, file)
+        self.store.append(filenames, representations)
@@ -3,7 +3,13 @@ import numpy as np
 import os
 from abc import ABC, abstractmethod
 from audioread import NoBackendError
+from multiprocessing import Pool
+from data.DatasetManifest import DatasetManifest
+from data.IVFIndex import IVFIndex
+from data.RepresentationStore import RepresentationStore
+from data.TextIndex import TextIndex
 from log import get_logger
+from log.tracing import span
 
 
 class QueryByVoiceDataset(ABC):
@@ -15,7 +21,11 @@ class QueryByVoiceDataset(ABC):
                  representation_directory,
                  model,
                  measure_similarity_batch_size,
-                 construct_representation_batch_size):
+                 construct_representation_batch_size,
+                 ann_num_lists=None,
+                 ann_num_probes=None,
+                 build_num_workers=None,
+                 representation_dtype='float32'):
         '''
         Dataset constructor.
 
@@ -33,6 +43,17 @@ class QueryByVoiceDataset(ABC):
             construct_representation_batch_size: An integer or None. The maximum
                 number of audio files to load during one batch of representation
                 construction.
+            ann_num_lists: An integer or None. The number of clusters of the
+                approximate nearest-neighbour index used to search models that
+                do not use windowing. If None, every query scans the full
+                dataset.
+            ann_num_probes: An integer or None. The number of index clusters
+                searched per query. Higher values trade latency for recall.
+            build_num_workers: An integer or None. The number of processes
+                decoding and resampling audio during representation
+                construction. If None, audio is decoded in this process.
+            representation_dtype: A string. The type representations are
+                stored as: float32, float16, or int8 with a scale per row.
         '''
         self.logger = get_logger('Dataset')
 
@@ -42,19 +63,74 @@ class QueryByVoiceDataset(ABC):
         self.measure_similarity_batch_size = measure_similarity_batch_size
         self.construct_representation_batch_size = \
             construct_representation_batch_size
+        self.build_num_workers = build_num_workers
+
+        # Memory-mapped storage of the audio representations, keyed by audio
+        # filename
+        self.store = RepresentationStore(
+            representation_directory,
+            dtype=representation_dtype,
+            model=self._model_signature())
+
+        # Size, modification time and content hash of each represented file
+        self.manifest = DatasetManifest(representation_directory)
+
+        # The state of the files represented by a build in progress
+        self.build_manifest = DatasetManifest(
+            representation_directory, name='build_manifest')
+
+        # Approximate nearest-neighbour index over fixed-size embeddings
+        if ann_num_lists and not self.model.uses_windowing:
+            self.index = IVFIndex(
+                representation_directory,
+                ann_num_lists,
+                ann_num_probes or 1,
+                representation_dtype)
+        else:
+            self.index = None
+        self._handles_by_row = None
+
+        # Inverted index over the text features of the dataset
+        self.text_index = TextIndex(representation_directory)
 
         if self._dataset_directory_empty():
             self.logger.error('No dataset found!')
             raise FileNotFoundError('No dataset found!')
 
         if (self._representation_directory_empty() or
-            self._dataset_directory_was_updated() or
+            not self.store.exists() or
+            not self.manifest.exists() or
+            (self.store.interrupted() and
+             not self.store.resumable(extends=True)) or
+            self.store.dtype_changed() or
             (self.model.parametric_representation and
              self._model_was_updated())):
             # Build the representations and write them to the representation
             # directory
             self.logger.info('Building all representations from scratch')
             self._build_representations()
+        else:
+            # Only construct representations of added or changed files
+            self._update_representations()
+
+        # An index built with other parameters is rebuilt
+        if self.index and not self.index.exists():
+            self._build_index()
+        if not self.text_index.exists():
+            self._build_text_index()
+
+    def preload(self):
+        '''
+        Opens the representation store and loads the indexes. Processes
+        forked afterwards, e.g., the workers of a WSGI server, share them
+        copy-on-write instead of each loading their own copy.
+        '''
+        self.store.keys()
+        if not self.model.uses_windowing:
+            self.store.float32_matrix()
+        if self.index:
+            self.index.load()
+        self.text_index.load()
 
     @abstractmethod
     def data_generator(self, query):
@@ -164,6 +240,22 @@ class QueryByVoiceDataset(ABC):
         '''
         pass
 
+    def _load_representation_matrix(self, handles):
+        '''
+        Loads the representations of models that do not use windowing as a
+        single float32 numpy array. Representations are read from the store's
+        float32 matrix, so contiguous batches are not copied or converted.
+
+        Arguments:
+            handles: A python list. The representation handles that must be
+                loaded.
+
+        Returns:
+            A numpy array of shape (len(handles), ...).
+        '''
+        filenames = [self.handle_to_filename(h) for h in handles]
+        return self.store.load_matrix(filenames, dtype='float32')
+
     @abstractmethod
     def _save_representations(self, representations, filenames):
         '''
@@ -181,11 +273,9 @@ class QueryByVoiceDataset(ABC):
 
     def _build_representations(self):
         '''
-        Constructs the audio representations and saves them to disk.
-
-        Arguments:
-            audio_filenames: A list. The filenames of the audio within
-                dataset_directory that require representation.
+        Constructs the audio representations and saves them to disk. Progress
+        is checkpointed after every batch, so a build that was interrupted
+        resumes where it stopped.
         '''
         try:
             # Create representation directory
@@ -194,46 +284,226 @@ class QueryByVoiceDataset(ABC):
         except OSError:
             pass
 
-        # Build a generator for reading in audio
+        # Skip the files saved by an interrupted build of the same model
+        if self.store.interrupted() and not self.store.resumable():
+            self.logger.info('Discarding representations of an interrupted \
+                build with another model or representation type')
+        completed = self.store.resume()
+        built = {}
+        if completed and self.build_manifest.exists():
+            built = self.build_manifest.load()
+
+        # Record the state of the dataset being represented
         audio_filenames = self._get_audio_filenames()
-        generator = self._build_audio_generator(audio_filenames)
+        manifest = self.manifest.scan(
+            self.dataset_directory, audio_filenames, built)
+
+        self._drop_stale_representations(completed, built, manifest)
+        if completed:
+            self.logger.info('Resuming representation construction after \
+                {} files'.format(len(completed)))
+        self.build_manifest.save(manifest)
+
+        self._construct_representations(
+            [f for f in audio_filenames if f not in completed])
+
+        # Write the representations of all batches to disk
+        with span('commit_representations'):
+            self.store.commit()
+        self.manifest.save(manifest)
+        self.build_manifest.remove()
+        self._handles_by_row = None
+
+        if self.index:
+            self._build_index()
+        self._build_text_index()
+
+    def _update_representations(self):
+        '''
+        Brings the saved representations up to date with the dataset
+        directory. Representations are constructed only for files that were
+        added or whose contents changed since the last build, and the
+        representations of deleted files are dropped.
+        '''
+        resuming = self.store.interrupted()
+        previous = self.manifest.load()
+        audio_filenames = self._get_audio_filenames()
+        manifest = self.manifest.scan(
+            self.dataset_directory, audio_filenames, previous)
+        changed, deleted = self.manifest.diff(previous, manifest)
+
+        if not changed and not deleted and not resuming:
+            if manifest != previous:
+                # Files were touched without changing their contents
+                self.manifest.save(manifest)
+            return
+
+        self.logger.info('Found {} added or changed and {} deleted files. \
+            Updating representations.'.format(len(changed), len(deleted)))
+
+        # Append the new representations to the saved ones, skipping those
+        # saved by an interrupted update
+        completed = self.store.extend()
+        built = {}
+        if completed and self.build_manifest.exists():
+            built = self.build_manifest.load()
+        stale = self._drop_stale_representations(completed, built, manifest)
+        self.build_manifest.save(manifest)
+
+        self.store.drop(deleted)
+        rebuilt = set(changed).union(stale)
+        self._construct_representations([
+            f for f in audio_filenames
+            if f in rebuilt and f not in completed])
+
+        with span('commit_representations'):
+            self.store.commit()
+        self.manifest.save(manifest)
+        self.build_manifest.remove()
+        self._handles_by_row = None
+
+        if self.index:
+            self._build_index()
+        self._build_text_index()
+
+    def _drop_stale_representations(self, completed, built, manifest):
+        '''
+        Drops the representations saved by an interrupted build of files
+        that were deleted or edited since, so that they are constructed
+        again.
 
-        # Build audio representations in batches
-        for audio, sampling_rates, filenames in generator:
-            representations = self.model.construct_representation(
-                audio, sampling_rates, is_query=False)
-            self._save_representations(representations, filenames)
+        Arguments:
+            completed: A python set. The filenames whose representations were
+                saved by the interrupted build. Stale filenames are removed
+                from it.
+            built: A dict. The manifest entries of the files represented by
+                the interrupted build.
+            manifest: A dict. The manifest entries describing the dataset now.
+
+        Returns:
+            A python list. The filenames whose representations were dropped.
+        '''
+        stale = [
+            f for f in completed
+            if f not in manifest or f not in built or
+            built[f]['hash'] != manifest[f]['hash']]
+        if stale:
+            self.logger.info('Discarding the representations of {} files \
+                changed during the interrupted build'.format(len(stale)))
+            self.store.drop(stale)
+            completed.difference_update(stale)
+        return stale
+
+    def _construct_representations(self, audio_filenames):
+        '''
+        Constructs the representations of the given audio files in batches and
+        saves them.
 
+        Arguments:
+            audio_filenames: A list. The filenames of the audio within
+                dataset_directory that require representation.
+        '''
+        generator = self._build_audio_generator(audio_filenames)
+        while True:
+            # Waiting for the next batch of decoded audio
+            with span('decode'):
+                batch = next(generator, None)
+            if batch is None:
+                break
+            audio, sampling_rates, filenames = batch
+
+            with span('construct_representation'):
+                representations = self.model.construct_representation(
+                    audio, sampling_rates, is_query=False)
+            with span('save_representations'):
+                self._save_representations(representations, filenames)
 
     def _build_audio_generator(self, audio_filenames):
+        # Decode and resample audio in a pool of worker processes while the
+        # model constructs representations in this one
+        tasks = [
+            (os.path.join(self.dataset_directory, f),
+             self.model.dataset_sampling_rate)
+            for f in audio_filenames]
+        if self.build_num_workers and self.build_num_workers > 1:
+            pool = Pool(self.build_num_workers)
+            decoded = pool.imap(_load_audio, tasks, chunksize=4)
+        else:
+            pool = None
+            decoded = map(_load_audio, tasks)
+
         audio_list = []
         sampling_rates = []
         filenames = []
-        for filename in audio_filenames:
-            try:
-                # read the file in as an audio file
-                filepath = os.path.join(self.dataset_directory, filename)
-                audio, sampling_rate = librosa.load(filepath, sr=None)
+        try:
+            for filename, (audio, sampling_rate) in zip(
+                    audio_filenames, decoded):
+                if audio is None:
+                    # either non-audio file or bad audioread setup
+                    self.logger.warning('The file {} could not be decoded by \
+                        any backend. Either no backends are available or each \
+                        available backend failed to decode the \
+                        file'.format(filename))
+                    continue
+
                 audio_list.append(audio)
                 sampling_rates.append(sampling_rate)
                 filenames.append(filename)
-            except NoBackendError:
-                # either non-audio file or bad audioread setup
-                self.logger.warning('The file {} could not be decoded by any \
-                    backend. Either no backends are available or each \
-                    available backend failed to decode the \
-                    file'.format(filename))
-                continue
-
-            # If we've successfully read a batch, yield the batch
-            batch_size = self.measure_similarity_batch_size
-            if batch_size and len(audio) == batch_size:
+
+                # If we've successfully read a batch, yield the batch
+                batch_size = self.measure_similarity_batch_size
+                if batch_size and len(audio_list) == batch_size:
+                    yield audio_list, sampling_rates, filenames
+                    audio_list = []
+                    sampling_rates = []
+                    filenames = []
+
+            if filenames:
                 yield audio_list, sampling_rates, filenames
-                audio_list = []
-                sampling_rates = []
-                filenames = []
+        finally:
+            if pool:
+                pool.terminate()
+
+    def _build_index(self):
+        '''
+        Builds the approximate nearest-neighbour index over the saved
+        representations.
+        '''
+        if not len(self.store):
+            return
+        self.logger.info('Building the nearest-neighbour index')
+        with span('build_index'):
+            self.index.build(self.store.load_matrix(self.store.keys()))
+
+    def _build_text_index(self):
+        '''
+        Builds the inverted index over the text features of the dataset.
+        '''
+        self.logger.info('Building the text index')
+        handles = self._get_representation_handles()
+        self.text_index.build(
+            handles, [self.handle_to_text_features(h) for h in handles])
+
+    def _candidate_handles(self, query, handles):
+        '''
+        Retrieves the handles of the representations that the nearest-neighbour
+        index considers close to the query.
 
-        yield audio_list, sampling_rates, filenames
+        Arguments:
+            query: A numpy array. The audio representation of the user's query.
+            handles: A python list. The representation handles of the dataset.
+
+        Returns:
+            A python list of handles, in the order they are stored.
+        '''
+        if self._handles_by_row is None:
+            # Map each stored representation back to its handle
+            filenames = {self.handle_to_filename(h): h for h in handles}
+            self._handles_by_row = [filenames.get(k) for k in self.store.keys()]
+
+        rows = self.index.search(np.array(query))
+        candidates = [self._handles_by_row[r] for r in rows]
+        return [h for h in candidates if h is not None]
 
     def _dataset_directory_empty(self):
         # Build the dataset directory if it does not exist
@@ -244,26 +514,6 @@ class QueryByVoiceDataset(ABC):
         except OSError:
             return False
 
-    def _dataset_directory_was_updated(self):
-        # Timestamp of representation directory
-        timestamp = os.path.getmtime(self.representation_directory)
-
-        # Has any file been updated?
-        files = self._get_audio_filenames()
-        files = [os.path.join(self.dataset_directory, file) for file in files]
-        file_was_updated = any([
-            timestamp < os.path.getmtime(file) for file in files])
-
-        # Has the directory itself been updated?
-        directory_was_updated = (
-            timestamp < os.path.getmtime(self.dataset_directory))
-
-        result = file_was_updated or directory_was_updated
-
-        if result:
-            self.logger.info('Found updated dataset directory.')
-        return result
-
     def _linear_data_generator(self, query, text_handler, require_text_match):
         '''
         Provides a generator that iterates linearly through all points in the
@@ -273,7 +523,8 @@ class QueryByVoiceDataset(ABC):
                 construct_representation_batch_size. The chunks of the query to
                 be compared with batch_representations. This may be windowed
                 chunks of the query in the case that self.generate_pairs is
-                True.
+                True. If the model broadcasts the query, this is the single
+                query representation.
             batch_representations: A numpy array of length
                 construct_representation_batch_size. The chunks of
                 representations to be compared to batch_query. This may be
@@ -295,9 +546,22 @@ class QueryByVoiceDataset(ABC):
         '''
         handles = self._get_representation_handles()
 
+        # Reduce the set of representation handles to the nearest neighbours of
+        # the query, which are then ranked exactly by the model
+        if self.index:
+            handles = self._candidate_handles(query, handles)
+
         # Reduce the set of representation handles to only those with file
         # text data matching the user's text query
         if require_text_match:
+            # Only check the handles the text index could not rule out
+            candidates = text_handler.candidate_handles(self.text_index)
+            if candidates is not None:
+                if self.index:
+                    candidates = set(candidates)
+                    handles = [h for h in handles if h in candidates]
+                else:
+                    handles = candidates
             handles = [h for h in handles if text_handler.is_match(
                 [self.handle_to_text_features(h)])]
 
@@ -311,19 +575,26 @@ class QueryByVoiceDataset(ABC):
         end = len(handles)
         while start < end:
             batch_handles = handles[start:min(start+max_batch_size, end)]
-            representations = self._load_representations(batch_handles)
 
             # Handle pairwise comparisons
             if self.model.uses_windowing:
+                representations = self._load_representations(batch_handles)
                 for batch in self._pairwise_batch_generator(
                     query, representations, batch_handles):
                     yield batch
             else:
-                batch_query = np.repeat(
-                    np.array(query), len(representations), axis=0)
+                representations = self._load_representation_matrix(
+                    batch_handles)
+                # Models that broadcast the query score it against the whole
+                # batch at once, so it is not repeated per item
+                if self.model.broadcasts_query:
+                    batch_query = np.array(query)
+                else:
+                    batch_query = np.repeat(
+                        np.array(query), len(representations), axis=0)
                 batch_size = min(len(representations), max_batch_size)
                 file_tracker = {i : batch_handles[i] for i in range(batch_size)}
-                yield batch_query, np.array(representations), file_tracker
+                yield batch_query, representations, file_tracker
 
             start += max_batch_size
 
@@ -338,11 +609,19 @@ class QueryByVoiceDataset(ABC):
         '''
         pass
 
+    def _model_signature(self):
+        # Identifies the model and the version of its weights
+        signature = type(self.model).__name__
+        if os.path.isfile(self.model.model_filepath):
+            signature += '@{}'.format(
+                os.path.getmtime(self.model.model_filepath))
+        return signature
+
     def _model_was_updated(self):
         result = (os.path.getmtime(self.representation_directory) <
                   os.path.getmtime(self.model.model_filepath))
         if result:
-            logger.info('Found updated model weights.')
+            self.logger.info('Found updated model weights.')
         return result
 
     def _pairwise_batch_generator(self, query, representations, handles):
@@ -360,48 +639,76 @@ class QueryByVoiceDataset(ABC):
         Returns:
             A python generator.
         '''
-        batch_size = self.construct_representation_batch_size
+        query = np.asarray(query)
         num_query_windows = len(query)
 
-        batch_representations = []
-        batch_query = []
-        file_tracker = {}
-        index = 0
-        for representation, handle in zip(representations, handles):
-            num_representation_windows = len(representation)
-            num_pairs = num_query_windows * num_representation_windows
-
-            # Cartesian product of query and representation windows
-            # TODO: use views to reduce memory storage
-            for i in range(num_representation_windows):
-                for j in range (num_query_windows):
-                    batch_representations.append(representation[i])
-                    batch_query.append(query[j])
-
-            # All above pairs belong to one representation. Mark the start point
-            # of that representation in the batch.
-            file_tracker[index] = handle
-            index += num_pairs
-
-            if batch_size and index >= batch_size:
-                yield (
-                   np.array(batch_query[:batch_size]),
-                   np.array(batch_representations[:batch_size]),
-                   file_tracker)
-
-                # If we have more than batch_size pairs, yield the others on the
-                # next batch
-                batch_query = batch_query[batch_size:]
-                batch_representations = batch_representations[batch_size:]
-                file_tracker = {} if index == batch_size else {0 : filename}
-                index -= batch_size
-
-        # Yield the last batch, or all pairs if batch_size == None
-        if index != 0:
-            yield (
-                np.array(batch_query),
-                np.array(batch_representations),
-                file_tracker)
+        # Pair p compares window p // num_query_windows of the concatenated
+        # representations with query window p % num_query_windows. Each batch
+        # gathers only its own windows from the representations, which are
+        # views into the representation store.
+        window_starts = np.concatenate(
+            ([0], np.cumsum([len(r) for r in representations]))).astype(int)
+        starts = window_starts[:-1] * num_query_windows
+
+        num_pairs = window_starts[-1] * num_query_windows
+        batch_size = self.construct_representation_batch_size or num_pairs
+
+        for start in range(0, num_pairs, batch_size):
+            end = min(start + batch_size, num_pairs)
+            first_window = start // num_query_windows
+            windows = self._gather_windows(
+                representations,
+                window_starts,
+                first_window,
+                (end - 1) // num_query_windows + 1)
+
+            if num_query_windows == 1:
+                # Each window is paired with the only query window, so the
+                # batch is the gathered windows and a view of the query
+                batch_representations = windows
+                batch_query = np.broadcast_to(
+                    query, (end - start,) + query.shape[1:])
+            else:
+                window_index, query_index = np.divmod(
+                    np.arange(start, end), num_query_windows)
+                batch_representations = windows[window_index - first_window]
+                batch_query = query[query_index]
+
+            # Mark the start point of each representation in the batch. A
+            # representation continuing from the previous batch starts at 0.
+            file_tracker = {}
+            first = np.searchsorted(starts, start, side='right') - 1
+            last = np.searchsorted(starts, end, side='left')
+            for i in range(first, last):
+                file_tracker[max(starts[i] - start, 0)] = handles[i]
+
+            yield batch_query, batch_representations, file_tracker
+
+    def _gather_windows(self, representations, window_starts, start, end):
+        '''
+        Gathers a range of the windows of the concatenated representations.
+
+        Arguments:
+            representations: A python list. The windowed representations.
+            window_starts: A 1D numpy array. The index of the first window of
+                each representation in the concatenation, followed by the
+                total number of windows.
+            start: An int. The first window to gather.
+            end: An int. The window after the last window to gather.
+
+        Returns:
+            A numpy array. A view of the windows if they belong to one
+                representation, and a copy otherwise.
+        '''
+        first = np.searchsorted(window_starts, start, side='right') - 1
+        last = np.searchsorted(window_starts, end, side='left')
+        windows = [
+            representations[i][
+                max(start - window_starts[i], 0):end - window_starts[i]]
+            for i in range(first, last)]
+        if len(windows) == 1:
+            return windows[0]
+        return np.concatenate(windows)
 
     def _representation_directory_empty(self):
         try:
@@ -414,3 +721,24 @@ class QueryByVoiceDataset(ABC):
             if result:
                 self.logger.info('Found empty representation directory.')
             return result
+
+
+def _load_audio(task):
+    '''
+    Reads an audio file. Defined at module level so it can run in a worker
+    process.
+
+    Arguments:
+        task: A tuple of (string, int or None). The path to the audio file and
+            the sampling rate to resample to, or None to keep the original
+            sampling rate.
+
+    Returns:
+        A tuple of (1D numpy array, int), or (None, None) if the file could not
+            be decoded.
+    '''
+    filepath, sampling_rate = task
+    try:
+        return librosa.load(filepath, sr=sampling_rate)
+    except NoBackendError:
+        return None, None
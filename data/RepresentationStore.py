@@ -0,0 +1,682 @@
+import json
+import numpy as np
+import os
+import shutil
+import struct
+import threading
+
+
+# The size of the header of the .npy files of a store. Fixing it lets a
+# commit rewrite the shape in the header when it appends rows in place.
+NPY_HEADER_SIZE = 128
+
+
+class RepresentationStore(object):
+    '''
+    On-disk storage for the audio representations of a dataset. All
+    representations are kept in one contiguous .npy matrix, with an index file
+    mapping each key to its rows. The matrix is opened memory-mapped, so
+    loading the store does not read the corpus into memory and processes
+    serving the same dataset share one copy through the OS page cache.
+
+    Each representation occupies one row of the matrix if it is 1D, or one row
+    per element of its first axis (e.g., one row per window) otherwise. All
+    rows of a store must have the same shape.
+
+    Representations can be stored at reduced precision. A float16 store is
+    loaded as float16 views. An int8 store quantizes each row with its own
+    scale, kept in a separate float32 .npy file, and dequantizes rows as they
+    are loaded. Matrices requested as float32 are served from a float32 copy
+    of the store, converted once per process, which trades the memory saved
+    by reduced precision for not converting rows on every search.
+
+    A build in progress is recorded in a checkpoint file, whose first line
+    holds the type, model and row shape of the appended representations. An
+    interrupted build is resumed only if they match those of the store.
+
+    A committed store can be extended: new rows are appended to the matrix in
+    place, and the rows of dropped or replaced representations are left in it
+    unindexed until they exceed compaction_threshold of the matrix, at which
+    point it is rewritten without them.
+    '''
+
+    def __init__(self, directory, name='representations', dtype='float32',
+                 model=None, compaction_threshold=0.25):
+        '''
+        RepresentationStore constructor.
+
+        Arguments:
+            directory: A string. The directory containing the store files.
+            name: A string. The filename prefix of the store files.
+            dtype: A string or numpy dtype. The type representations are stored
+                as. Either a floating point type or int8.
+            model: A string or None. Identifies the model that constructs the
+                representations, so that an interrupted build is not resumed
+                with another model.
+            compaction_threshold: A float. The fraction of the rows of the
+                matrix that may belong to dropped or replaced representations
+                before a commit rewrites it without them.
+        '''
+        self.directory = directory
+        self.name = name
+        self.model = model
+        self.compaction_threshold = compaction_threshold
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind != 'f' and self.dtype != np.int8:
+            raise ValueError(
+                'Representations cannot be stored as {}'.format(self.dtype))
+        self.quantized = self.dtype == np.int8
+
+        self.matrix_filename = os.path.join(directory, name + '.npy')
+        self.index_filename = os.path.join(directory, name + '.json')
+        self.partial_filename = os.path.join(directory, name + '.partial')
+        self.checkpoint_filename = os.path.join(
+            directory, name + '.checkpoint')
+        self.scales_filename = os.path.join(directory, name + '_scales.npy')
+        self.partial_scales_filename = os.path.join(
+            directory, name + '_scales.partial')
+
+        self.matrix = None
+        self.scales = None
+        self._keys = []
+        self.offsets = None
+        self.shapes = []
+        self.positions = {}
+        self._float32_matrix = None
+        self._lock = threading.Lock()
+
+        self._writer = None
+
+    def __len__(self):
+        self._open()
+        return len(self._keys)
+
+    def __contains__(self, key):
+        self._open()
+        return key in self.positions
+
+    def exists(self):
+        '''
+        Returns True if a committed store is available on disk.
+        '''
+        return (os.path.isfile(self.matrix_filename) and
+                os.path.isfile(self.index_filename) and
+                (not self.quantized or os.path.isfile(self.scales_filename)))
+
+    def dtype_changed(self):
+        '''
+        Returns True if the committed store holds representations of another
+        type than the type of this store.
+        '''
+        index = self._read_index()
+        return np.dtype(index.get('dtype', 'float32')) != self.dtype
+
+    def interrupted(self):
+        '''
+        Returns True if representations were appended to the store but never
+        committed, e.g., because a build was interrupted.
+        '''
+        return (os.path.isfile(self.partial_filename) and
+                os.path.isfile(self.checkpoint_filename) and
+                (not self.quantized or
+                 os.path.isfile(self.partial_scales_filename)))
+
+    def resumable(self, extends=False):
+        '''
+        Returns True if the store was interrupted by a build of
+        representations of the same type and model as this store.
+
+        Arguments:
+            extends: A boolean. If True, the interrupted build must extend
+                the committed store, as started by extend. Otherwise it must
+                replace it.
+        '''
+        if not self.interrupted():
+            return False
+        header = self._checkpoint_header()
+        if (header is None or
+                header.get('dtype') != self.dtype.str or
+                header.get('model') != self.model):
+            return False
+        if header.get('base') is None:
+            return not extends
+        return (extends and self.exists() and
+                self._read_index()['offsets'][-1] == header['base'])
+
+    def keys(self):
+        '''
+        Returns the keys of all committed representations, in the order they
+        are stored.
+
+        Returns:
+            A python list.
+        '''
+        self._open()
+        return self._keys
+
+    def load(self, keys):
+        '''
+        Loads the representations with the given keys.
+
+        Arguments:
+            keys: A python list. The keys of the representations to load.
+
+        Returns:
+            A python list of numpy arrays, in the same order as keys. Unless
+                the store is quantized, the arrays are read-only views into
+                the memory-mapped matrix.
+        '''
+        self._open()
+        representations = []
+        for key in keys:
+            position = self.positions[key]
+            start = self.offsets[position]
+            end = self.offsets[position + 1]
+            representations.append(
+                self._rows(slice(start, end)).reshape(self.shapes[position]))
+        return representations
+
+    def load_matrix(self, keys, dtype=None):
+        '''
+        Loads the representations with the given keys as one matrix. Every
+        representation must occupy a single row. If the keys are stored
+        contiguously and in order, the result is a view into the matrix and
+        no data is copied, unless the store is quantized and dtype is None.
+
+        Arguments:
+            keys: A python list. The keys of the representations to load.
+            dtype: A string, numpy dtype or None. If float32, the rows are
+                loaded from the float32 copy of the store, as returned by
+                float32_matrix. If None, they have the type of the store.
+
+        Returns:
+            A numpy array of shape (len(keys),) + row shape.
+        '''
+        self._open()
+        load_rows = self._rows
+        if dtype is not None and np.dtype(dtype) == np.float32:
+            load_rows = self.float32_matrix().__getitem__
+
+        rows = self.rows(keys)
+        if len(rows) and np.all(
+                self.offsets[rows + 1] - self.offsets[rows] == 1):
+            starts = self.offsets[rows]
+            if np.all(np.diff(starts) == 1):
+                return load_rows(slice(starts[0], starts[-1] + 1))
+            return load_rows(starts)
+        return np.array(self.load(keys), dtype=dtype)
+
+    def float32_matrix(self):
+        '''
+        Returns all rows of the store as float32. A float32 store returns its
+        memory-mapped matrix. Other stores are converted on the first call and
+        the converted matrix is kept in memory until the store is next
+        committed.
+
+        Returns:
+            A numpy array of shape (number of rows,) + row shape.
+        '''
+        self._open()
+        if self.dtype == np.float32:
+            return self.matrix
+        with self._lock:
+            if self._float32_matrix is None:
+                self._float32_matrix = np.asarray(
+                    self._rows(slice(None)), dtype='float32')
+            return self._float32_matrix
+
+    def rows(self, keys):
+        '''
+        Returns the positions of the given keys within the store.
+
+        Arguments:
+            keys: A python list. The keys to look up.
+
+        Returns:
+            A 1D numpy array of ints.
+        '''
+        self._open()
+        return np.array([self.positions[k] for k in keys], dtype='int64')
+
+    def append(self, keys, representations):
+        '''
+        Adds representations to the store. Appended representations become
+        visible to load only after commit is called.
+
+        Arguments:
+            keys: A python list. The keys of the representations.
+            representations: A python list. The representations to save, in
+                the same order as keys.
+        '''
+        if self._writer is None:
+            self._begin()
+
+        num_saved = len(self._writer['keys'])
+        for key, representation in zip(keys, representations):
+            if self.quantized:
+                representation = np.asarray(representation, dtype='float32')
+                rows, scales = self._quantize(self._as_rows(representation))
+                self._writer['scales'].write(scales.tobytes())
+            else:
+                representation = np.asarray(representation, dtype=self.dtype)
+                rows = self._as_rows(representation)
+
+            row_shape = list(rows.shape[1:])
+            if self._writer['row_shape'] is None:
+                self._writer['row_shape'] = row_shape
+                self._write_checkpoint_header()
+            elif self._writer['row_shape'] != row_shape:
+                raise ValueError(
+                    'Representation of {} has row shape {}, expected {}'.format(
+                        key, row_shape, self._writer['row_shape']))
+
+            self._writer['file'].write(np.ascontiguousarray(rows).tobytes())
+            self._writer['keys'].append(key)
+            self._writer['shapes'].append(list(representation.shape))
+            self._writer['offsets'].append(
+                self._writer['offsets'][-1] + len(rows))
+
+        # Record the appended representations once their rows are on disk, so
+        # an interrupted build can be resumed
+        self._writer['file'].flush()
+        if self.quantized:
+            self._writer['scales'].flush()
+        for key, shape in zip(
+                self._writer['keys'][num_saved:],
+                self._writer['shapes'][num_saved:]):
+            self._writer['checkpoint'].write(json.dumps([key, shape]) + '\n')
+        self._writer['checkpoint'].flush()
+
+    def drop(self, keys):
+        '''
+        Removes appended representations from the pending write, e.g.,
+        because their audio changed while a build was interrupted. If the
+        write extends the committed store, committed representations with the
+        given keys are removed when it is committed. Their rows stay in the
+        matrix but are no longer indexed.
+
+        Arguments:
+            keys: A python list. The keys of the representations to remove.
+        '''
+        if self._writer is None:
+            self._begin()
+
+        keys = set(keys)
+        dropped = set()
+        for position, key in enumerate(self._writer['keys']):
+            if key in keys:
+                self._writer['keys'][position] = None
+                dropped.add(key)
+        if self._writer['base'] is not None:
+            removed = keys.intersection(self._writer['base']['keys'])
+            self._writer['removed'].update(removed)
+            dropped.update(removed)
+
+        for key in sorted(dropped):
+            self._writer['checkpoint'].write(json.dumps([key, None]) + '\n')
+        self._writer['checkpoint'].flush()
+
+    def copy(self, keys, batch_size=1024):
+        '''
+        Appends committed representations to the pending write, so that they
+        are kept when the store is next committed.
+
+        Arguments:
+            keys: A python list. The keys of the committed representations to
+                keep.
+            batch_size: An int. The number of representations copied at once.
+        '''
+        for start in range(0, len(keys), batch_size):
+            batch_keys = keys[start:start + batch_size]
+            self.append(batch_keys, self.load(batch_keys))
+
+    def resume(self):
+        '''
+        Continues the write of an interrupted build. Representations appended
+        before the interruption are kept and later appends are added after
+        them. If the interrupted build is not resumable, e.g., because it
+        stored another type or used another model, it is discarded and a new
+        write begins.
+
+        Returns:
+            A python set. The keys of the representations already appended.
+        '''
+        if self._writer is None:
+            self._begin(resume=self.resumable())
+        return set(self._writer['keys']) - {None}
+
+    def extend(self):
+        '''
+        Begins a write that adds to the committed store instead of replacing
+        it. Representations appended with the key of a committed one replace
+        it. If an interrupted write extended the same committed store, it is
+        resumed.
+
+        Returns:
+            A python set. The keys of the representations already appended.
+        '''
+        if self._writer is None:
+            if self.resumable(extends=True):
+                self._begin(resume=True)
+            elif self.exists() and self._read_index()['offsets'][-1]:
+                # Stores committed with a shorter header are rewritten once
+                self._close()
+                self._pad_header(self.matrix_filename, self.dtype)
+                if self.quantized:
+                    self._pad_header(self.scales_filename, np.float32)
+                self._begin(extend=True)
+            else:
+                # There are no committed rows to keep
+                self._begin()
+        return set(self._writer['keys']) - {None}
+
+    def commit(self):
+        '''
+        Writes all appended representations to the .npy matrix and index file.
+        If the write extends the committed store, the rows are appended to the
+        matrix in place. Otherwise they replace the committed store.
+        '''
+        if self._writer is None:
+            self._begin()
+
+        writer = self._writer
+        self._writer = None
+        writer['file'].close()
+        writer['checkpoint'].close()
+        if self.quantized:
+            writer['scales'].close()
+
+        row_shape = tuple(writer['row_shape'] or [0])
+        num_rows = writer['offsets'][-1]
+
+        # Release the previous mapping before its files are modified
+        self._close()
+
+        base = writer['base']
+        if base is None:
+            keys = writer['keys']
+            offsets = writer['offsets']
+            shapes = writer['shapes']
+            self._write_array(
+                self.matrix_filename, self.partial_filename, self.dtype,
+                (num_rows,) + row_shape)
+            if self.quantized:
+                self._write_array(
+                    self.scales_filename, self.partial_scales_filename,
+                    np.float32, (num_rows,))
+        else:
+            # Unindex the committed representations that were dropped or
+            # appended again
+            base_rows = base['offsets'][-1]
+            replaced = writer['removed'].union(writer['keys'])
+            keys = [None if k in replaced else k for k in base['keys']]
+            keys += writer['keys']
+            offsets = base['offsets'] + [
+                base_rows + o for o in writer['offsets'][1:]]
+            shapes = base['shapes'] + writer['shapes']
+            self._extend_array(
+                self.matrix_filename, self.partial_filename, self.dtype,
+                (base_rows + num_rows,) + row_shape, base_rows)
+            if self.quantized:
+                self._extend_array(
+                    self.scales_filename, self.partial_scales_filename,
+                    np.float32, (base_rows + num_rows,), base_rows)
+
+        index = {
+            'keys': keys,
+            'offsets': offsets,
+            'shapes': shapes,
+            'dtype': self.dtype.str
+        }
+        temporary_filename = self.index_filename + '.tmp'
+        with open(temporary_filename, 'w') as file:
+            json.dump(index, file)
+        os.replace(temporary_filename, self.index_filename)
+
+        # The write is complete once the index is replaced. Until then, an
+        # interrupted commit is resumed from the checkpoint.
+        os.remove(self.partial_filename)
+        os.remove(self.checkpoint_filename)
+        if self.quantized:
+            os.remove(self.partial_scales_filename)
+
+        # Rewrite the matrix once too many of its rows are unindexed
+        live_rows = sum(
+            offsets[i + 1] - offsets[i]
+            for (i, k) in enumerate(keys) if k is not None)
+        if offsets[-1] - live_rows > self.compaction_threshold * offsets[-1]:
+            self.copy(self.keys())
+            self.commit()
+
+    def _as_rows(self, representation):
+        if representation.ndim < 2:
+            return representation.reshape((1,) + representation.shape)
+        return representation
+
+    def _quantize(self, rows):
+        # Scale each row so that its largest magnitude maps to 127
+        flat = rows.reshape(len(rows), -1)
+        scales = np.max(np.abs(flat), axis=1) / 127
+        scales[scales == 0] = 1
+        quantized = np.clip(np.round(flat / scales[:, np.newaxis]), -127, 127)
+        return (quantized.astype(self.dtype).reshape(rows.shape),
+                scales.astype('float32'))
+
+    def _rows(self, selection):
+        # The rows at a slice or index array, dequantized if needed
+        rows = self.matrix[selection]
+        if not self.quantized:
+            return rows
+        scales = self.scales[selection]
+        return rows * scales.reshape(scales.shape + (1,) * (rows.ndim - 1))
+
+    def _row_layout(self, shape):
+        # The number of rows and row shape of a representation, as in _as_rows
+        if len(shape) < 2:
+            return 1, list(shape)
+        return shape[0], list(shape[1:])
+
+    def _begin(self, resume=False, extend=False):
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            pass
+
+        self._writer = {
+            'keys': [],
+            'offsets': [0],
+            'shapes': [],
+            'row_shape': None,
+            # The committed index, if the write extends the committed store
+            'base': None,
+            'removed': set()
+        }
+
+        if resume:
+            header = self._checkpoint_header()
+            extend = header['base'] is not None
+        if extend:
+            self._writer['base'] = self._read_index()
+            self._writer['row_shape'] = list(
+                self._read_array_header(self.matrix_filename)[0][1:])
+
+        if not resume:
+            self._writer['file'] = open(self.partial_filename, 'wb')
+            self._writer['checkpoint'] = open(self.checkpoint_filename, 'w')
+            if self.quantized:
+                self._writer['scales'] = open(
+                    self.partial_scales_filename, 'wb')
+            if extend:
+                self._write_checkpoint_header()
+            return
+
+        # Replay the checkpoint. A partially written last line belongs to
+        # rows that were not fully recorded and is discarded.
+        with open(self.checkpoint_filename, 'r') as file:
+            lines = file.readlines()
+        self._writer['row_shape'] = header['row_shape']
+        positions = {}
+        for line in lines[1:]:
+            try:
+                key, shape = json.loads(line)
+            except ValueError:
+                break
+            if shape is None:
+                # A dropped representation
+                if key in positions:
+                    self._writer['keys'][positions.pop(key)] = None
+                if extend:
+                    self._writer['removed'].add(key)
+                continue
+            if key is not None:
+                positions[key] = len(self._writer['keys'])
+            num_rows, row_shape = self._row_layout(shape)
+            if row_shape != self._writer['row_shape']:
+                break
+            self._writer['keys'].append(key)
+            self._writer['shapes'].append(shape)
+            self._writer['offsets'].append(
+                self._writer['offsets'][-1] + num_rows)
+
+        # Drop rows written after the last checkpoint
+        row_size = self.dtype.itemsize * int(
+            np.prod(self._writer['row_shape'] or [0]))
+        self._writer['file'] = open(self.partial_filename, 'r+b')
+        self._writer['file'].truncate(self._writer['offsets'][-1] * row_size)
+        self._writer['file'].seek(0, os.SEEK_END)
+
+        if self.quantized:
+            self._writer['scales'] = open(self.partial_scales_filename, 'r+b')
+            self._writer['scales'].truncate(self._writer['offsets'][-1] * 4)
+            self._writer['scales'].seek(0, os.SEEK_END)
+
+        self._writer['checkpoint'] = open(self.checkpoint_filename, 'w')
+        self._write_checkpoint_header()
+        for key, shape in zip(self._writer['keys'], self._writer['shapes']):
+            self._writer['checkpoint'].write(json.dumps([key, shape]) + '\n')
+        for key in sorted(self._writer['removed']):
+            self._writer['checkpoint'].write(json.dumps([key, None]) + '\n')
+        self._writer['checkpoint'].flush()
+
+    def _checkpoint_header(self):
+        # The header of the checkpoint, or None if it is missing or corrupt
+        with open(self.checkpoint_filename, 'r') as file:
+            line = file.readline()
+        try:
+            header = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(header, dict) or 'row_shape' not in header:
+            return None
+        return header
+
+    def _write_checkpoint_header(self):
+        base = self._writer['base']
+        header = {
+            'dtype': self.dtype.str,
+            'model': self.model,
+            'row_shape': self._writer['row_shape'],
+            # The number of committed rows an extending write adds to
+            'base': base['offsets'][-1] if base is not None else None
+        }
+        self._writer['checkpoint'].write(json.dumps(header) + '\n')
+
+    def _read_index(self):
+        with open(self.index_filename, 'r') as file:
+            return json.load(file)
+
+    def _npy_header(self, dtype, shape):
+        # A .npy version 1.0 header padded to NPY_HEADER_SIZE bytes
+        magic = np.lib.format.magic(1, 0)
+        header = repr({
+            'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            'fortran_order': False,
+            'shape': tuple(shape)
+        })
+        length = NPY_HEADER_SIZE - len(magic) - 2
+        return (magic + struct.pack('<H', length) +
+                header.ljust(length - 1).encode('latin1') + b'\n')
+
+    def _read_array_header(self, filename):
+        # The shape and the size of the header of a .npy file
+        with open(filename, 'rb') as file:
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape = np.lib.format.read_array_header_1_0(file)[0]
+            else:
+                shape = np.lib.format.read_array_header_2_0(file)[0]
+            return shape, file.tell()
+
+    def _write_array(self, filename, source_filename, dtype, shape,
+                     source_offset=0):
+        # Prepend the .npy header to the raw rows of the source file and
+        # atomically replace the .npy file
+        temporary_filename = filename + '.tmp'
+        with open(temporary_filename, 'wb') as output:
+            output.write(self._npy_header(dtype, shape))
+            with open(source_filename, 'rb') as rows:
+                rows.seek(source_offset)
+                shutil.copyfileobj(rows, output, 16 * 1024 * 1024)
+        os.replace(temporary_filename, filename)
+
+    def _extend_array(self, filename, source_filename, dtype, shape,
+                      num_rows):
+        # Append the raw rows of the source file to the first num_rows rows
+        # of the .npy file, then write its new shape. Rows left after them by
+        # an interrupted commit are overwritten. Processes mapping the file
+        # keep reading the rows of their index, which do not move.
+        row_size = np.dtype(dtype).itemsize * int(np.prod(shape[1:]))
+        with open(filename, 'r+b') as output:
+            output.truncate(NPY_HEADER_SIZE + num_rows * row_size)
+            output.seek(0, os.SEEK_END)
+            with open(source_filename, 'rb') as rows:
+                shutil.copyfileobj(rows, output, 16 * 1024 * 1024)
+            output.flush()
+            output.seek(0)
+            output.write(self._npy_header(dtype, shape))
+
+    def _pad_header(self, filename, dtype):
+        # Rewrite a .npy file whose header does not have NPY_HEADER_SIZE bytes
+        shape, header_size = self._read_array_header(filename)
+        if header_size != NPY_HEADER_SIZE:
+            self._write_array(filename, filename, dtype, shape, header_size)
+
+    def _close(self):
+        with self._lock:
+            self.matrix = None
+            self.scales = None
+            self._float32_matrix = None
+            self._keys = []
+            self.offsets = None
+            self.shapes = []
+            self.positions = {}
+
+    def _open(self):
+        if self.matrix is not None:
+            return
+
+        with self._lock:
+            if self.matrix is not None:
+                return
+
+            index = self._read_index()
+
+            # Load everything before publishing it, so that a thread that
+            # sees the matrix also sees the index of its rows
+            matrix = np.load(self.matrix_filename, mmap_mode='r')
+            scales = None
+            if self.quantized:
+                scales = np.load(self.scales_filename, mmap_mode='r')
+            # Dropped representations are recorded with a null key
+            keys = [k for k in index['keys'] if k is not None]
+            offsets = np.array(index['offsets'], dtype='int64')
+            shapes = [tuple(s) for s in index['shapes']]
+            positions = {
+                k: i for (i, k) in enumerate(index['keys']) if k is not None}
+
+            self.scales = scales
+            self._keys = keys
+            self.offsets = offsets
+            self.shapes = shapes
+            self.positions = positions
+            self.matrix = matrix
@@ -1,6 +1,5 @@
 import numpy as np
 import os
-import pickle
 from data.QueryByVoiceDataset import QueryByVoiceDataset
 
 class TestDataset(QueryByVoiceDataset):
@@ -13,7 +12,11 @@ class TestDataset(QueryByVoiceDataset):
                  representation_directory,
                  model,
                  measure_similarity_batch_size=None,
-                 construct_representation_batch_size=None):
+                 construct_representation_batch_size=None,
+                 ann_num_lists=None,
+                 ann_num_probes=None,
+                 build_num_workers=None,
+                 representation_dtype='float32'):
         '''
         TestDataset constructor.
 
@@ -31,17 +34,28 @@ class TestDataset(QueryByVoiceDataset):
             construct_representation_batch_size: An integer or None. The maximum
                 number of audio files to load during one batch of representation
                 construction.
+            ann_num_lists: An integer or None. The number of clusters of the
+                approximate nearest-neighbour index used to search models that
+                do not use windowing. If None, every query scans the full
+                dataset.
+            ann_num_probes: An integer or None. The number of index clusters
+                searched per query. Higher values trade latency for recall.
+            build_num_workers: An integer or None. The number of processes
+                decoding and resampling audio during representation
+                construction. If None, audio is decoded in this process.
+            representation_dtype: A string. The type representations are
+                stored as: float32, float16, or int8 with a scale per row.
         '''
-        self.binary_filename = os.path.join(
-            representation_directory, 'test_dataset.pickle')
-        self.data_dict = None
-
         super(TestDataset, self).__init__(
             dataset_directory,
             representation_directory,
             model,
             measure_similarity_batch_size,
-            construct_representation_batch_size)
+            construct_representation_batch_size,
+            ann_num_lists,
+            ann_num_probes,
+            build_num_workers,
+            representation_dtype)
 
     def data_generator(self, query, text_handler, require_text_match):
         '''
@@ -151,10 +165,8 @@ class TestDataset(QueryByVoiceDataset):
             A python list. Representations should be in the same order as the
                 handles
         '''
-        if not self.data_dict:
-            with open(self.binary_filename, 'rb') as file:
-                self.data_dict = pickle.load(file)
-        return [self.data_dict[handle] for handle in handles]
+        filenames = [self.handle_to_filename(h) for h in handles]
+        return self.store.load(filenames)
 
     def _save_representations(self, representations, filenames):
         '''
@@ -168,6 +180,4 @@ class TestDataset(QueryByVoiceDataset):
                     representations[i] is the audio representation of
                     filenames[i]).
         '''
-        self.data_dict = {f: r for (f, r) in zip(filenames, representations)}
-        with open(self.binary_filename, 'wb') as file:
-            pickle.dump(self.data_dict, file)
+        self.store.append(filenames, representations)
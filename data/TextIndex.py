@@ -0,0 +1,106 @@
+import json
+import numpy as np
+import os
+
+
+class TextIndex(object):
+    '''
+    An inverted index from the character n-grams of the text features of a
+    dataset to the representation handles containing them. Every handle whose
+    text contains the query text as a substring contains all of its n-grams,
+    so intersecting their posting lists gives a small superset of the matching
+    handles without a pass over the whole dataset.
+    '''
+
+    def __init__(self, directory, name='text_index', n=3):
+        '''
+        TextIndex constructor.
+
+        Arguments:
+            directory: A string. The directory containing the index file.
+            name: A string. The filename prefix of the index file.
+            n: An int. The length of the indexed n-grams.
+        '''
+        self.filename = os.path.join(directory, name + '.json')
+        self.n = n
+
+        self.handles = None
+        self.postings = None
+
+    def exists(self):
+        '''
+        Returns True if a built index is available on disk.
+        '''
+        return os.path.isfile(self.filename)
+
+    def build(self, handles, texts):
+        '''
+        Indexes the text features of a dataset and saves the index to disk.
+
+        Arguments:
+            handles: A python list. The representation handles of the dataset.
+            texts: A python list of strings. The text features of each handle,
+                in the same order as handles.
+        '''
+        postings = {}
+        for position, text in enumerate(texts):
+            for gram in self._grams(text.lower()):
+                postings.setdefault(gram, []).append(position)
+
+        temporary_filename = self.filename + '.tmp'
+        with open(temporary_filename, 'w') as file:
+            json.dump({
+                'n': self.n,
+                'handles': list(handles),
+                'postings': postings
+            }, file)
+        os.replace(temporary_filename, self.filename)
+
+        self.handles = None
+        self.postings = None
+
+    def search(self, query_text):
+        '''
+        Retrieves the handles whose text may contain the query text.
+
+        Arguments:
+            query_text: A string. The text the handles must contain.
+
+        Returns:
+            A python list of handles, in the order they were indexed. Queries
+                shorter than n cannot be looked up and return all handles.
+        '''
+        if self.postings is None:
+            self.load()
+
+        if len(query_text) < self.n:
+            return list(self.handles)
+        grams = self._grams(query_text.lower())
+
+        # Intersect the posting lists, shortest first
+        lists = sorted(
+            (self.postings.get(g, self._empty) for g in grams), key=len)
+        positions = lists[0]
+        for other in lists[1:]:
+            if not len(positions):
+                break
+            positions = np.intersect1d(positions, other, assume_unique=True)
+
+        return [self.handles[p] for p in positions]
+
+    def _grams(self, text):
+        # The distinct n-grams of text
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def load(self):
+        '''
+        Loads the index from disk.
+        '''
+        with open(self.filename, 'r') as file:
+            index = json.load(file)
+
+        self.n = index['n']
+        self.handles = index['handles']
+        self.postings = {
+            g: np.array(p, dtype='int64') for g, p in index['postings'].items()}
+        self._empty = np.array([], dtype='int64')
@@ -1,15 +1,18 @@
 import os
 from model.MCFT import MCFT
 from model.SiameseStyle import SiameseStyle
+from model.QuantizedVGGishEmbedding import QuantizedVGGishEmbedding
 from model.VGGishEmbedding import VGGishEmbedding
 from data.TestDataset import TestDataset
 from data.OtoMobile import OtoMobile
 from log import get_logger
+from query_cache import QueryCache
+from voogle import Voogle
 
 logger = get_logger('factory')
 
 
-def model_factory(model_name, model_filepath):
+def model_factory(model_name, model_filepath, trace_model=False):
     '''
     Given a model name and weight file location, construct the model for
     query-by-voice search.
@@ -17,6 +20,8 @@ def model_factory(model_name, model_filepath):
     Arguments:
         model_name: A string. The name of the model.
         model_filepath: A string. The location of the weight file on disk.
+        trace_model: A boolean. If True, models that support it are compiled
+            with TorchScript tracing.
 
     Returns:
         A QueryByVoiceModel.
@@ -29,7 +34,9 @@ def model_factory(model_name, model_filepath):
     elif model_name == 'siamese-style':
         model = SiameseStyle(model_filepath)
     elif model_name == 'VGGish-embedding':
-        model = VGGishEmbedding(model_filepath)
+        model = VGGishEmbedding(model_filepath, trace=trace_model)
+    elif model_name == 'VGGish-embedding-int8':
+        model = QuantizedVGGishEmbedding(model_filepath, trace=trace_model)
     else:
         raise ValueError('Model {} is not defined'.format(model_name))
 
@@ -43,7 +50,11 @@ def dataset_factory(
     representation_directory,
     construct_representation_batch_size,
     measure_similarity_batch_size,
-    model):
+    model,
+    ann_num_lists=None,
+    ann_num_probes=None,
+    build_num_workers=None,
+    representation_dtype='float32'):
     '''
     Constructs a dataset object for query-by-voice search.
 
@@ -59,6 +70,15 @@ def dataset_factory(
             representations to load during one batch of model inference.
         model: A QueryByVoiceModel. The model being used in the query-by-voice
             system. Defines the audio representation.
+        ann_num_lists: An integer or None. The number of clusters of the
+            approximate nearest-neighbour index. If None, every query scans the
+            full dataset.
+        ann_num_probes: An integer or None. The number of index clusters
+            searched per query.
+        build_num_workers: An integer or None. The number of processes
+            decoding audio during representation construction.
+        representation_dtype: A string. The type representations are stored
+            as: float32, float16 or int8.
 
     Returns:
         A Dataset object.
@@ -73,17 +93,93 @@ def dataset_factory(
             representation_directory,
             model,
             measure_similarity_batch_size,
-            construct_representation_batch_size)
+            construct_representation_batch_size,
+            ann_num_lists,
+            ann_num_probes,
+            build_num_workers,
+            representation_dtype)
     elif dataset_name == 'otomobile':
         dataset = OtoMobile(
             dataset_directory,
             representation_directory,
             model,
             measure_similarity_batch_size,
-            construct_representation_batch_size)
+            construct_representation_batch_size,
+            ann_num_lists,
+            ann_num_probes,
+            build_num_workers,
+            representation_dtype)
     else:
         raise ValueError('Dataset {} is not defined'.format(dataset_name))
 
     logger.debug('Dataset construction complete.')
 
     return dataset
+
+
+def voogle_factory(
+    config, parent_directory, model_name=None, representation_dtype=None):
+    '''
+    Constructs the model, dataset and query-by-voice system described by a
+    config file.
+
+    Arguments:
+        config: A dict. The contents of the .yaml config file.
+        parent_directory: A string. The root directory of the repository.
+        model_name: A string or None. Overrides the model_name of the config.
+        representation_dtype: A string or None. Overrides the
+            representation_dtype of the config.
+
+    Returns:
+        A Voogle object.
+    '''
+    model_name = model_name or config.get('model_name')
+    representation_dtype = (
+        representation_dtype or config.get('representation_dtype') or
+        'float32')
+    dataset_directory = os.path.join(
+        parent_directory, 'data', 'audio', config.get('dataset_name'))
+
+    # Setup the model
+    model_filepath = os.path.join(
+        parent_directory, 'model', 'weights', config.get('model_filepath'))
+    model = model_factory(
+        model_name,
+        os.path.abspath(model_filepath),
+        config.get('trace_model', False))
+
+    # Setup the dataset. Reduced-precision representations are kept apart from
+    # the float32 ones, so both can be compared.
+    representation_name = model_name
+    if representation_dtype != 'float32':
+        representation_name += '-' + representation_dtype
+    representation_directory = os.path.join(
+        parent_directory,
+        'data',
+        config.get('representation_directory'),
+        config.get('dataset_name'),
+        representation_name)
+    dataset = dataset_factory(
+        config.get('dataset_name'),
+        dataset_directory,
+        representation_directory,
+        config.get('measure_similarity_batch_size'),
+        config.get('construct_representation_batch_size'),
+        model,
+        config.get('ann_num_lists'),
+        config.get('ann_num_probes'),
+        config.get('build_num_workers'),
+        representation_dtype)
+
+    cache = None
+    if config.get('query_cache_size'):
+        cache = QueryCache(
+            config.get('query_cache_size'), config.get('query_cache_ttl'))
+
+    return Voogle(
+        model,
+        dataset,
+        config.get('require_text_match'),
+        cache=cache,
+        cache_results=config.get('cache_search_results', False),
+        progressive_batch_size=config.get('progressive_batch_size'))
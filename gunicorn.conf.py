@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+import torch
+import yaml
+from log import tracing
+
+# Serving options are read from the same config file as the app
+parent_directory = os.path.dirname(os.path.abspath(__file__))
+config_file = os.path.join(parent_directory, 'config.yaml')
+config = yaml.safe_load(open(config_file))
+
+bind = os.environ.get('VOOGLE_BIND', '0.0.0.0:5000')
+
+# Set up the dataset and load the model once in the master process, so that the
+# workers share the memory-mapped representations and the model weights
+# copy-on-write. TensorFlow sessions do not survive the fork, so models built
+# on them (siamese-style) are loaded again in each worker instead.
+preload_app = True
+
+# The master process runs torch on a single thread, so that no OpenMP thread
+# pool exists when the workers fork. Each worker sets its own number of threads
+# after the fork.
+torch.set_num_threads(1)
+
+workers = config.get('server_num_workers') or multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = config.get('server_num_threads') or 1
+
+# Streaming searches and first-time representation builds can be slow
+timeout = 300
+
+
+def post_fork(server, worker):
+    # Each worker runs inference on its own share of the CPU cores
+    torch.set_num_threads(
+        config.get('server_torch_num_threads') or multiprocessing.cpu_count())
+
+    # Load models that are not fork-safe before the worker accepts requests
+    from wsgi import app
+    app.config.get('voogle').model.load()
+
+
+def worker_exit(server, worker):
+    # Keep the metrics the worker recorded since it last saved them
+    tracing.flush()
@@ -1 +1,2 @@
 from log.log import get_logger
+from log import tracing
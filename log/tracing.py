@@ -0,0 +1,216 @@
+import contextlib
+import json
+import os
+import threading
+from timeit import default_timer as timer
+
+# Upper bounds in seconds of the stage duration histogram buckets
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0, 30.0, float('inf'))
+
+# Minimum number of seconds between two saves of the metrics of a process to
+# the shared metrics directory
+SAVE_INTERVAL = 1.0
+
+_lock = threading.Lock()
+_stages = {}
+_traces = threading.local()
+
+# The process the metrics in _stages were recorded by, the directory shared by
+# the processes of a multi-process server and the time of the last save to it
+_pid = None
+_directory = None
+_last_save = 0.0
+
+
+@contextlib.contextmanager
+def span(name):
+    '''
+    Times a stage of the search or indexing pipeline. The duration is added to
+    the process-wide stage metrics and, if a trace is active in this thread,
+    to the trace.
+
+    Arguments:
+        name: A string. The name of the stage.
+    '''
+    start = timer()
+    try:
+        yield
+    finally:
+        duration = timer() - start
+        _observe(name, duration)
+        add(name, duration)
+
+
+@contextlib.contextmanager
+def trace():
+    '''
+    Collects the durations of the spans that run in this thread until the
+    context exits.
+
+    Returns:
+        A dict. Maps each stage name to its total duration in seconds. Filled
+            in while the context is active.
+    '''
+    timings = {}
+    previous = getattr(_traces, 'timings', None)
+    _traces.timings = timings
+    try:
+        yield timings
+    finally:
+        _traces.timings = previous
+
+
+def add(name, duration):
+    '''
+    Adds a duration to the trace active in this thread, without recording it
+    in the process-wide metrics. Used to hand the timings of work done in
+    another thread to the trace of the request that waited for it.
+
+    Arguments:
+        name: A string. The name of the stage.
+        duration: A float. The duration in seconds.
+    '''
+    timings = getattr(_traces, 'timings', None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + duration
+
+
+def set_metrics_directory(directory):
+    '''
+    Shares the stage metrics between the processes of a multi-process server,
+    e.g., gunicorn workers. Each process saves its metrics to its own file in
+    the directory at most every SAVE_INTERVAL seconds, and prometheus_text
+    merges the files of all processes. The files of exited processes are
+    kept, so the merged histograms never decrease.
+
+    Arguments:
+        directory: A string or None. The metrics directory. If None, each
+            process exports only its own metrics.
+    '''
+    global _directory
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    with _lock:
+        _directory = directory
+
+
+def flush():
+    '''
+    Saves the stage metrics of this process to the metrics directory, if one
+    is set. Call before a process exits, so that its latest observations are
+    kept.
+    '''
+    with _lock:
+        _own_stages()
+        if _directory is not None:
+            _save()
+
+
+def clear_metrics_directory(directory):
+    '''
+    Removes the metric files left by a previous run of the server. Call once
+    when the server starts, before it records any metrics.
+
+    Arguments:
+        directory: A string. The metrics directory.
+    '''
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            os.remove(os.path.join(directory, filename))
+
+
+def prometheus_text():
+    '''
+    Renders the stage metrics in the Prometheus text exposition format. These
+    are the metrics of every process sharing the metrics directory, or of this
+    process only if no directory is set.
+
+    Returns:
+        A string.
+    '''
+    name = 'voogle_stage_duration_seconds'
+    lines = [
+        '# HELP {} Duration of each stage of the search and indexing \
+pipeline.'.format(name),
+        '# TYPE {} histogram'.format(name)
+    ]
+    with _lock:
+        _own_stages()
+        if _directory is None:
+            stages = _stages
+        else:
+            _save()
+            stages = _merged_stages()
+
+        for stage in sorted(stages):
+            counts, total, count = stages[stage]
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                    name, stage, le, cumulative))
+            lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, total))
+            lines.append('{}_count{{stage="{}"}} {}'.format(
+                name, stage, count))
+    return '\n'.join(lines) + '\n'
+
+
+def _own_stages():
+    # A forked process starts with a copy of the metrics of its parent, which
+    # the parent exports itself
+    global _pid
+    if _pid != os.getpid():
+        _stages.clear()
+        _pid = os.getpid()
+
+
+def _save():
+    # Atomically replace the metric file of this process
+    global _last_save
+    filepath = os.path.join(_directory, '{}.json'.format(_pid))
+    with open(filepath + '.tmp', 'w') as file:
+        json.dump(_stages, file)
+    os.replace(filepath + '.tmp', filepath)
+    _last_save = timer()
+
+
+def _merged_stages():
+    # Sums the metrics saved by every process
+    stages = {}
+    for filename in os.listdir(_directory):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(_directory, filename)) as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for name, (counts, total, count) in saved.items():
+            if name not in stages:
+                stages[name] = [[0] * len(BUCKETS), 0.0, 0]
+            stage = stages[name]
+            stage[0] = [a + b for a, b in zip(stage[0], counts)]
+            stage[1] += total
+            stage[2] += count
+    return stages
+
+
+def _observe(name, duration):
+    with _lock:
+        _own_stages()
+        if name not in _stages:
+            _stages[name] = [[0] * len(BUCKETS), 0.0, 0]
+        stage = _stages[name]
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                stage[0][i] += 1
+                break
+        stage[1] += duration
+        stage[2] += 1
+        if _directory is not None and timer() - _last_save > SAVE_INTERVAL:
+            _save()
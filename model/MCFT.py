@@ -1,15 +1,16 @@
+import hashlib
+import json
 import librosa
-import math
 import numpy as np
 import os
-from model.mcft.cqt_toolbox.cqt import cqt
-from model.mcft.mcft_toolbox.mcft import cqt_to_mcft
+from model.mcft.cqt_toolbox.cqt import CQTPlan
+from model.mcft.mcft_toolbox.mcft import cqt_to_mcft_pooled
 from model.mcft.mcft_toolbox.spectro_temporal_fbank import (
     filt_default_centers, gen_fbank_scale_rate)
 from model.QueryByVoiceModel import QueryByVoiceModel
+from log.tracing import span
 import pickle
 from scipy import spatial
-import time
 
 
 class MCFT(QueryByVoiceModel):
@@ -43,13 +44,27 @@ class MCFT(QueryByVoiceModel):
             hop_length: A float. The hop length between windows in seconds.
                 Unused if uses_windowing is False.
         '''
+        # Analysis parameters of the CQT and the MCFT filter bank
+        self.analysis_sampling_rate = 8000
+        self.fres = 24
+        self.fmin = 27.5*2**(0/12)
+        self.fmax = 27.5*2**(87/12)
+        self.gamma = 0
+        self.scale_res = 1
+        self.rate_res = 8
+        self.time_const = 1
+        self.filter_bank_dtype = 'complex64'
+
+        # The number of windows transformed together by the CQT
+        self.cqt_batch_size = 16
+
         super().__init__(
             model_filepath,
             parametric_representation,
             uses_windowing,
             window_length,
             hop_length)
-        self.filter_bank = np.array([])
+        self.dataset_sampling_rate = self.analysis_sampling_rate
 
     def construct_representation(self, audio_list, sampling_rates, is_query):
         '''
@@ -68,11 +83,14 @@ class MCFT(QueryByVoiceModel):
             A python list of audio representations. The list order should be
                 the same as in audio_list.
         '''
+        self.load()
         representations = []
         for audio, sampling_rate in zip(audio_list, sampling_rates):
 
-            new_sampling_rate = 8000
-            audio = librosa.resample(audio, sampling_rate, new_sampling_rate)
+            new_sampling_rate = self.analysis_sampling_rate
+            with span('resample'):
+                audio = librosa.resample(
+                    audio, sampling_rate, new_sampling_rate)
 
             if self.uses_windowing:
                 windows = self._window(audio, new_sampling_rate)
@@ -81,19 +99,15 @@ class MCFT(QueryByVoiceModel):
                     librosa.util.fix_length(
                         audio, self.window_length * new_sampling_rate)]
 
+            # The CQTs of a batch of windows are computed in one call
             representation = []
-            for window in windows:
-                if not self.filter_bank.any():
-                    self.filter_bank = self._make_filter_bank(
-                        window, new_sampling_rate)
-
-                start = time.time()
-                query_cqt_mag = self._compute_cqt(window, new_sampling_rate)
-                mcft_out = cqt_to_mcft(query_cqt_mag, self.filter_bank)
-                features = np.mean(np.abs(mcft_out), axis=(2, 3))
-                end = time.time()
-                print('time: {}'.format(end - start))
-                representation.append(features)
+            for start in range(0, len(windows), self.cqt_batch_size):
+                with span('feature_extraction'):
+                    cqt_mags = self._compute_cqts(
+                        windows[start:start + self.cqt_batch_size])
+                    for query_cqt_mag in cqt_mags:
+                        representation.append(cqt_to_mcft_pooled(
+                            query_cqt_mag, self.filter_bank))
 
             # normalize to zero mean and unit variance
             representation = np.array(representation)
@@ -123,51 +137,49 @@ class MCFT(QueryByVoiceModel):
         for q, i in zip(query, items):
             sim = []
             for window in q:
-                sim.append(
-                    1 - spatial.distance.cosine(window.flatten(), i.flatten()))
+                # Representations stored at reduced precision are upcast
+                sim.append(1 - spatial.distance.cosine(
+                    np.asarray(window, dtype='float64').flatten(),
+                    np.asarray(i, dtype='float64').flatten()))
             simlarities.append(np.max(np.array(sim)))
 
         return np.array(simlarities)
 
     def _compute_cqt(self, query, sampling_rate):
-        # cqt parameters
-        fmin = 27.5*2**(0/12)
-        fmax = 27.5*2**(87/12)
-        fres = 24
-        gamma = 0
-        print(query.shape, sampling_rate)
-        cqt_results = cqt(query, fres, sampling_rate, fmin, fmax, gamma=gamma)
-        return np.abs(cqt_results['cqt'])
+        # The plan is made for windows at the analysis sampling rate
+        return np.abs(self.cqt_plan.apply(query)['cqt'])
+
+    def _compute_cqts(self, windows):
+        # The CQT magnitudes of a 2D array of windows at the analysis sampling
+        # rate
+        return np.abs(self.cqt_plan.apply_batch(windows))
 
     def _compute_filter_bank(self, query, sampling_rate):
-        fres = 24
         query_cqt_mag = self._compute_cqt(query, sampling_rate)
         num_freq_bin, num_time_frame = np.shape(query_cqt_mag)
 
         # filterbank parameters
         query_dur = len(query)/sampling_rate
-        scale_res, rate_res = 1, 8
-        samprate_spec = fres
+        samprate_spec = self.fres
         samprate_temp = np.floor(num_time_frame/query_dur)
 
         scale_nfft, rate_nfft = num_freq_bin, num_time_frame
 
-        scale_params = (scale_res, scale_nfft, samprate_spec)
-        rate_params = (rate_res, rate_nfft, samprate_temp)
-        print(scale_params, rate_params)
+        scale_params = (self.scale_res, scale_nfft, samprate_spec)
+        rate_params = (self.rate_res, rate_nfft, samprate_temp)
         scale_ctrs, rate_ctrs = filt_default_centers(scale_params, rate_params)
+        self.logger.debug('Filter bank scale centers {} and rate centers {}\
+            '.format(scale_ctrs, rate_ctrs))
 
-        print(scale_ctrs, rate_ctrs)
-
-        time_const = 1
         filt_params = {
             'samprate_spec': samprate_spec,
             'samprate_temp': samprate_temp,
-            'time_const': time_const
+            'time_const': self.time_const
         }
 
         _, fbank_sr_domain = gen_fbank_scale_rate(
-            scale_ctrs, rate_ctrs, scale_nfft, rate_nfft, filt_params)
+            scale_ctrs, rate_ctrs, scale_nfft, rate_nfft, filt_params,
+            comp_tf_domain=False)
 
         return fbank_sr_domain
 
@@ -176,11 +188,82 @@ class MCFT(QueryByVoiceModel):
         Loads the model weights from disk. Prepares the model to be able to
         make predictions.
         '''
-        pass
+        # The CQT filters only depend on the parameters and the window length
+        self.cqt_plan = CQTPlan(
+            self.fres,
+            self.analysis_sampling_rate,
+            self.fmin,
+            self.fmax,
+            int(self.window_length * self.analysis_sampling_rate),
+            gamma=self.gamma)
 
-    def _make_filter_bank(self, query, sampling_rate):
-        try:
+        with span('filter_bank'):
+            self.filter_bank = self._make_filter_bank()
+
+    def _make_filter_bank(self):
+        '''
+        Loads the filter bank for the analysis parameters of the model. The
+        filter bank only depends on those parameters, so it is computed once,
+        saved next to model_filepath as a .npy file named after a hash of the
+        parameters, and memory-mapped by every later process. A cache file
+        that cannot be read is computed again.
+
+        If a file exists at model_filepath, it must hold a pickled filter
+        bank, which is used instead. It is not checked against the analysis
+        parameters, so it must have been computed with the same ones.
+
+        Returns:
+            A 4D complex64 numpy array. The scale-rate domain filter bank.
+        '''
+        if os.path.isfile(self.model_filepath):
+            self.logger.info('Loading the pickled MCFT filter bank {} instead \
+                of the filter bank of the analysis parameters'.format(
+                    self.model_filepath))
             with open(self.model_filepath, 'rb') as file:
-                return pickle.load(file)
+                return np.asarray(
+                    pickle.load(file), dtype=self.filter_bank_dtype)
+
+        filename = self._filter_bank_filename()
+        try:
+            filter_bank = np.load(filename, mmap_mode='r')
+            self.logger.info('Loaded the MCFT filter bank from {}'.format(
+                filename))
+            return filter_bank
         except FileNotFoundError:
-            return self._compute_filter_bank(query, sampling_rate)
+            pass
+        except (OSError, ValueError):
+            self.logger.warning('Could not read the MCFT filter bank {}. \
+                Computing it again.'.format(filename))
+
+        self.logger.info('Computing the MCFT filter bank')
+
+        # The filter bank only depends on the length of the windows
+        window = np.zeros(
+            int(self.window_length * self.analysis_sampling_rate))
+        filter_bank = self._compute_filter_bank(
+            window, self.analysis_sampling_rate)
+
+        temporary_filename = filename + '.tmp.npy'
+        np.save(temporary_filename, filter_bank.astype(self.filter_bank_dtype))
+        os.replace(temporary_filename, filename)
+        return np.load(filename, mmap_mode='r')
+
+    def _filter_bank_filename(self):
+        # The cache file of the filter bank for the current parameters
+        parameters = {
+            'sampling_rate': self.analysis_sampling_rate,
+            'window_length': self.window_length,
+            'fres': self.fres,
+            'fmin': self.fmin,
+            'fmax': self.fmax,
+            'gamma': self.gamma,
+            'scale_res': self.scale_res,
+            'rate_res': self.rate_res,
+            'time_const': self.time_const,
+            'dtype': self.filter_bank_dtype
+        }
+        digest = hashlib.sha1(
+            json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+        return os.path.join(
+            os.path.dirname(self.model_filepath),
+            'mcft_filter_bank_{}.npy'.format(digest[:16]))
@@ -0,0 +1,116 @@
+import numpy as np
+import os
+import torch
+from model.VGGishEmbedding import VGGishEmbedding
+
+
+class QuantizedVGGishEmbedding(VGGishEmbedding):
+    '''
+    A VGGish model whose weights are stored as int8 with one scale per output
+    channel. The int8 weights are derived from the float weight file once and
+    saved next to it. Loading the model dequantizes them to float32, so
+    inference runs on the float kernels of the pinned torch version, which
+    has no int8 kernels. The embeddings differ from those of VGGish-embedding
+    only by the rounding of the weights. ranking_agreement.py reports how
+    much that changes the search results.
+    '''
+
+    def _load_state_dict(self):
+        '''
+        Loads the int8 weights, quantizing the float weight file first if
+        they are missing or older than it, and dequantizes them.
+
+        Returns:
+            A dict. The float32 state dict of the VGGish2s network.
+        '''
+        quantized_filepath = self._quantized_filepath()
+        try:
+            if (os.path.getmtime(quantized_filepath) <
+                    os.path.getmtime(self.model_filepath)):
+                raise ValueError('The int8 weights are out of date')
+            with np.load(quantized_filepath) as quantized:
+                arrays = dict(quantized)
+        except (OSError, ValueError):
+            arrays = self._quantize_weights(quantized_filepath)
+
+        state_dict = {}
+        for name in arrays:
+            if name.endswith('.scales'):
+                continue
+            if name.endswith('.int8'):
+                parameter = name[:-len('.int8')]
+                state_dict[parameter] = torch.from_numpy(
+                    dequantize_per_channel(
+                        arrays[name], arrays[parameter + '.scales']))
+            else:
+                state_dict[name] = torch.from_numpy(arrays[name])
+        return state_dict
+
+    def _quantize_weights(self, quantized_filepath):
+        '''
+        Quantizes the weight matrices and convolution kernels of the float
+        weight file to int8 and saves them. Biases keep their type.
+
+        Arguments:
+            quantized_filepath: A string. The file the int8 weights are saved
+                to.
+
+        Returns:
+            A dict. Maps '<parameter>.int8' and '<parameter>.scales' to the
+                quantized weights and their scales, and the name of each
+                other parameter to its values.
+        '''
+        self.logger.info('Quantizing the weights of {} to int8'.format(
+            self.model_filepath))
+        arrays = {}
+        for name, tensor in torch.load(self.model_filepath).items():
+            values = tensor.cpu().numpy()
+            if values.ndim >= 2:
+                arrays[name + '.int8'], arrays[name + '.scales'] = \
+                    quantize_per_channel(values)
+            else:
+                arrays[name] = values
+
+        temporary_filepath = quantized_filepath + '.tmp.npz'
+        np.savez(temporary_filepath, **arrays)
+        os.replace(temporary_filepath, quantized_filepath)
+        return arrays
+
+    def _quantized_filepath(self):
+        return os.path.splitext(self.model_filepath)[0] + '_int8.npz'
+
+
+def quantize_per_channel(weight):
+    '''
+    Quantizes weights to int8 with one symmetric scale per output channel.
+
+    Arguments:
+        weight: A numpy array of at least two dimensions. The first axis
+            indexes the output channels.
+
+    Returns:
+        A tuple of
+            - An int8 numpy array of the same shape as weight.
+            - A float32 numpy array of shape (len(weight),). The scale of each
+                output channel.
+    '''
+    flat = weight.reshape(len(weight), -1).astype('float32')
+    scales = np.max(np.abs(flat), axis=1) / 127
+    scales[scales == 0] = 1
+    values = np.clip(np.round(flat / scales[:, np.newaxis]), -127, 127)
+    return values.astype('int8').reshape(weight.shape), scales
+
+
+def dequantize_per_channel(values, scales):
+    '''
+    Restores float32 weights from int8 values and per-channel scales.
+
+    Arguments:
+        values: An int8 numpy array. The quantized weights.
+        scales: A float32 numpy array. The scale of each output channel.
+
+    Returns:
+        A float32 numpy array of the same shape as values.
+    '''
+    shape = (len(values),) + (1,) * (values.ndim - 1)
+    return values.astype('float32') * scales.reshape(shape)
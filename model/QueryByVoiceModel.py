@@ -1,6 +1,7 @@
 import librosa
 import numpy as np
 import os
+import threading
 from abc import ABC, abstractmethod
 from log import get_logger
 
@@ -40,7 +41,23 @@ class QueryByVoiceModel(ABC):
         self.window_length = window_length
         self.hop_length = hop_length
 
-        self._load_model()
+        # True if measure_similarity accepts a single query representation and
+        # scores it against every item, so the query need not be repeated
+        self.broadcasts_query = False
+
+        # The sampling rate construct_representation resamples dataset audio
+        # to, or None. Lets datasets resample while decoding, outside of the
+        # model.
+        self.dataset_sampling_rate = None
+
+        # True if a loaded model stays usable in processes forked afterwards,
+        # so that they share its weights copy-on-write instead of loading
+        # their own copy
+        self.fork_safe = True
+
+        # The process that loaded the model. Models are loaded on first use.
+        self.pid = None
+        self.lock = threading.Lock()
 
     @abstractmethod
     def construct_representation(self, audio_list, sampling_rates, is_query):
@@ -69,7 +86,9 @@ class QueryByVoiceModel(ABC):
 
         Arguments:
             query: A numpy array. An audio representation as defined by
-                construct_representation. The user's vocal query.
+                construct_representation. The user's vocal query. If
+                broadcasts_query is True this may hold a single query
+                representation that is compared against all items.
             items: A numpy array. The audio representations as defined by
                 construct_representation. The dataset of potential matches for
                 the user's query.
@@ -81,6 +100,43 @@ class QueryByVoiceModel(ABC):
         '''
         pass
 
+    def measure_similarity_many(self, queries, items):
+        '''
+        Runs model inference on several queries against the same items. Only
+        used by models that broadcast the query. Models that can score all
+        queries in one product should override this.
+
+        Arguments:
+            queries: A numpy array. One query representation per row.
+            items: A numpy array. The audio representations as defined by
+                construct_representation.
+
+        Returns:
+            A 2D numpy array of shape (len(queries), len(items)). The
+                similarity score of each query and each item.
+        '''
+        return np.array([
+            self.measure_similarity(q[np.newaxis], items) for q in queries])
+
+    def load(self):
+        '''
+        Loads the model if it is not loaded yet. Called on first use. A model
+        loaded before a fork (e.g., with gunicorn's preload_app) is reused by
+        the forked processes if it is fork-safe, and loaded again in each of
+        them otherwise.
+        '''
+        if self._loaded():
+            return
+        with self.lock:
+            if self._loaded():
+                return
+            self._load_model()
+            self.pid = os.getpid()
+
+    def _loaded(self):
+        return self.pid == os.getpid() or (
+            self.pid is not None and self.fork_safe)
+
     @abstractmethod
     def _load_model(self):
         '''
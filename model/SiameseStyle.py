@@ -3,6 +3,7 @@ import numpy as np
 import os
 import tensorflow as tf
 from keras.models import load_model
+from log.tracing import span
 from model.QueryByVoiceModel import QueryByVoiceModel
 
 
@@ -44,6 +45,11 @@ class SiameseStyle(QueryByVoiceModel):
             uses_windowing,
             window_length,
             hop_length)
+        self.dataset_sampling_rate = 44100
+
+        # TensorFlow sessions do not survive a fork, so each process loads
+        # its own copy of the model
+        self.fork_safe = False
 
     def construct_representation(self, audio_list, sampling_rates, is_query):
         '''
@@ -62,6 +68,7 @@ class SiameseStyle(QueryByVoiceModel):
             A python list of audio representations. The list order should be
                 the same as in audio_list.
         '''
+        self.load()
 
         # Siamese-style network requires different representation of query
         # and dataset audio
@@ -89,12 +96,10 @@ class SiameseStyle(QueryByVoiceModel):
                 element in the dataset. The list order should be the same as
                 in dataset.
         '''
-        if not self.model:
-            raise RuntimeError('No model loaded during call to \
-                               measure_similarity.')
+        self.load()
 
         # run model inference
-        with self.graph.as_default():
+        with self.graph.as_default(), span('model_forward'):
             self.logger.debug('Running inference')
             return np.array(self.model.predict(
                 [query, items], batch_size=len(query), verbose=1),
@@ -115,7 +120,8 @@ class SiameseStyle(QueryByVoiceModel):
 
         # resample query at 16k
         new_sampling_rate = 16000
-        query = librosa.resample(query, sampling_rate, new_sampling_rate)
+        with span('resample'):
+            query = librosa.resample(query, sampling_rate, new_sampling_rate)
         sampling_rate = new_sampling_rate
 
         if self.uses_windowing:
@@ -127,14 +133,15 @@ class SiameseStyle(QueryByVoiceModel):
 
         # construct the logmelspectrogram of the signal
         representation = []
-        for window in windows:
-            melspec = librosa.feature.melspectrogram(
-                window, sr=sampling_rate, n_fft=133,
-                hop_length=133, power=2, n_mels=39,
-                fmin=0.0, fmax=5000)
-            melspec = melspec[:, :482]
-            logmelspec = librosa.power_to_db(melspec, ref=np.max)
-            representation.append(logmelspec)
+        with span('feature_extraction'):
+            for window in windows:
+                melspec = librosa.feature.melspectrogram(
+                    window, sr=sampling_rate, n_fft=133,
+                    hop_length=133, power=2, n_mels=39,
+                    fmin=0.0, fmax=5000)
+                melspec = melspec[:, :482]
+                logmelspec = librosa.power_to_db(melspec, ref=np.max)
+                representation.append(logmelspec)
 
         # normalize to zero mean and unit variance
         representation = np.array(representation)
@@ -148,7 +155,9 @@ class SiameseStyle(QueryByVoiceModel):
         for audio, sampling_rate in zip(dataset, sampling_rates):
 
             # resample audio at 44.1k
-            audio = librosa.resample(audio, sampling_rate, new_sampling_rate)
+            with span('resample'):
+                audio = librosa.resample(
+                    audio, sampling_rate, new_sampling_rate)
             sampling_rate = new_sampling_rate
 
             if self.uses_windowing:
@@ -159,17 +168,18 @@ class SiameseStyle(QueryByVoiceModel):
                         audio, self.window_length * sampling_rate)]
 
             representation = []
-            for window in windows:
-                # construct the logmelspectrogram of the signal
-                melspec = librosa.feature.melspectrogram(
-                    window,
-                    sr=sampling_rate,
-                    n_fft=1024,
-                    hop_length=1024,
-                    power=2)
-                melspec = melspec[:, 0:128]
-                logmelspec = librosa.power_to_db(melspec, ref=np.max)
-                representation.append(logmelspec)
+            with span('feature_extraction'):
+                for window in windows:
+                    # construct the logmelspectrogram of the signal
+                    melspec = librosa.feature.melspectrogram(
+                        window,
+                        sr=sampling_rate,
+                        n_fft=1024,
+                        hop_length=1024,
+                        power=2)
+                    melspec = melspec[:, 0:128]
+                    logmelspec = librosa.power_to_db(melspec, ref=np.max)
+                    representation.append(logmelspec)
 
             # normalize to zero mean and unit variance
             representation = np.array(representation)
@@ -2,13 +2,13 @@ import librosa
 import numpy as np
 import os
 import tensorflow as tf
+import threading
 from keras.models import load_model
+from log.tracing import span
 from model.QueryByVoiceModel import QueryByVoiceModel
-from model.vggish_utils import vggish_input_bk
+from model.vggish_utils import vggish_input_bk, vggish_params
 from model.vggish_utils.vggish_model_architecture import VGGish2s
-from scipy import spatial
 import torch
-from torch.autograd import Variable
 
 
 class VGGishEmbedding(QueryByVoiceModel):
@@ -28,9 +28,11 @@ class VGGishEmbedding(QueryByVoiceModel):
         parametric_representation=False,
         uses_windowing=False,
         window_length=None,
-        hop_length=None):
+        hop_length=None,
+        max_batch_examples=64,
+        trace=False):
         '''
-        SiameseStyle model constructor.
+        VGGishEmbedding model constructor.
 
         Arguments:
             model_filepath: A string. The path to the model weight file on
@@ -43,7 +45,18 @@ class VGGishEmbedding(QueryByVoiceModel):
                 uses_windowing is False.
             hop_length: A float. The hop length between windows in seconds.
                 Unused if uses_windowing is False.
+            max_batch_examples: An int. The maximum number of log-mel examples,
+                pooled across audio files, passed through the network at once.
+            trace: A boolean. If True, the convolutional layers are compiled
+                with TorchScript tracing after the weights are loaded.
         '''
+        self.max_batch_examples = max_batch_examples
+        self.trace = trace
+
+        # One input buffer per thread, as the server handles requests
+        # concurrently
+        self._buffers = threading.local()
+
         super().__init__(
             model_filepath,
             parametric_representation,
@@ -51,6 +64,11 @@ class VGGishEmbedding(QueryByVoiceModel):
             window_length,
             hop_length)
 
+        # Embeddings are unit-norm, so one query is scored against a whole
+        # matrix of items with a single matrix-vector product
+        self.broadcasts_query = True
+        self.dataset_sampling_rate = 16000
+
     def construct_representation(self, audio_list, sampling_rates, is_query):
         '''
         Constructs the audio representation used during inference. Audio
@@ -65,11 +83,30 @@ class VGGishEmbedding(QueryByVoiceModel):
             is_query: A boolean. True only if audio is a user query.
 
         Returns:
-            A python list of audio representations. The list order should be
-                the same as in audio_list.
+            A python list of L2-normalized float32 embeddings. The list order
+                should be the same as in audio_list.
         '''
+        self.load()
         pairs = zip(audio_list, sampling_rates)
-        return [self._construct_representation(a, s) for (a, s) in pairs]
+        melspecs = [self._compute_melspec(a, s) for (a, s) in pairs]
+
+        # Embed the examples of as many files as fit in one batch with a
+        # single forward pass
+        representations = []
+        start = 0
+        while start < len(melspecs):
+            end = start + 1
+            num_examples = len(melspecs[start])
+            while end < len(melspecs):
+                num_examples += len(melspecs[end])
+                if num_examples > self.max_batch_examples:
+                    break
+                end += 1
+
+            representations.extend(self._embed(melspecs[start:end]))
+            start = end
+
+        return representations
 
     def measure_similarity(self, query, items):
         '''
@@ -77,7 +114,9 @@ class VGGishEmbedding(QueryByVoiceModel):
 
         Arguments:
             query: A numpy array. An audio representation as defined by
-                construct_representation. The user's vocal query.
+                construct_representation. The user's vocal query. Either a
+                single embedding of shape (1, embedding_size), which is scored
+                against every item, or one embedding per item.
             items: A numpy array. The audio representations as defined by
                 construct_representation. The dataset of potential matches for
                 the user's query.
@@ -87,17 +126,39 @@ class VGGishEmbedding(QueryByVoiceModel):
                 element in the dataset. The list order should be the same as
                 in dataset.
         '''
-        if not self.model:
-            raise RuntimeError('No model loaded during call to \
-                               measure_similarity.')
+        self.load()
 
         # run model inference
         self.logger.debug('Running inference')
-        simlarities = []
-        for q, i in zip(query, items):
-            simlarities.append(1 - spatial.distance.cosine(q, i))
+        query = np.asarray(query, dtype='float32')
+        items = np.asarray(items, dtype='float32')
+        items = items.reshape(len(items), -1)
+
+        # Representations are unit-norm, so the cosine similarity reduces to a
+        # dot product
+        if len(query) == 1:
+            return items.dot(query.reshape(-1))
+        query = query.reshape(len(query), -1)
+        return np.einsum('ij,ij->i', query, items)
+
+    def measure_similarity_many(self, queries, items):
+        '''
+        Runs model inference on several queries against the same items with a
+        single matrix product.
+
+        Arguments:
+            queries: A numpy array. One query embedding per row.
+            items: A numpy array. The audio representations as defined by
+                construct_representation.
 
-        return np.array(simlarities)
+        Returns:
+            A 2D numpy array of shape (len(queries), len(items)). The
+                similarity score of each query and each item.
+        '''
+        queries = np.asarray(queries, dtype='float32')
+        items = np.asarray(items, dtype='float32')
+        return queries.reshape(len(queries), -1).dot(
+            items.reshape(len(items), -1).T)
 
     def _load_model(self):
         '''
@@ -107,13 +168,40 @@ class VGGishEmbedding(QueryByVoiceModel):
         self.logger.info(
             'Loading model weights from {}'.format(self.model_filepath))
         self.model = VGGish2s()
-        self.model.load_state_dict(torch.load(self.model_filepath))
+        self.model.load_state_dict(self._load_state_dict())
         self.model.eval()
 
-    def _construct_representation(self, audio, sampling_rate):
+        # The model is only used for inference, so no gradients are tracked
+        for parameter in self.model.parameters():
+            parameter.requires_grad_(False)
+
+        self.features = self.model.features
+        if self.trace:
+            self.logger.info('Tracing the VGGish convolutional layers')
+            num_frames = int(round(
+                vggish_params.EXAMPLE_WINDOW_SECONDS /
+                vggish_params.STFT_HOP_LENGTH_SECONDS))
+            example = torch.zeros(1, num_frames, vggish_params.NUM_BANDS)
+            with torch.no_grad():
+                if int(torch.__version__.split('.')[0]) < 1:
+                    # Before torch 1.0, trace takes the example inputs and
+                    # returns a decorator
+                    self.features = torch.jit.trace(example)(self.features)
+                else:
+                    self.features = torch.jit.trace(self.features, example)
+
+    def _load_state_dict(self):
+        '''
+        Returns the state dict of the VGGish2s network stored in the weight
+        file.
+        '''
+        return torch.load(self.model_filepath)
+
+    def _compute_melspec(self, audio, sampling_rate):
         # resample query at 16k
         new_sampling_rate = 16000
-        audio = librosa.resample(audio, sampling_rate, new_sampling_rate)
+        with span('resample'):
+            audio = librosa.resample(audio, sampling_rate, new_sampling_rate)
         sampling_rate = new_sampling_rate
 
         # zero-padding
@@ -123,9 +211,47 @@ class VGGishEmbedding(QueryByVoiceModel):
         pad = np.zeros((target_length*sampling_rate-audio.shape[0]))
         audio = np.append(audio, pad)
 
-        melspec = vggish_input_bk.waveform_to_examples(audio, sampling_rate)
-        melspec = melspec.astype('float32')
-        representation = self.model(Variable(torch.from_numpy(melspec)))
-        representation = representation.detach().numpy()
+        with span('feature_extraction'):
+            melspec = vggish_input_bk.waveform_to_examples(
+                audio, sampling_rate)
+        return melspec.astype('float32')
+
+    def _embed(self, melspecs):
+        # Run the log-mel examples of several files through the network at
+        # once and split the output back into one embedding per file
+        lengths = [len(m) for m in melspecs]
+        examples = self._input_buffer(sum(lengths), melspecs[0].shape[1:])
+        np.concatenate(melspecs, out=examples.numpy())
+
+        with torch.no_grad(), span('model_forward'):
+            out_conv4_1, out_conv4_2 = self.features(examples)
+
+            representations = []
+            start = 0
+            for length in lengths:
+                end = start + length
+                representation = self.model.embed(
+                    out_conv4_1[start:end], out_conv4_2[start:end])
+                representations.append(self._normalize(representation.numpy()))
+                start = end
+
+        return representations
+
+    def _input_buffer(self, num_examples, example_shape):
+        # Returns a tensor of num_examples examples backed by a buffer that is
+        # allocated once per thread and grown when a larger batch arrives
+        buffer = getattr(self._buffers, 'examples', None)
+        if (buffer is None or len(buffer) < num_examples or
+                tuple(buffer.shape[1:]) != tuple(example_shape)):
+            num_rows = max(num_examples, self.max_batch_examples)
+            buffer = torch.empty((num_rows,) + tuple(example_shape))
+            self._buffers.examples = buffer
+        return buffer[:num_examples]
 
+    def _normalize(self, representation):
+        # scale to unit L2 norm so that cosine similarity is a dot product
+        representation = representation.astype('float32')
+        norm = np.linalg.norm(representation)
+        if norm > 0:
+            representation /= norm
         return representation
@@ -2,8 +2,8 @@ from __future__ import print_function, division
 
 import numpy as np 
 
-def apply_filterbank(signal,filter_bank,shift,phasemode,bw_bins=None):
-    # type: (numpy.ndarray, list, numpy.ndarray, str, numpy.ndarray) -> (list, long)
+def apply_filterbank(signal,filter_bank,shift,phasemode,bw_bins=None,plan=None):
+    # type: (numpy.ndarray, list, numpy.ndarray, str, numpy.ndarray, dict) -> (list, long)
     '''
     Input parameters: 
         signal          : A real-valued signal -- multichannel
@@ -17,6 +17,9 @@ def apply_filterbank(signal,filter_bank,shift,phasemode,bw_bins=None):
         **bw_bins       : Number of time channels 
                            If this is constant, the output is converted
                            to a matrix
+        **plan          : Gather plan returned by plan_filterbank for this
+                          signal length and filter bank. Computed on the
+                          fly if not given
 
     Output parameters:
         cqt             : Transform coefficients
@@ -49,6 +52,86 @@ def apply_filterbank(signal,filter_bank,shift,phasemode,bw_bins=None):
     # Unpack the signal length and num of channels
     sig_len,num_channels = signal.shape
 
+    if plan is None:
+        plan = plan_filterbank(filter_bank,shift,phasemode,sig_len,bw_bins)
+
+    signal = np.fft.fft(signal,axis=0)
+
+    # Padding for scale frames
+    padding = np.zeros((int(plan['zpad_len']),int(num_channels)))
+    signal = np.vstack((signal,padding))
+
+    num_filters = plan['num_filters']
+    bw_bins = plan['bw_bins']
+    cqt = [None] * (num_filters+1)
+
+    # Applying the filters with equal bandwidth together: gather the
+    # supported frequencies of every filter into its zero-padded, shifted
+    # slot and take one batched inverse FFT
+    for group in plan['groups']:
+        temp = np.zeros((len(group['filters']),group['bw_bins'],num_channels), dtype=np.complex128)
+        temp[group['rows'],group['slots'],:] = signal[group['freqs'],:] * group['weights'][:,np.newaxis]
+        coefficients = np.fft.ifft(temp, axis=1)
+        for j, i in enumerate(group['filters']):
+            cqt[i] = coefficients[j]
+
+    # Filters longer than their number of time channels alias
+    for i in plan['aliased']:
+        filter_len = len(filter_bank[i])
+        idx = np.concatenate((np.arange(np.ceil(filter_len/2),filter_len),np.arange(np.ceil(filter_len/2))))
+        filter_range = ((plan['ctr_freqs'][i] + np.arange(-1*np.floor(filter_len/2),np.ceil(filter_len/2))) % sig_len+plan['zpad_len'])
+        idx,filter_range = (idx.astype(np.int32), filter_range.astype(np.int32))
+
+        # This case involves aliasing (non-painless case)
+        col = np.ceil(filter_len/bw_bins[i])
+        temp = np.zeros((col*bw_bins[i], num_channels))
+
+        slice_one = np.arange((temp.shape[0]-np.floor(filter_len/2)),temp.shape[0],dtype=np.int32)
+        slice_two = np.arange(np.ceil(filter_len/2),dtype=np.int32)
+        temp[np.concatenate((slice_one,slice_two)),:] = signal[filter_range,:] * filter_bank[i][idx]
+
+        temp = np.reshape(temp,(bw_bins[i],col,num_channels), dtype=np.complex128)
+        cqt[i] = np.squeeze(np.fft.ifft(np.sum(temp, axis=1)))
+
+    # If coefficients are all teh same length, reshape the list into an ndarray
+    if np.max(bw_bins) == np.min(bw_bins):
+        cqt = np.asarray(cqt)
+        cqt = np.reshape(cqt, (int(bw_bins[0]),int(num_filters+1),int(num_channels)))
+
+    return cqt, sig_len
+
+
+def plan_filterbank(filter_bank,shift,phasemode,sig_len,bw_bins=None):
+    # type: (list, numpy.ndarray, str, int, numpy.ndarray) -> dict
+    '''
+    Input parameters:
+        filter_bank     : List of filters for each center
+                          frequency of analysis
+        shift           : Ndarray of frequency shifts
+        phasemode       : 'local': zero-centered filtered used
+                          'global': mapping function used (see cqt)
+        sig_len         : Length of the signals the filter bank is
+                          applied to
+        **bw_bins       : Number of time channels
+
+    Output parameters:
+        plan            : Dict consisting of
+           .num_filters   : Index of the last filter applied
+           .bw_bins       : Ndarray of number of time channels
+           .ctr_freqs     : Ndarray of center frequency positions
+           .zpad_len      : Length of the zero padding of the spectrum
+           .groups        : List of dicts, one per number of time
+                            channels, with the gather indices and
+                            weights of all its filters
+           .aliased       : List of indices of the filters longer than
+                            their number of time channels
+
+    Precomputes the indices at which apply_filterbank gathers the
+    spectrum of the signal for every filter, and the positions the
+    filtered spectrum is scattered to before the inverse FFT. The plan
+    only depends on the filter bank and the signal length, so it can be
+    reused for every signal of that length.
+    '''
     # Setup some useful variables for computation later on
     num_filters = len(shift)
     if bw_bins is None:
@@ -59,63 +142,55 @@ def apply_filterbank(signal,filter_bank,shift,phasemode,bw_bins=None):
     if bw_bins.size == 1:
         bw_bins = bw_bins[0]*np.ones(num_filters)
 
-    signal = np.fft.fft(signal,axis=0)
-
     # Convert from distance between center freqs to positions
     ctr_freqs = np.cumsum(shift)-shift[0]
 
     # Padding for scale frames
     zpad_len = np.sum(shift)-sig_len
-    padding = np.zeros((int(zpad_len),int(num_channels)))
-    signal = np.vstack((signal,padding))
 
-    filter_lens = np.zeros(len(filter_bank))
-    for i in range(len(filter_bank)):
-        filter_lens[i] = len(filter_bank[i])
+    filter_lens = np.array([len(f) for f in filter_bank])
 
     # Number of filters determined by the last center freq position greater than the signal length
-    num_filters = [ctr_freqs[i] - np.floor(filter_lens[i]/2) <= (sig_len+zpad_len)/2 for i in range(len(ctr_freqs))]
+    num_filters = ctr_freqs - np.floor(filter_lens/2) <= (sig_len+zpad_len)/2
     num_filters = np.nonzero(num_filters)[0][-1]
-    cqt = []
-    
-    # Applying the filters at the correct center freqs
-    for i in range(num_filters+1):
-        # Create the lists of indices at which points of the filters will be applied to the signal
-        idx = np.concatenate((np.arange(np.ceil(filter_lens[i]/2),filter_lens[i]),np.arange(np.ceil(filter_lens[i]/2))))
-        filter_range = ((ctr_freqs[i] + np.arange(-1*np.floor(filter_lens[i]/2),np.ceil(filter_lens[i]/2))) % sig_len+zpad_len)
-        idx,filter_range = (idx.astype(np.int32), filter_range.astype(np.int32))
-        
-        # Create the cqt coefficients
-        if bw_bins[i] < filter_lens[i]:
-            # This case involves aliasing (non-painless case)
-            col = np.ceil(filter_lens[i]/bw_bins[i])
-            temp = np.zeros((col*bw_bins[i], num_channels))
-
-            slice_one = np.arange((temp.shape[0]-np.floor(filter_lens[i]/2)),temp.shape[0],dtype=np.int32)
-            slice_two = np.arange(np.ceil(filter_lens[i]/2),dtype=np.int32)
-            temp[np.concatenate((slice_one,slice_two)),:] = signal[filter_range,:] * filter_bank[i][idx]
-            
-            temp = np.reshape(temp,(bw_bins[i],col,num_channels), dtype=np.complex128)
-            cqt.append(np.squeeze(np.fft.ifft(np.sum(temp, axis=1))))
-
-        else:
-            # No aliasing here
-            temp = np.zeros((int(bw_bins[i]),num_channels), dtype=np.complex128)
-            slice_one = np.arange((temp.shape[0]-np.floor(filter_lens[i]/2)),temp.shape[0],dtype=np.int32)
-            slice_two = np.arange(np.ceil(filter_lens[i]/2),dtype=np.int32)
-            temp[np.concatenate((slice_one,slice_two)),:] = signal[filter_range,:] * np.reshape(filter_bank[i][idx],(len(filter_bank[i]),1))
-
-            if phasemode == 'global':
-                fsNewBins = bw_bins[i]
-                fkBins = ctr_freqs[i]
-                displace = fkBins - np.floor(fkBins/fsNewBins) * fsNewBins
-                temp = np.roll(temp, int(displace))
-        
-            cqt.append(np.fft.ifft(temp, axis=0))
-            
-    # If coefficients are all teh same length, reshape the list into an ndarray
-    if np.max(bw_bins) == np.min(bw_bins):
-        cqt = np.asarray(cqt)
-        cqt = np.reshape(cqt, (int(bw_bins[0]),int(num_filters+1),int(num_channels)))
 
-    return cqt, sig_len
\ No newline at end of file
+    applied = np.arange(num_filters+1)
+    aliased = applied[bw_bins[applied] < filter_lens[applied]]
+    painless = applied[bw_bins[applied] >= filter_lens[applied]]
+
+    groups = []
+    for group_bw_bins in np.unique(bw_bins[painless]):
+        filters = painless[bw_bins[painless] == group_bw_bins]
+        lens = filter_lens[filters]
+        group_bw_bins = int(group_bw_bins)
+
+        # Position k of every filter, its row in the group and its offset
+        # in the concatenated filters
+        rows = np.repeat(np.arange(len(filters)), lens)
+        k = np.arange(np.sum(lens)) - np.repeat(np.cumsum(lens)-lens, lens)
+        lens = np.repeat(lens, lens)
+        half_floor = np.floor(lens/2)
+        half_ceil = np.ceil(lens/2)
+
+        # Filter samples, in the order of the zero-centered filter
+        idx = (k + half_ceil) % lens
+        weights = np.concatenate([filter_bank[i] for i in filters])
+        weights = weights[(np.repeat(np.cumsum(filter_lens[filters])-filter_lens[filters], filter_lens[filters]) + idx).astype(np.int64)]
+
+        # Frequencies of the spectrum they apply to
+        freqs = (np.repeat(ctr_freqs[filters], filter_lens[filters]) - half_floor + k) % sig_len+zpad_len
+
+        # Time channel slots they are written to
+        slots = (group_bw_bins - half_floor + k) % group_bw_bins
+        if phasemode == 'global':
+            fkBins = ctr_freqs[filters]
+            displace = (fkBins - np.floor(fkBins/group_bw_bins) * group_bw_bins).astype(np.int64)
+            slots = (slots + np.repeat(displace, filter_lens[filters])) % group_bw_bins
+
+        groups.append({'filters':filters,'bw_bins':group_bw_bins,'rows':rows,
+            'freqs':freqs.astype(np.int64),'slots':slots.astype(np.int64),'weights':weights})
+
+    plan = {'num_filters':num_filters,'bw_bins':bw_bins,'ctr_freqs':ctr_freqs,'zpad_len':zpad_len,
+        'groups':groups,'aliased':aliased}
+
+    return plan
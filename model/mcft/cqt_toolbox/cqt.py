@@ -3,7 +3,7 @@ from __future__ import print_function, division
 import numpy as np
 
 from model.mcft.cqt_toolbox.gen_filterbank import gen_filterbank
-from model.mcft.cqt_toolbox.apply_filterbank import apply_filterbank
+from model.mcft.cqt_toolbox.apply_filterbank import apply_filterbank, plan_filterbank
 
 def cqt(signal, bins_per_octave, samp_rate, fmin, fmax,
             rasterize='full', phasemode='global', outputFormat='sparse',
@@ -73,50 +73,129 @@ def cqt(signal, bins_per_octave, samp_rate, fmin, fmax,
     Translation from MATLAB by: Trent Cwiok (cwiok@u.northwestern.edu)
                                 Fatemeh Pishdadian (fpishdadian@u.northwestern.edu)
     '''
-    filter_bank,shift,bw_bins = gen_filterbank(fmin,fmax,bins_per_octave,samp_rate,len(signal), window_name=window_name, gamma=gamma)
-
-    num_filters = int(len(bw_bins)/2 -1)
-    ctr_freqs = samp_rate * np.cumsum(shift[1:]) / len(signal)
-    ctr_freqs = ctr_freqs[:num_filters]
-
-    # Assumes rasterize is full always
-    bw_bins[1:num_filters+1] = bw_bins[num_filters]
-    bw_bins[num_filters+2:] = bw_bins[num_filters:0:-1]
-
-    # Create a normalization vector
-    normalize = normalize.lower()
-    if normalize in ['sine','sin']:
-        normFacVec = 2 * bw_bins[:num_filters+2]/len(signal)
-    elif normalize in ['impulse','imp']:
-        filter_lens = np.zeros(len(filter_bank))
-        for i in range(len(g)):
-            filter_lens[i] = len(filter_bank[i])
-        normFacVec = 2 * bw_bins[:num_filters+2]/filter_lens
-    elif normalize in ['none','no']:
-        normFacVec = np.ones(num_filters+2)
-    else:
-        print("Unknown normalization method")
-
-    normFacVec = np.concatenate((normFacVec,normFacVec[len(normFacVec)-2:0:-1]))
-
-    # Apply normalization to the filterbank
-    for i in range(len(normFacVec)):
-        filter_bank[i] *= normFacVec[i]
-
-    if len(signal.shape) < 2:
-        signal.shape = (len(signal),1)
-
-    # Apply the normalized filterbank to the signal to compute the cqt
-    cqt,sig_len = apply_filterbank(signal,filter_bank,shift,phasemode,bw_bins)
-
-    # Assume rasterize is full always
-    # Seperate  the actual cqt from the zero and nyq coefficients needed for perfect reconstruction
-    cqt_DC = np.squeeze(cqt[0])
-    cqt_Nyq = np.squeeze(cqt[num_filters+1])
-    cqt = np.squeeze(np.asarray(cqt[1:num_filters+1]))
-
-    results = {'cqt':cqt,'filter_bank':filter_bank,'shift':shift,'bw_bins':bw_bins,'sig_len':sig_len,
-        'phasemode':phasemode,'rast':rasterize,'fmin':fmin,'fmax':fmax,
-        'bins_per_octave':bins_per_octave,'cqt_DC':cqt_DC,'cqt_Nyq':cqt_Nyq,'format':outputFormat,'ctr_freqs':ctr_freqs}
-
-    return results
+    plan = CQTPlan(bins_per_octave, samp_rate, fmin, fmax, len(signal),
+                   rasterize=rasterize, phasemode=phasemode, outputFormat=outputFormat,
+                   gamma=gamma, normalize=normalize, window_name=window_name)
+
+    return plan.apply(signal)
+
+
+class CQTPlan(object):
+    '''
+    Input parameters:
+          bins_per_octave   : Number of bins per octave
+          samp_rate         : Sampling frequency
+          fmin              : Lowest frequency to be analyzed
+          fmax              : Highest frequency to be analyzed
+          sig_len           : Length of the signals to be analyzed
+          **rasterize, **phasemode, **outputFormat, **gamma, **normalize,
+          **window_name     : As in cqt
+
+    **optional args
+
+    A CQT plan generates and normalizes the filter bank and the gather plan
+    of apply_filterbank once for a fixed set of parameters and signal length.
+    It can then be applied to any number of signals of that length, which
+    gives the same results as calling cqt on each of them.
+    '''
+
+    def __init__(self, bins_per_octave, samp_rate, fmin, fmax, sig_len,
+                 rasterize='full', phasemode='global', outputFormat='sparse',
+                 gamma=0, normalize='sine', window_name='hann'):
+        filter_bank,shift,bw_bins = gen_filterbank(fmin,fmax,bins_per_octave,samp_rate,sig_len, window_name=window_name, gamma=gamma)
+
+        num_filters = int(len(bw_bins)/2 -1)
+        ctr_freqs = samp_rate * np.cumsum(shift[1:]) / sig_len
+        ctr_freqs = ctr_freqs[:num_filters]
+
+        # Assumes rasterize is full always
+        bw_bins[1:num_filters+1] = bw_bins[num_filters]
+        bw_bins[num_filters+2:] = bw_bins[num_filters:0:-1]
+
+        # Create a normalization vector
+        normalize = normalize.lower()
+        if normalize in ['sine','sin']:
+            normFacVec = 2 * bw_bins[:num_filters+2]/sig_len
+        elif normalize in ['impulse','imp']:
+            filter_lens = np.zeros(len(filter_bank))
+            for i in range(len(filter_bank)):
+                filter_lens[i] = len(filter_bank[i])
+            normFacVec = 2 * bw_bins[:num_filters+2]/filter_lens[:num_filters+2]
+        elif normalize in ['none','no']:
+            normFacVec = np.ones(num_filters+2)
+        else:
+            print("Unknown normalization method")
+
+        normFacVec = np.concatenate((normFacVec,normFacVec[len(normFacVec)-2:0:-1]))
+
+        # Apply normalization to the filterbank
+        for i in range(len(normFacVec)):
+            filter_bank[i] *= normFacVec[i]
+
+        self.filter_bank = filter_bank
+        self.shift = shift
+        self.bw_bins = bw_bins
+        self.num_filters = num_filters
+        self.ctr_freqs = ctr_freqs
+        self.sig_len = sig_len
+        self.params = {'phasemode':phasemode,'rast':rasterize,'fmin':fmin,'fmax':fmax,
+            'bins_per_octave':bins_per_octave,'format':outputFormat}
+
+        # Indices of the filter bank application for this signal length
+        self.filterbank_plan = plan_filterbank(filter_bank,shift,phasemode,sig_len,bw_bins)
+
+    def apply(self, signal):
+        '''
+        Input parameters:
+              signal            : Real-valued signal of length sig_len
+
+        Output parameters:
+              results          : Dict with the same contents as the output
+                                 of cqt
+        '''
+        if len(signal) != self.sig_len:
+            raise ValueError('Expected a signal of length {}, got {}'.format(self.sig_len, len(signal)))
+
+        if len(signal.shape) < 2:
+            signal = np.reshape(signal, (len(signal),1))
+
+        # Apply the normalized filterbank to the signal to compute the cqt
+        cqt,sig_len = apply_filterbank(signal,self.filter_bank,self.shift,self.params['phasemode'],self.bw_bins,
+                                       plan=self.filterbank_plan)
+
+        # Assume rasterize is full always
+        # Seperate  the actual cqt from the zero and nyq coefficients needed for perfect reconstruction
+        num_filters = self.num_filters
+        cqt_DC = np.squeeze(cqt[0])
+        cqt_Nyq = np.squeeze(cqt[num_filters+1])
+        cqt = np.squeeze(np.asarray(cqt[1:num_filters+1]))
+
+        results = {'cqt':cqt,'filter_bank':self.filter_bank,'shift':self.shift,'bw_bins':self.bw_bins,'sig_len':sig_len,
+            'cqt_DC':cqt_DC,'cqt_Nyq':cqt_Nyq,'ctr_freqs':self.ctr_freqs}
+        results.update(self.params)
+
+        return results
+
+    def apply_batch(self, signals):
+        '''
+        Input parameters:
+              signals           : 2d ndarray of shape (num_signals, sig_len)
+
+        Output parameters:
+              cqt               : 3d ndarray of shape (num_signals,
+                                  num_bins, num_frames) containing the CQT
+                                  coefficients of each signal
+
+        The signals are transformed together as the channels of one
+        multichannel signal, so every FFT is batched over the signals.
+        '''
+        signals = np.asarray(signals)
+        if signals.ndim != 2 or signals.shape[1] != self.sig_len:
+            raise ValueError('Expected signals of shape (num_signals, {}), got {}'.format(self.sig_len, signals.shape))
+
+        cqt,_ = apply_filterbank(signals.T,self.filter_bank,self.shift,self.params['phasemode'],self.bw_bins,
+                                 plan=self.filterbank_plan)
+
+        # (num_bins, num_frames, num_signals) to (num_signals, num_bins, num_frames)
+        cqt = np.asarray(cqt[1:self.num_filters+1])
+        return np.transpose(cqt, (2, 0, 1))
@@ -129,7 +129,7 @@ def mcft(signal, cqt_params_in, filt_params_in=None,del_cqt_phase=0):
 
 
 
-def cqt_to_mcft(sig_cqt,fbank_scale_rate):
+def cqt_to_mcft(sig_cqt,fbank_scale_rate,dtype='complex128',chunk_size=None):
     """
     This function receives the time-frequency representation (CQT)
     of an audio signal (complex in general) and generates a 4-dimensional
@@ -141,6 +141,10 @@ def cqt_to_mcft(sig_cqt,fbank_scale_rate):
              representation of an audio signal (log scale frequency, e.g. CQT)
     fbank_scale_rate: 4d numpy array containing a bank of filters in the
              scale-rate domain
+    dtype: complex data type of the filtering and of the output (complex64 halves
+             the memory and roughly doubles the speed of the inverse transforms)
+    chunk_size: number of scale filters applied together in one batched inverse
+             transform (default: all of them)
 
     Ouptput:
     mcft_out: 4d numpy array containing the MCFT coefficients
@@ -151,28 +155,69 @@ def cqt_to_mcft(sig_cqt,fbank_scale_rate):
     # dimensions
     num_scale_ctrs, num_rate_ctrs, nfft_scale, nfft_rate = np.shape(fbank_scale_rate)
 
-    ### compute the MCFT coefficients
+    # allocate memory for the coefficients
+    mcft_out = np.zeros((num_scale_ctrs, num_rate_ctrs, nfft_scale, nfft_rate), dtype=dtype)
 
-    # 2D-Fourier transform of the time-frequency representation
-    sig_cqt_2dft = fft2(sig_cqt,[nfft_scale, nfft_rate])
+    for start, stop, sig_filt_tf in _filter_scale_rate(sig_cqt, fbank_scale_rate, dtype, chunk_size):
+        mcft_out[start:stop] = sig_filt_tf
 
-    # allocate memory for the coefficients
-    mcft_out = np.zeros((num_scale_ctrs, num_rate_ctrs, nfft_scale, nfft_rate), dtype='complex128')
+    return mcft_out
+
+
+def cqt_to_mcft_pooled(sig_cqt,fbank_scale_rate,dtype='complex64',chunk_size=4):
+    """
+    This function computes the mean magnitude of the MCFT coefficients of every
+    (scale,rate) filter, i.e. np.mean(np.abs(cqt_to_mcft(...)), axis=(2,3)),
+    without materializing the 4-dimensional output. The filters are applied
+    in chunks of scale filters, each with one batched inverse 2d-FFT.
+
+    Inputs:
+    sig_cqt: 2d numpy array containing the (complex) time-frequency
+             representation of an audio signal (log scale frequency, e.g. CQT)
+    fbank_scale_rate: 4d numpy array containing a bank of filters in the
+             scale-rate domain
+    dtype: complex data type of the filtering
+    chunk_size: number of scale filters applied together
+
+    Ouptput:
+    mcft_pooled: 2d numpy array (scale,rate) containing the mean magnitude of
+             the MCFT coefficients
+    """
 
-    for i in range(num_scale_ctrs):
-        for j in range(num_rate_ctrs):
+    num_scale_ctrs, num_rate_ctrs = np.shape(fbank_scale_rate)[:2]
 
-            # extract the current filter
-            filt_sr_temp = fbank_scale_rate[i,j,:,:]
+    mcft_pooled = np.zeros((num_scale_ctrs, num_rate_ctrs), dtype=np.finfo(dtype).dtype)
 
-            # filter the signal in the scale-rate domain
-            sig_filt_sr = sig_cqt_2dft * filt_sr_temp
+    for start, stop, sig_filt_tf in _filter_scale_rate(sig_cqt, fbank_scale_rate, dtype, chunk_size):
+        mcft_pooled[start:stop] = np.mean(np.abs(sig_filt_tf), axis=(2, 3))
 
-            # convert back to the time-frequency domain
-            sig_filt_tf = ifft2(sig_filt_sr)
-            mcft_out[i,j,:,:] = sig_filt_tf
+    return mcft_pooled
 
-    return mcft_out
 
+def _filter_scale_rate(sig_cqt,fbank_scale_rate,dtype,chunk_size):
+    """
+    This function filters the 2d-Fourier transform of the time-frequency
+    representation with chunks of the filterbank, and yields the start and stop
+    scale index of each chunk and its filtered time-frequency representation
+    (a 4d array).
+    """
+
+    num_scale_ctrs, _, nfft_scale, nfft_rate = np.shape(fbank_scale_rate)
+    if chunk_size is None:
+        chunk_size = num_scale_ctrs
+
+    # 2D-Fourier transform of the time-frequency representation
+    sig_cqt_2dft = fft2(sig_cqt,[nfft_scale, nfft_rate]).astype(dtype, copy=False)
+
+    for start in range(0, num_scale_ctrs, chunk_size):
+        stop = min(start + chunk_size, num_scale_ctrs)
+
+        # filter the signal in the scale-rate domain
+        fbank_chunk = np.asarray(fbank_scale_rate[start:stop], dtype=dtype)
+        sig_filt_sr = fbank_chunk * sig_cqt_2dft
 
+        # convert back to the time-frequency domain (single precision input
+        # is transformed in single precision)
+        sig_filt_tf = ifft2(sig_filt_sr, axes=(-2, -1), overwrite_x=True)
 
+        yield start, stop, sig_filt_tf
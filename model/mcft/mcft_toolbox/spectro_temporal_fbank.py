@@ -1,7 +1,7 @@
 import numpy as np
 from scipy.fftpack import fft,ifft,fft2,ifft2,helper
 
-def gen_fbank_scale_rate(scale_ctrs,rate_ctrs,nfft_scale,nfft_rate,filt_params,comp_specgram=None):
+def gen_fbank_scale_rate(scale_ctrs,rate_ctrs,nfft_scale,nfft_rate,filt_params,comp_specgram=None,comp_tf_domain=True):
     """
     This function generates a scale-rate domain bank of up-/down-ward,filters.
     The filterbank will be tuned to the passband of a target signal if specified.
@@ -20,6 +20,10 @@ def gen_fbank_scale_rate(scale_ctrs,rate_ctrs,nfft_scale,nfft_rate,filt_params,c
                     If provided, the function will return a filterbank that is modulated with the
                     phase of the spectrogram. Otherwise, the function will return the original set
                     of filters.
+    comp_tf_domain: boolean indicating whether the time-frequency-domain filterbank is returned.
+                    If False, None is returned in its place and, without comp_specgram, the
+                    scale-rate-domain filterbank is computed without transforming the filters
+                    back from the time-frequency domain (equal up to rounding errors).
 
     Output:
     fbank_tf_domain: numpy array of size [num_scale_ctr, 2*num_ref_ctr, nfft_scale, nfft_rate] containing
@@ -31,6 +35,9 @@ def gen_fbank_scale_rate(scale_ctrs,rate_ctrs,nfft_scale,nfft_rate,filt_params,c
           [num_freq_bin,num_time_frame] = np.shape(spectrogram)
     Note: the first and last filters in the scale and rate ranges are assumed
           to be lowpass and highpass respectively
+    Note: the 2d filters are quadrant separable, so the scale and rate responses are computed
+          once per filter center, the impulse responses are formed from 1d inverse transforms,
+          and the filterbank is filled in place one scale filter center at a time
 
     Author: Fatemeh Pishdadian (fpishdadian@u.northwestern.edu)
     """
@@ -57,6 +64,49 @@ def gen_fbank_scale_rate(scale_ctrs,rate_ctrs,nfft_scale,nfft_rate,filt_params,c
     scale_params = {'scale_filt_len': nfft_scale, 'samprate_spec': samprate_spec}
     rate_params = {'time_const': beta, 'rate_filt_len': nfft_rate, 'samprate_temp': samprate_temp}
 
+    ### Generate the 1d responses
+
+    scale_filt_fft = np.zeros((num_scale_ctrs, nfft_scale), dtype='complex128')
+    for i in range(num_scale_ctrs): # iterate over scale filter centers
+        scale_params['type'] = filt_type(i, num_scale_ctrs)
+        scale_filt_fft[i] = gen_scale_response(scale_ctrs[i], scale_params)
+
+    rate_filt_fft = np.zeros((num_rate_ctrs, nfft_rate), dtype='complex128')
+    for j in range(num_rate_ctrs): # iterate over rate filter centers
+        rate_params['type'] = filt_type(j, num_rate_ctrs)
+        rate_filt_fft[j] = gen_rate_response(rate_ctrs[j], rate_params)
+
+    ### Split the 1d responses at DC and nyquist
+
+    # the direction masks keep whole blocks of the scale-rate plane, so every masked filter
+    # is a sum of three outer products: [s_dc, s_pos, s_neg] x [r, r_dc + r_neg, r_dc + r_pos]
+    # for the upward and [s_dc, s_pos, s_neg] x [r, r_dc + r_pos, r_dc + r_neg] for the downward
+    half_scale = int(nfft_scale/2)
+    half_rate = int(nfft_rate/2)
+
+    scale_parts = np.zeros((num_scale_ctrs, 3, nfft_scale), dtype='complex128')
+    scale_parts[:, 0, 0] = scale_filt_fft[:, 0]
+    scale_parts[:, 1, 1:half_scale+1] = scale_filt_fft[:, 1:half_scale+1]
+    scale_parts[:, 2, half_scale+1::] = scale_filt_fft[:, half_scale+1::]
+
+    rate_dc = np.zeros((num_rate_ctrs, nfft_rate), dtype='complex128')
+    rate_dc[:, 0] = rate_filt_fft[:, 0]
+    rate_pos = np.zeros((num_rate_ctrs, nfft_rate), dtype='complex128')
+    rate_pos[:, 1:half_rate+1] = rate_filt_fft[:, 1:half_rate+1]
+    rate_neg = rate_filt_fft - rate_dc - rate_pos
+
+    rate_parts_up = np.stack((rate_filt_fft, rate_dc + rate_neg, rate_dc + rate_pos), axis=1)
+    rate_parts_down = np.stack((rate_filt_fft, rate_dc + rate_pos, rate_dc + rate_neg), axis=1)
+
+    # impulse responses of the parts (the 2d inverse transform of an outer product
+    # is the outer product of the 1d inverse transforms)
+    scale_parts_tf = ifft(scale_parts, axis=-1)
+    rate_parts_tf = {'up': ifft(rate_parts_up, axis=-1), 'down': ifft(rate_parts_down, axis=-1)}
+
+    # normalization factors: the maximum magnitude of each outer product
+    scale_max = np.max(np.abs(scale_filt_fft), axis=1)
+    rate_max = np.max(np.abs(rate_filt_fft), axis=1)[:, np.newaxis, np.newaxis]
+
     ### Generate the filterbank
 
     # filter modulation factor (pre-filtering stage)
@@ -68,51 +118,91 @@ def gen_fbank_scale_rate(scale_ctrs,rate_ctrs,nfft_scale,nfft_rate,filt_params,c
         # otherwise fft phase difference results in large error values
         #spec_phase = np.angle(comp_specgram) * (np.abs(comp_specgram)>1e-10)
         filt_mod_factor = np.exp(1j * spec_phase)
+
+    fbank_sr_domain = np.zeros((num_scale_ctrs, 2 * num_rate_ctrs, nfft_scale, nfft_rate), dtype='complex128')
+    if comp_tf_domain:
+        fbank_tf_domain = np.zeros((num_scale_ctrs, 2 * num_rate_ctrs, nfft_scale, nfft_rate), dtype='complex128')
     else:
-        filt_mod_factor = 1
+        fbank_tf_domain = None
 
+    # upward filters in reverse order of rate centers, then downward filters
+    filt_dirs = [('up', slice(num_rate_ctrs - 1, None, -1)),
+                 ('down', slice(num_rate_ctrs, 2 * num_rate_ctrs))]
 
-    fbank_tf_domain = np.zeros((num_scale_ctrs, 2 * num_rate_ctrs, nfft_scale, nfft_rate),dtype='complex128')
-    fbank_sr_domain = np.zeros((num_scale_ctrs, 2 * num_rate_ctrs, nfft_scale, nfft_rate),dtype='complex128')
+    for i in range(num_scale_ctrs): # iterate over scale filter centers, one chunk of filters at a time
 
-    for i in range(num_scale_ctrs): # iterate over scale filter centers
+        filt_norm = scale_max[i] * rate_max
 
-        if i == 0:
-            scale_params['type'] = 'lowpass'
-        elif i == num_scale_ctrs - 1:
-            scale_params['type'] = 'highpass'
-        else:
-            scale_params['type'] = 'bandpass'
+        for filt_dir, filt_idx in filt_dirs:
 
-        for j in range(num_rate_ctrs): # iterate over rate filter centers
+            # impulse responses, real-valued where the imaginary parts are negligible
+            filt_tf = np.matmul(scale_parts_tf[i].T, rate_parts_tf[filt_dir]) / filt_norm
+            real_filts = np.max(np.imag(filt_tf), axis=(1, 2)) < 1e-8
+            filt_tf[real_filts] = np.real(filt_tf[real_filts])
 
-            if j == 0:
-                rate_params['type'] = 'lowpass'
-            elif j == num_rate_ctrs -1:
-                rate_params['type'] = 'highpass'
+            if mod_filter:
+                filt_tf *= filt_mod_factor
+                filt_sr = fft2(filt_tf, axes=(-2, -1))
             else:
-                rate_params['type'] = 'bandpass'
+                # discarding the imaginary part of an impulse response keeps the hermitian part
+                # of its transform, so the transform back to the scale-rate domain is not needed
+                filt_sr = scale_filt_fft[i, np.newaxis, :, np.newaxis] * rate_filt_fft[:, np.newaxis, :]
+                filt_sr *= sr_direction_mask(nfft_scale, nfft_rate, filt_dir)
+                filt_sr /= filt_norm
+                filt_sr[real_filts] = hermitian_part(filt_sr[real_filts])
 
+            fbank_sr_domain[i, filt_idx] = filt_sr
+            if comp_tf_domain:
+                fbank_tf_domain[i, filt_idx] = filt_tf
 
-            # generate two analytic filters (one upward and one downward)
-            # for the current (scale_ctr, rate_ctr)
+    return fbank_tf_domain, fbank_sr_domain
 
-            # upward
-            filt_tf_up, _ = gen_filt_scale_rate(scale_ctrs[i], rate_ctrs[j], scale_params, rate_params, 'up')
-            filt_tf_up_mod = filt_tf_up * filt_mod_factor
-            fbank_tf_domain[i, num_rate_ctrs - j - 1,:,:] = filt_tf_up_mod
-            filt_sr_up = fft2(filt_tf_up_mod)
-            fbank_sr_domain[i, num_rate_ctrs - j - 1,:,:] = filt_sr_up
 
-            # downward
-            filt_tf_down, _ = gen_filt_scale_rate(scale_ctrs[i], rate_ctrs[j], scale_params, rate_params, 'down')
-            filt_tf_down_mod = filt_tf_down * filt_mod_factor
-            fbank_tf_domain[i, num_rate_ctrs + j, :, :] = filt_tf_down_mod
-            filt_sr_down = fft2(filt_tf_down_mod)
-            fbank_sr_domain[i, num_rate_ctrs + j, :, :] = filt_sr_down
 
+def filt_type(idx, num_ctrs):
+    """
+    This function returns the type of the filter at position idx among num_ctrs filter centers:
+    the first filter is lowpass, the last one highpass and the others bandpass.
+    """
+
+    if idx == 0:
+        return 'lowpass'
+    elif idx == num_ctrs - 1:
+        return 'highpass'
+    else:
+        return 'bandpass'
 
-    return fbank_tf_domain, fbank_sr_domain
+
+
+def hermitian_part(filt_sr):
+    """
+    This function returns the hermitian part of 2d Fourier transforms (along the last two axes),
+    i.e. the transform of the real part of the corresponding 2d signals.
+    """
+
+    filt_sr_flip = np.roll(filt_sr[..., ::-1, ::-1], 1, axis=(-2, -1))
+
+    return (filt_sr + np.conj(filt_sr_flip)) / 2
+
+
+
+def sr_direction_mask(scale_filt_len, rate_filt_len, filt_dir):
+    """
+    This function returns a binary mask of the quadrants of the scale-rate domain kept by
+    the 'up' (2nd and 4th quadrants) or 'down' (1st and 3rd quadrants) analytic filters.
+    """
+
+    mask = np.ones((scale_filt_len, rate_filt_len))
+
+    if filt_dir == 'up':
+        mask[1:int(scale_filt_len/2)+1, 1:int(rate_filt_len/2)+1] = 0
+        mask[int(scale_filt_len/2)+1::,int(rate_filt_len/2)+1::] = 0
+
+    elif filt_dir == 'down':
+        mask[1:int(scale_filt_len/2)+1,int(rate_filt_len/2)+1::] = 0
+        mask[int(scale_filt_len/2)+1::,1:int(rate_filt_len/2)+1] = 0
+
+    return mask
 
 
 
@@ -159,53 +249,77 @@ def gen_filt_scale_rate(scale_ctr, rate_ctr, scale_params, rate_params, filt_dir
     Author: Fatemeh Pishdadian (fpishdadian@u.northwestern.edu)
     """
 
-    ### extract filter parameters
+    # zero-pad filters to the next 5-smooth number
+    scale_filt_len = helper.next_fast_len(scale_params['scale_filt_len']) # scale_filt_len + np.mod(scale_filt_len, 2)
+    rate_filt_len = helper.next_fast_len(rate_params['rate_filt_len']) # rate_filt_len + np.mod(rate_filt_len, 2)
 
-    # scale filter
-    scale_filt_len = scale_params['scale_filt_len']
-    samprate_spec = scale_params['samprate_spec']
-    scale_filt_type = scale_params['type']
+    ### scale and rate responses (Fourier transforms of the impulse responses)
+    scale_filt_fft = gen_scale_response(scale_ctr, scale_params)
+    rate_filt_fft = gen_rate_response(rate_ctr, rate_params)
 
-    # rate filter
-    beta = rate_params['time_const']
-    rate_filt_len = rate_params['rate_filt_len']
-    samprate_temp = rate_params['samprate_temp']
-    rate_filt_type = rate_params['type']
+    ### full scale-rate impulse and transform responses
 
-    ### frequency and time vectors
+    # filt_sr_full is quadrant separable
+    scale_filt_fft = np.expand_dims(scale_filt_fft,axis=1)
+    rate_filt_fft = np.expand_dims(rate_filt_fft,axis=0)
 
-    # zero-pad filters to the next 5-smooth number
-    scale_filt_len = helper.next_fast_len(scale_filt_len) # scale_filt_len + np.mod(scale_filt_len, 2)
-    rate_filt_len = helper.next_fast_len(rate_filt_len) # rate_filt_len + np.mod(rate_filt_len, 2)
+    filt_sr_full = np.matmul(scale_filt_fft, rate_filt_fft)
 
-    # generate frequency and time vectors
-    freq_vec = np.arange(scale_filt_len,dtype='float64')/samprate_spec
-    time_vec = np.arange(rate_filt_len,dtype='float64')/samprate_temp
+
+    # normalize the filter magnitude
+    filt_sr_full_mag = np.abs(filt_sr_full)
+    filt_sr_full_mag /= np.max(filt_sr_full_mag)
+
+    filt_sr_full_phase = np.angle(filt_sr_full)
+    filt_sr_full = filt_sr_full_mag * np.exp(1j * filt_sr_full_phase)
+
+
+    # upward or downward direction
+    if filt_dir in ('up', 'down'):
+        filt_sr_domain = filt_sr_full * sr_direction_mask(scale_filt_len, rate_filt_len, filt_dir)
+
+    else:
+        filt_sr_domain = filt_sr_full
+
+
+    filt_tf_domain = ifft2(filt_sr_domain)
+
+    if np.max(np.imag(filt_tf_domain)) < 1e-8:
+        filt_tf_domain = np.real(filt_tf_domain)
 
 
+    return filt_tf_domain, filt_sr_domain
+
+
+def gen_scale_response(scale_ctr, scale_params):
+    """
+    This function generates the Fourier transform of the spectral (Gaussian) impulse
+    response with filter center scale_ctr.
+
+    Inputs:
+    scale_ctr: filter center along the scale axis
+    scale_params: dictionary containing the parameters of the spectral filter (see gen_filt_scale_rate)
+
+    Output:
+    scale_filt_fft: numpy array containing the (real-valued) scale response
+    """
+
+    scale_filt_len = helper.next_fast_len(scale_params['scale_filt_len'])
+    samprate_spec = scale_params['samprate_spec']
+    scale_filt_type = scale_params['type']
+
+    freq_vec = np.arange(scale_filt_len,dtype='float64')/samprate_spec
+
     ### impulse response of the original scale filter: Gaussian
     scale_filt = scale_ctr * (1 - 2 * (scale_ctr * np.pi * freq_vec)**2) * np.exp(-((scale_ctr * freq_vec * np.pi)**2))
     # make it even so the transform is real
     scale_filt = np.append(scale_filt[0:int(scale_filt_len/2)+1],scale_filt[int(scale_filt_len/2)-1:0:-1])
 
-    ### impulse response of the original rate filter
-    rate_filt = rate_ctr * (rate_ctr*time_vec)**2 * np.exp(-time_vec * beta * rate_ctr) * np.sin(2 * np.pi * rate_ctr * time_vec)
-    # remove the DC element
-    rate_filt = rate_filt - np.mean(rate_filt)
-    # if the magnitude of dc element is set to zero by subtracting the mean of hr, make sure the phase is
-    # also set to zero to avoid any computational error
-    if np.abs(np.mean(rate_filt)) < 1e-16:
-        correct_rate_phase = 1
-    else:
-        correct_rate_phase = 0
-
-    ### scale response (Fourier transform of the scale impulse response)
-
     # bandpass scale filter
     scale_filt_fft = np.abs(fft(scale_filt,n=scale_filt_len)).astype('complex128') # discard negligible imaginary parts
 
     # low/high-pass scale filter
-    if scale_filt_type is not 'bandpass':
+    if scale_filt_type != 'bandpass':
         scale_filt_fft_1 = scale_filt_fft[0:int(scale_filt_len/2)+1]
         scale_filt_fft_1 /= np.max(scale_filt_fft_1)
         max_idx_1 = np.squeeze(np.argwhere(scale_filt_fft_1 == np.max(scale_filt_fft_1)))
@@ -215,26 +329,57 @@ def gen_filt_scale_rate(scale_ctr, rate_ctr, scale_params, rate_params, filt_dir
         max_idx_2 = np.squeeze(np.argwhere(scale_filt_fft_2 == np.max(scale_filt_fft_2)))
 
 
-        if scale_filt_type is 'lowpass':
+        if scale_filt_type == 'lowpass':
             scale_filt_fft_1[0:max_idx_1] = 1
             scale_filt_fft_2[max_idx_2+1::] = 1
 
-        elif scale_filt_type is 'highpass':
+        elif scale_filt_type == 'highpass':
             scale_filt_fft_1[max_idx_1+1::] = 1
             scale_filt_fft_2[0:max_idx_2] = 1
 
         # form the full magnitude spectrum
         scale_filt_fft = np.append(scale_filt_fft_1, scale_filt_fft_2)
 
+    return scale_filt_fft
 
 
-    ### rate response (Fourier transform of the rate impulse response)
+
+def gen_rate_response(rate_ctr, rate_params):
+    """
+    This function generates the Fourier transform of the temporal (gamma-tone) impulse
+    response with filter center rate_ctr.
+
+    Inputs:
+    rate_ctr: filter center along the rate axis
+    rate_params: dictionary containing the parameters of the temporal filter (see gen_filt_scale_rate)
+
+    Output:
+    rate_filt_fft: numpy array containing the (complex) rate response
+    """
+
+    beta = rate_params['time_const']
+    rate_filt_len = helper.next_fast_len(rate_params['rate_filt_len'])
+    samprate_temp = rate_params['samprate_temp']
+    rate_filt_type = rate_params['type']
+
+    time_vec = np.arange(rate_filt_len,dtype='float64')/samprate_temp
+
+    ### impulse response of the original rate filter
+    rate_filt = rate_ctr * (rate_ctr*time_vec)**2 * np.exp(-time_vec * beta * rate_ctr) * np.sin(2 * np.pi * rate_ctr * time_vec)
+    # remove the DC element
+    rate_filt = rate_filt - np.mean(rate_filt)
+    # if the magnitude of dc element is set to zero by subtracting the mean of hr, make sure the phase is
+    # also set to zero to avoid any computational error
+    if np.abs(np.mean(rate_filt)) < 1e-16:
+        correct_rate_phase = 1
+    else:
+        correct_rate_phase = 0
 
     # band-pass rate filter
     rate_filt_fft = fft(rate_filt, n=rate_filt_len) # rate response is complex
 
     # low/high-pass rate filter
-    if rate_filt_type is not 'bandpass':
+    if rate_filt_type != 'bandpass':
         rate_filt_phase = np.unwrap(np.angle(rate_filt_fft))
         if correct_rate_phase:
             rate_filt_phase[0] = 0
@@ -248,11 +393,11 @@ def gen_filt_scale_rate(scale_ctr, rate_ctr, scale_params, rate_params, filt_dir
         rate_filt_mag_2 /= np.max(rate_filt_mag_2)
         max_idx_2 = np.squeeze(np.argwhere(rate_filt_mag_2 == np.max(rate_filt_mag_2)))
 
-        if rate_filt_type is 'lowpass':
+        if rate_filt_type == 'lowpass':
             rate_filt_mag_1[0:max_idx_1] = 1
             rate_filt_mag_2[max_idx_2+1::] = 1
 
-        elif rate_filt_type is 'highpass':
+        elif rate_filt_type == 'highpass':
             rate_filt_mag_1[max_idx_1+1::] = 1
             rate_filt_mag_2[0:max_idx_2+1] = 1
 
@@ -261,50 +406,7 @@ def gen_filt_scale_rate(scale_ctr, rate_ctr, scale_params, rate_params, filt_dir
         # form the full Fourier transform
         rate_filt_fft = rate_filt_mag * np.exp(1j * rate_filt_phase)
 
-
-    ### full scale-rate impulse and transform responses
-
-    # filt_sr_full is quadrant separable
-    scale_filt_fft = np.expand_dims(scale_filt_fft,axis=1)
-    rate_filt_fft = np.expand_dims(rate_filt_fft,axis=0)
-
-    filt_sr_full = np.matmul(scale_filt_fft, rate_filt_fft)
-
-
-    # normalize the filter magnitude
-    filt_sr_full_mag = np.abs(filt_sr_full)
-    filt_sr_full_mag /= np.max(filt_sr_full_mag)
-
-    filt_sr_full_phase = np.angle(filt_sr_full)
-    filt_sr_full = filt_sr_full_mag * np.exp(1j * filt_sr_full_phase)
-
-
-    # upward or downward direction
-    if filt_dir is 'up':
-        # compute the upward version of the scale-rate response
-        filt_sr_up = filt_sr_full
-        filt_sr_up[1:int(scale_filt_len/2)+1, 1:int(rate_filt_len/2)+1] = 0
-        filt_sr_up[int(scale_filt_len/2)+1::,int(rate_filt_len/2)+1::] = 0
-        filt_sr_domain = filt_sr_up
-
-    elif filt_dir is 'down':
-        # compute the downward version of the scale-rate response
-        filt_sr_down = filt_sr_full
-        filt_sr_down[1:int(scale_filt_len/2)+1,int(rate_filt_len/2)+1::] = 0
-        filt_sr_down[int(scale_filt_len/2)+1::,1:int(rate_filt_len/2)+1] = 0
-        filt_sr_domain = filt_sr_down
-
-    else:
-        filt_sr_domain = filt_sr_full
-
-
-    filt_tf_domain = ifft2(filt_sr_domain)
-
-    if np.max(np.imag(filt_tf_domain)) < 1e-8:
-        filt_tf_domain = np.real(filt_tf_domain)
-
-
-    return filt_tf_domain, filt_sr_domain
+    return rate_filt_fft
 
 
 # ToDo add Smin, Smax, Rmin and Rmax to parameters and an option for using them instead of automatically
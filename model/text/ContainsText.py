@@ -16,6 +16,18 @@ class ContainsText(TextHandler):
         '''
         self.query_text = query_text.lower()
 
+    def candidate_handles(self, text_index):
+        '''
+        Retrieves the handles whose text features may contain query_text.
+
+        Arguments:
+            text_index: A TextIndex. The index over the dataset text features.
+
+        Returns:
+            A python list of handles.
+        '''
+        return text_index.search(self.query_text)
+
     def _is_match(self, text_features):
         '''
         Returns true if text_features and query_text match. If query_text is an
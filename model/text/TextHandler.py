@@ -33,6 +33,20 @@ class TextHandler(ABC):
             raise ValueError(message)
         return self._is_match(text_features)
 
+    def candidate_handles(self, text_index):
+        '''
+        Retrieves the handles that may match query_text from an inverted text
+        index, so that is_match is only evaluated on those. Handlers whose
+        matches cannot be looked up in the index return None.
+
+        Arguments:
+            text_index: A TextIndex. The index over the dataset text features.
+
+        Returns:
+            A python list of handles or None.
+        '''
+        return None
+
     @abstractmethod
     def set_query_text(self, query_text):
         '''
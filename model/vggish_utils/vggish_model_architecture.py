@@ -69,6 +69,11 @@ class VGGish2s(nn.Module):
 
     def forward(self, x):
 
+        out_conv4_1, out_conv4_2 = self.features(x)
+        return self.embed(out_conv4_1, out_conv4_2)
+
+    def features(self, x):
+
         x = x.view(x.size(0), 1, x.size(1), x.size(2))
         out = self.layer1_conv1(x)
         out = self.layer2_pool1(out)
@@ -80,13 +85,18 @@ class VGGish2s(nn.Module):
         out = self.layer6_conv3_2(out)
 
         out = self.layer7_pool3(out)
-        out = self.layer8_conv4_1(out)
-        out_emb1 = torch.mean(out, dim=0)
-        out_emb1 = out_emb1.view(out_emb1.size(0), -1)
+        out_conv4_1 = self.layer8_conv4_1(out)
+        out_conv4_2 = self.layer9_conv4_2(out_conv4_1)
 
+        return out_conv4_1, out_conv4_2
 
-        out = self.layer9_conv4_2(out)
-        out_emb2 = torch.mean(out, dim=0)
+    def embed(self, out_conv4_1, out_conv4_2):
+
+        # average over the examples of one clip
+        out_emb1 = torch.mean(out_conv4_1, dim=0)
+        out_emb1 = out_emb1.view(out_emb1.size(0), -1)
+
+        out_emb2 = torch.mean(out_conv4_2, dim=0)
         out_emb2 = out_emb2.view(out_emb2.size(0), -1)
 
         out = torch.cat((out_emb1, out_emb2), dim=1)
@@ -0,0 +1,167 @@
+import librosa
+import os
+import queue
+import threading
+import time
+from log import get_logger
+
+
+class QueryArchiver(object):
+    '''
+    Saves user queries to disk in background threads, so that slow disk writes
+    do not delay search requests. Pending queries wait in a bounded queue. If
+    the queue is full, queries are dropped according to the drop policy.
+    '''
+
+    def __init__(
+        self,
+        query_directory,
+        queue_size=64,
+        num_workers=1,
+        drop_policy='drop_newest',
+        block_timeout=0.1,
+        raw=False):
+        '''
+        QueryArchiver constructor.
+
+        Arguments:
+            query_directory: A string. The directory queries are saved to.
+            queue_size: An int. The maximum number of queries waiting to be
+                written.
+            num_workers: An int. The number of writer threads.
+            drop_policy: A string. What happens to a query arriving at a full
+                queue. One of
+                    - 'drop_newest': the arriving query is dropped.
+                    - 'drop_oldest': the oldest waiting query is dropped.
+                    - 'block': the request waits up to block_timeout seconds
+                        for space in the queue, then the arriving query is
+                        dropped.
+            block_timeout: A float. The number of seconds a request waits for
+                space in the queue. Unused unless drop_policy is 'block'.
+            raw: A boolean. If True, queries are saved as the raw float32
+                samples received from the client (.f32 files) instead of
+                being encoded as WAV.
+        '''
+        if drop_policy not in ('drop_newest', 'drop_oldest', 'block'):
+            raise ValueError('Drop policy {} is not defined'.format(
+                drop_policy))
+
+        self.logger = get_logger('QueryArchiver')
+
+        self.query_directory = query_directory
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.raw = raw
+        self.num_dropped = 0
+
+        # Make the query directory if it doesn't exist
+        try:
+            os.makedirs(query_directory)
+        except OSError:
+            pass
+
+        self.queue_size = queue_size
+        self.num_workers = num_workers
+        self.queue = None
+        self.workers = []
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def save(self, query, sampling_rate, text_input):
+        '''
+        Queues a query to be saved. Returns without waiting for the write.
+
+        Arguments:
+            query: A 1D numpy array. The vocal query.
+            sampling_rate: An integer. The sampling rate of the query.
+            text_input: A string. The user's text query.
+
+        Returns:
+            A boolean. False if the query was dropped.
+        '''
+        self._start()
+
+        item = (time.time(), query, sampling_rate, text_input)
+        try:
+            if self.drop_policy == 'block':
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        if self.drop_policy == 'drop_oldest':
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self._dropped()
+                self.queue.put_nowait(item)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+
+        self._dropped()
+        return False
+
+    def close(self):
+        '''
+        Waits for the queued queries to be written and stops the writer
+        threads.
+        '''
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        self.pid = None
+
+    def _start(self):
+        # Threads do not survive a fork, so the writers are started on first
+        # use in each process
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self.workers = [
+                threading.Thread(target=self._work, daemon=True)
+                for _ in range(self.num_workers)]
+            for worker in self.workers:
+                worker.start()
+            self.pid = os.getpid()
+
+    def _dropped(self):
+        self.num_dropped += 1
+        self.logger.warning('Query archive queue is full. {} queries \
+            dropped so far.'.format(self.num_dropped))
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception:
+                self.logger.exception('Failed to save query')
+            finally:
+                self.queue.task_done()
+
+    def _write(self, timestamp, query, sampling_rate, text_input):
+        start = time.time()
+        name = str(int(timestamp)) + '_' + text_input
+        if self.raw:
+            # The sampling rate is kept in the filename
+            filepath = os.path.join(
+                self.query_directory,
+                '{}.{}.f32'.format(name, sampling_rate))
+            with open(filepath, 'wb') as file:
+                file.write(query.astype('float32').tobytes())
+        else:
+            filepath = os.path.join(self.query_directory, name + '.wav')
+            librosa.output.write_wav(filepath, query, sampling_rate)
+
+        self.logger.debug('Saved query in {} seconds'.format(
+            time.time() - start))
@@ -0,0 +1,93 @@
+import collections
+import hashlib
+import numpy as np
+import threading
+import time
+
+
+class QueryCache(object):
+    '''
+    A thread-safe least-recently-used cache with an optional time-to-live.
+    Used by Voogle to reuse the representations, and optionally the search
+    results, of queries that are submitted more than once.
+    '''
+
+    def __init__(self, size, ttl=None):
+        '''
+        QueryCache constructor.
+
+        Arguments:
+            size: An int. The maximum number of entries kept.
+            ttl: A float or None. The number of seconds an entry remains
+                valid. If None, entries are only evicted when the cache is
+                full.
+        '''
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        '''
+        Retrieves a cached value.
+
+        Arguments:
+            key: A hashable object. The key of the value.
+
+        Returns:
+            The cached value, or None if the key is absent or expired.
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            value, expiry = entry
+            if expiry is not None and expiry < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        '''
+        Adds a value to the cache, evicting the least recently used entry if
+        the cache is full.
+
+        Arguments:
+            key: A hashable object. The key of the value.
+            value: The value to cache.
+        '''
+        expiry = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            self.entries[key] = (value, expiry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        Removes all entries.
+        '''
+        with self.lock:
+            self.entries.clear()
+
+
+def hash_audio(audio, sampling_rate):
+    '''
+    Computes a key identifying a decoded audio signal.
+
+    Arguments:
+        audio: A 1D numpy array. The audio samples.
+        sampling_rate: An integer. The sampling rate of the audio.
+
+    Returns:
+        A string. The hex digest of the samples and sampling rate.
+    '''
+    digest = hashlib.sha1(str(sampling_rate).encode())
+    digest.update(np.ascontiguousarray(audio, dtype='float32').tobytes())
+    return digest.hexdigest()
@@ -0,0 +1,141 @@
+import argparse
+import json
+import librosa
+import numpy as np
+import os
+import yaml
+from factory import voogle_factory
+
+
+def ranking_agreement(reference, candidate, queries, k=15):
+    '''
+    Measures how closely the search results of a candidate query-by-voice
+    system follow those of a reference system, e.g., a quantized model or
+    reduced-precision representations against their float version.
+
+    Arguments:
+        reference: A Voogle object. The system whose rankings are taken as
+            ground truth.
+        candidate: A Voogle object. The system being evaluated.
+        queries: A python list of tuples. The audio and sampling rate of each
+            vocal query.
+        k: An int. The number of top matches compared per query.
+
+    Returns:
+        A dict with keys
+            - 'queries': The number of queries.
+            - 'overlap': The mean fraction of the reference top-k matches
+                that are also in the candidate top-k.
+            - 'top1': The fraction of queries with the same best match.
+            - 'rank_displacement': The mean absolute difference in rank of
+                the matches shared by both top-k lists.
+    '''
+    reference.matches = k
+    candidate.matches = k
+
+    overlaps = []
+    top1 = []
+    displacements = []
+    for query, sampling_rate in queries:
+        _, reference_matches, _, _ = reference.search(query, sampling_rate)
+        _, candidate_matches, _, _ = candidate.search(query, sampling_rate)
+
+        candidate_ranks = {m: i for i, m in enumerate(candidate_matches)}
+        shared = [m for m in reference_matches if m in candidate_ranks]
+
+        overlaps.append(len(shared) / max(1, len(reference_matches)))
+        top1.append(reference_matches[:1] == candidate_matches[:1])
+        displacements.extend(
+            abs(i - candidate_ranks[m])
+            for i, m in enumerate(reference_matches) if m in candidate_ranks)
+
+    def mean(values):
+        return sum(values) / len(values) if values else None
+
+    return {
+        'queries': len(queries),
+        'overlap': mean(overlaps),
+        'top1': mean(top1),
+        'rank_displacement': mean(displacements)
+    }
+
+
+def load_queries(query_directory):
+    '''
+    Loads the vocal queries saved by the query archiver, either encoded as
+    WAV or as raw float32 samples.
+
+    Arguments:
+        query_directory: A string. The directory of vocal queries.
+
+    Returns:
+        A python list of tuples. The audio and sampling rate of each vocal
+            query, sorted by filename.
+    '''
+    queries = []
+    for filename in sorted(os.listdir(query_directory)):
+        filepath = os.path.join(query_directory, filename)
+        if filename.endswith('.wav'):
+            queries.append(librosa.load(filepath, sr=None))
+        elif filename.endswith('.f32'):
+            # Raw queries are named <time>_<text>.<sampling rate>.f32
+            sampling_rate = int(filename[:-len('.f32')].rsplit('.', 1)[1])
+            queries.append(
+                (np.fromfile(filepath, dtype='float32'), sampling_rate))
+
+    if not queries:
+        raise ValueError('No queries found in {}'.format(query_directory))
+
+    return queries
+
+
+if __name__ == '__main__':
+    # set up parser to grab inputs:
+    #   -r specifies the reference model name
+    #   -c specifies the candidate model name
+    #   --reference-dtype and --candidate-dtype specify the representation
+    #       types of the two systems
+    #   -q specifies the directory of vocal queries
+    #   -k specifies the number of top matches compared
+    parser = argparse.ArgumentParser(
+        description='Report the ranking agreement of two models.')
+    parser.add_argument(
+        '-r', '--reference',
+        help='The reference model name.',
+        default='VGGish-embedding')
+    parser.add_argument(
+        '-c', '--candidate',
+        help='The candidate model name.',
+        default='VGGish-embedding-int8')
+    parser.add_argument(
+        '--reference-dtype',
+        help='The representation type of the reference system. Defaults to \
+            the representation_dtype of the config.')
+    parser.add_argument(
+        '--candidate-dtype',
+        help='The representation type of the candidate system. Defaults to \
+            the representation_dtype of the config.')
+    parser.add_argument(
+        '-q', '--queries',
+        help='The directory of vocal queries.',
+        default=os.path.join('data', 'queries'))
+    parser.add_argument(
+        '-k', '--matches',
+        help='The number of top matches compared per query.',
+        type=int,
+        default=15)
+    args = parser.parse_args()
+
+    # Load the config file
+    parent_directory = os.path.dirname(os.path.abspath(__file__))
+    config_file = os.path.join(parent_directory, 'config.yaml')
+    config = yaml.safe_load(open(config_file))
+
+    reference = voogle_factory(
+        config, parent_directory, args.reference, args.reference_dtype)
+    candidate = voogle_factory(
+        config, parent_directory, args.candidate, args.candidate_dtype)
+
+    queries = load_queries(args.queries)
+    report = ranking_agreement(reference, candidate, queries, args.matches)
+    print(json.dumps(report, indent=4))
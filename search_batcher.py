@@ -0,0 +1,146 @@
+import os
+import queue
+import threading
+import time
+from log import get_logger
+from log import tracing
+
+
+class SearchBatcher(object):
+    '''
+    Coalesces concurrent search requests. Queries that queued up while the
+    previous batch was searched, or that arrive within max_wait seconds of
+    each other, are searched together with Voogle.search_many, so they are
+    embedded in one forward pass and share one scan of the dataset.
+    '''
+
+    def __init__(self, voogle, max_wait=0, max_batch_size=16):
+        '''
+        SearchBatcher constructor.
+
+        Arguments:
+            voogle: A Voogle object. The query-by-voice system searched.
+            max_wait: A float. The number of seconds the first query of a
+                batch waits for more queries to arrive. If 0, a batch holds
+                only the queries already queued and a lone query is searched
+                immediately.
+            max_batch_size: An int. The maximum number of queries searched
+                together.
+        '''
+        self.logger = get_logger('SearchBatcher')
+
+        self.voogle = voogle
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+
+        self.queue = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def search(self, query, sampling_rate, text_input=''):
+        '''
+        Search the dataset for the closest match to the given vocal query.
+        Blocks until the batch containing the query has been searched.
+
+        Arguments:
+            query: A 1D numpy array. The vocal query.
+            sampling_rate: An integer. The sampling rate of the query.
+            text_input: A string. Optional text input describing the target
+                sound.
+
+        Returns:
+            The results, in the format returned by Voogle.search.
+        '''
+        self._start()
+
+        request = _SearchRequest(query, sampling_rate, text_input)
+        self.queue.put(request)
+        with tracing.span('batch_wait'):
+            request.done.wait()
+
+        # Report the stages of the batch to the trace of this request
+        for name, duration in request.timings.items():
+            tracing.add(name, duration)
+
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _start(self):
+        # Threads do not survive a fork, so the dispatcher is started on first
+        # use in each process
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue()
+            threading.Thread(target=self._work, daemon=True).start()
+            self.pid = os.getpid()
+
+    def _work(self):
+        while True:
+            requests = self._next_batch()
+            if len(requests) > 1:
+                self.logger.debug(
+                    'Searching {} queries together'.format(len(requests)))
+
+            with tracing.trace() as timings:
+                try:
+                    results = self.voogle.search_many(
+                        [r.query for r in requests],
+                        [r.sampling_rate for r in requests],
+                        [r.text_input for r in requests])
+                    for request, request_results in zip(requests, results):
+                        request.results = request_results
+                except Exception as error:
+                    if len(requests) == 1:
+                        requests[0].error = error
+                    else:
+                        # Search each query on its own, so that a bad query
+                        # only fails its own request
+                        self.logger.warning(
+                            'Batched search failed, searching {} queries \
+                            separately'.format(len(requests)))
+                        for request in requests:
+                            self._search_one(request)
+                finally:
+                    for request in requests:
+                        request.timings = timings
+                        request.done.set()
+
+    def _search_one(self, request):
+        try:
+            request.results = self.voogle.search(
+                request.query, request.sampling_rate, request.text_input)
+        except Exception as error:
+            request.error = error
+
+    def _next_batch(self):
+        # Wait for a query, then gather the queries already queued and those
+        # arriving shortly after it
+        requests = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(requests) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    requests.append(self.queue.get_nowait())
+                else:
+                    requests.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return requests
+
+
+class _SearchRequest(object):
+    # A query waiting to be searched and, once done is set, its outcome
+
+    def __init__(self, query, sampling_rate, text_input):
+        self.query = query
+        self.sampling_rate = sampling_rate
+        self.text_input = text_input
+        self.results = None
+        self.error = None
+        self.timings = {}
+        self.done = threading.Event()
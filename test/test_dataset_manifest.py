@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+from data.DatasetManifest import DatasetManifest
+
+
+class TestDatasetManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = DatasetManifest(self.directory)
+        for filename in ['a.wav', 'b.wav', 'c.wav']:
+            self._write(filename, filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, filename, contents):
+        with open(os.path.join(self.directory, filename), 'w') as file:
+            file.write(contents)
+
+    def test_diff(self):
+        previous = self.manifest.scan(
+            self.directory, ['a.wav', 'b.wav', 'c.wav'])
+        self.manifest.save(previous)
+        self.assertTrue(self.manifest.exists())
+        self.assertEqual(self.manifest.load(), previous)
+
+        # Modify one file, touch another without changing it, delete a third
+        # and add a new one
+        self._write('a.wav', 'changed')
+        os.utime(os.path.join(self.directory, 'b.wav'), (0, 0))
+        self._write('d.wav', 'd.wav')
+
+        current = self.manifest.scan(
+            self.directory, ['a.wav', 'b.wav', 'd.wav'], previous)
+        changed, deleted = self.manifest.diff(previous, current)
+        self.assertEqual(sorted(changed), ['a.wav', 'd.wav'])
+        self.assertEqual(deleted, ['c.wav'])
+        self.assertNotEqual(
+            current['b.wav']['mtime'], previous['b.wav']['mtime'])
+
+
+if __name__ == '__main__':
+    unittest.main()
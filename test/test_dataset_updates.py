@@ -0,0 +1,116 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+from scipy.io import wavfile
+from data.TestDataset import TestDataset
+from model.QueryByVoiceModel import QueryByVoiceModel
+
+
+class AmplitudeModel(QueryByVoiceModel):
+    '''
+    A model whose representation of a file is its peak amplitude, so that
+    the saved representations show which version of a file was represented
+    '''
+
+    def __init__(self, fail_after=None):
+        super().__init__(
+            'amplitude', False, uses_windowing=False, window_length=None,
+            hop_length=None)
+        self.fail_after = fail_after
+
+    def construct_representation(self, audio_list, sampling_rates, is_query):
+        if self.fail_after is not None:
+            if self.fail_after < len(audio_list):
+                raise KeyboardInterrupt
+            self.fail_after -= len(audio_list)
+        return [np.array([np.max(np.abs(audio))]) for audio in audio_list]
+
+    def measure_similarity(self, query, items):
+        return list(-np.abs(items[:, 0] - query[0, 0]))
+
+    def _load_model(self):
+        pass
+
+
+class TestDatasetUpdates(unittest.TestCase):
+    '''
+    Test cases for rebuilding the representations of a changing dataset
+    '''
+
+    def setUp(self):
+        self.dataset_directory = tempfile.mkdtemp()
+        self.representation_directory = tempfile.mkdtemp()
+        for i in range(6):
+            self._write('{}.wav'.format(i), 0.1 * (i + 1))
+
+    def tearDown(self):
+        shutil.rmtree(self.dataset_directory)
+        shutil.rmtree(self.representation_directory)
+
+    def _write(self, filename, amplitude):
+        audio = amplitude * np.sin(np.linspace(0, 100, 8000))
+        wavfile.write(
+            os.path.join(self.dataset_directory, filename),
+            8000,
+            audio.astype('float32'))
+
+    def _dataset(self, model):
+        return TestDataset(
+            self.dataset_directory,
+            self.representation_directory,
+            model,
+            measure_similarity_batch_size=2)
+
+    def _amplitudes(self, dataset):
+        keys = dataset.store.keys()
+        return {
+            k: round(float(r[0]), 2)
+            for (k, r) in zip(keys, dataset.store.load(keys))}
+
+    def test_update(self):
+        dataset = self._dataset(AmplitudeModel())
+        matrix_filename = dataset.store.matrix_filename
+        inode = os.stat(matrix_filename).st_ino
+
+        # Add, change and remove a file
+        self._write('6.wav', 0.7)
+        self._write('2.wav', 0.8)
+        os.remove(os.path.join(self.dataset_directory, '4.wav'))
+
+        # Only the added and changed files are constructed, and their rows
+        # are appended to the saved matrix
+        model = AmplitudeModel(fail_after=2)
+        dataset = self._dataset(model)
+        self.assertEqual(model.fail_after, 0)
+        self.assertEqual(os.stat(matrix_filename).st_ino, inode)
+        self.assertEqual(
+            dataset.store.keys(), ['0.wav', '1.wav', '3.wav', '5.wav',
+                                   '2.wav', '6.wav'])
+        self.assertEqual(self._amplitudes(dataset), {
+            '0.wav': 0.1, '1.wav': 0.2, '2.wav': 0.8, '3.wav': 0.4,
+            '5.wav': 0.6, '6.wav': 0.7})
+        self.assertEqual(
+            np.load(matrix_filename, mmap_mode='r').shape, (8, 1))
+
+    def test_resume_rebuilds_edited_files(self):
+        # Interrupt the build after the first two batches
+        with self.assertRaises(KeyboardInterrupt):
+            self._dataset(AmplitudeModel(fail_after=4))
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.representation_directory, 'representations.checkpoint')))
+
+        # Edit a file whose representation was saved before the interruption
+        # and delete another
+        self._write('1.wav', 0.9)
+        os.remove(os.path.join(self.dataset_directory, '3.wav'))
+
+        dataset = self._dataset(AmplitudeModel())
+        self.assertEqual(self._amplitudes(dataset), {
+            '0.wav': 0.1, '1.wav': 0.9, '2.wav': 0.3, '4.wav': 0.5,
+            '5.wav': 0.6})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import numpy as np
+import shutil
+import tempfile
+import unittest
+from data.IVFIndex import IVFIndex
+
+
+class TestIVFIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        # Unit-norm embeddings drawn around a few well-separated directions
+        random = np.random.RandomState(1)
+        centers = random.randn(8, 32)
+        labels = random.randint(8, size=1000)
+        embeddings = centers[labels] + 0.1 * random.randn(1000, 32)
+        self.embeddings = (embeddings / np.linalg.norm(
+            embeddings, axis=1, keepdims=True)).astype('float32')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_search(self):
+        index = IVFIndex(self.directory, num_lists=16, num_probes=2)
+        index.build(self.embeddings)
+        self.assertTrue(index.exists())
+
+        # Probing a few clusters returns a fraction of the dataset that still
+        # contains the nearest neighbours of the query
+        index = IVFIndex(self.directory, num_lists=16, num_probes=2)
+        query = self.embeddings[0]
+        candidates = index.search(query)
+        self.assertLess(len(candidates), len(self.embeddings))
+        self.assertTrue(np.all(np.diff(candidates) > 0))
+
+        nearest = np.argsort(-self.embeddings.dot(query))[:15]
+        self.assertTrue(set(nearest) <= set(candidates))
+
+    def test_parameters_changed(self):
+        index = IVFIndex(self.directory, num_lists=16, num_probes=2)
+        index.build(self.embeddings)
+
+        # An index built with another number of clusters or over another
+        # representation type is out of date
+        self.assertTrue(
+            IVFIndex(self.directory, num_lists=16, num_probes=4).exists())
+        self.assertFalse(
+            IVFIndex(self.directory, num_lists=8, num_probes=2).exists())
+        self.assertFalse(IVFIndex(
+            self.directory, num_lists=16, num_probes=2,
+            dtype='int8').exists())
+
+    def test_search_all_lists(self):
+        index = IVFIndex(self.directory, num_lists=16, num_probes=16)
+        index.build(self.embeddings)
+
+        # Probing every cluster is an exhaustive search
+        candidates = index.search(self.embeddings[0])
+        self.assertTrue(
+            np.array_equal(candidates, np.arange(len(self.embeddings))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import numpy as np
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from model.MCFT import MCFT
+
+
+class TestMCFT(unittest.TestCase):
+    '''
+    Test cases for the cache of the MCFT filter bank
+    '''
+
+    def setUp(self):
+        self.weights_directory = tempfile.mkdtemp()
+        self.model_filepath = os.path.join(
+            self.weights_directory, 'mcft_filter_bank.pkl')
+
+    def tearDown(self):
+        shutil.rmtree(self.weights_directory)
+
+    def _model(self, compute=True):
+        model = MCFT(self.model_filepath)
+        if not compute:
+            def fail(query, sampling_rate):
+                raise AssertionError('The filter bank was computed')
+            model._compute_filter_bank = fail
+        return model
+
+    def _cache_files(self):
+        return sorted(
+            f for f in os.listdir(self.weights_directory)
+            if f.startswith('mcft_filter_bank_'))
+
+    def test_cache_hit(self):
+        model = self._model()
+        model.load()
+        self.assertEqual(
+            self._cache_files(),
+            [os.path.basename(model._filter_bank_filename())])
+
+        # A later process memory-maps the saved filter bank
+        cached = self._model(compute=False)
+        cached.load()
+        self.assertIsInstance(cached.filter_bank, np.memmap)
+        np.testing.assert_array_equal(cached.filter_bank, model.filter_bank)
+
+    def test_parameter_change(self):
+        model = self._model()
+        model.load()
+
+        # Other analysis parameters give another filter bank
+        changed = self._model()
+        changed.rate_res = 4
+        self.assertNotEqual(
+            changed._filter_bank_filename(), model._filter_bank_filename())
+        changed.load()
+        self.assertEqual(len(self._cache_files()), 2)
+        self.assertNotEqual(
+            changed.filter_bank.shape[:2], model.filter_bank.shape[:2])
+
+    def test_corrupt_cache(self):
+        model = self._model()
+        model.load()
+        filter_bank = np.array(model.filter_bank)
+
+        # A cache file that cannot be read is computed again
+        filename = model._filter_bank_filename()
+        with open(filename, 'wb') as file:
+            file.write(b'not a filter bank')
+        rebuilt = self._model()
+        rebuilt.load()
+        np.testing.assert_array_equal(rebuilt.filter_bank, filter_bank)
+        np.testing.assert_array_equal(np.load(filename), filter_bank)
+
+    def test_pickled_filter_bank(self):
+        # A filter bank pickled at model_filepath is used instead of the
+        # cache
+        filter_bank = np.ones((2, 3, 4, 5))
+        with open(self.model_filepath, 'wb') as file:
+            pickle.dump(filter_bank, file)
+        model = self._model(compute=False)
+        model.load()
+        self.assertEqual(model.filter_bank.dtype, np.complex64)
+        np.testing.assert_array_equal(model.filter_bank, filter_bank)
+        self.assertEqual(self._cache_files(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+import numpy as np
+import unittest
+from scipy.fftpack import fft, fft2, helper, ifft2
+from model.mcft.cqt_toolbox.apply_filterbank import (
+    apply_filterbank, plan_filterbank)
+from model.mcft.cqt_toolbox.cqt import CQTPlan, cqt
+from model.mcft.cqt_toolbox.gen_filterbank import gen_filterbank
+from model.mcft.mcft_toolbox.mcft import cqt_to_mcft, cqt_to_mcft_pooled
+from model.mcft.mcft_toolbox.spectro_temporal_fbank import (
+    filt_default_centers, filt_type, gen_fbank_scale_rate)
+
+
+def _reference_filt_tf(scale_ctr, rate_ctr, nfft_scale, nfft_rate,
+                       samprate_spec, samprate_temp, beta, scale_type,
+                       rate_type, filt_dir):
+    '''
+    Impulse response of one analytic filter, as computed filter by filter
+    by the original MCFT toolbox (gen_hsr)
+    '''
+    scale_filt_len = helper.next_fast_len(nfft_scale)
+    rate_filt_len = helper.next_fast_len(nfft_rate)
+    half_scale = int(scale_filt_len / 2)
+    half_rate = int(rate_filt_len / 2)
+    freq_vec = np.arange(scale_filt_len, dtype='float64') / samprate_spec
+    time_vec = np.arange(rate_filt_len, dtype='float64') / samprate_temp
+
+    # Even Gaussian scale impulse response
+    scale_filt = (
+        scale_ctr * (1 - 2 * (scale_ctr * np.pi * freq_vec) ** 2) *
+        np.exp(-((scale_ctr * freq_vec * np.pi) ** 2)))
+    scale_filt = np.append(
+        scale_filt[0:half_scale + 1], scale_filt[half_scale - 1:0:-1])
+
+    # Gamma-tone rate impulse response without its DC element
+    rate_filt = (
+        rate_ctr * (rate_ctr * time_vec) ** 2 *
+        np.exp(-time_vec * beta * rate_ctr) *
+        np.sin(2 * np.pi * rate_ctr * time_vec))
+    rate_filt = rate_filt - np.mean(rate_filt)
+    correct_rate_phase = np.abs(np.mean(rate_filt)) < 1e-16
+
+    scale_filt_fft = np.abs(
+        fft(scale_filt, n=scale_filt_len)).astype('complex128')
+    if scale_type != 'bandpass':
+        scale_filt_fft_1 = scale_filt_fft[0:half_scale + 1]
+        scale_filt_fft_1 /= np.max(scale_filt_fft_1)
+        max_idx_1 = np.squeeze(np.argwhere(
+            scale_filt_fft_1 == np.max(scale_filt_fft_1)))
+        scale_filt_fft_2 = scale_filt_fft[half_scale + 1:]
+        scale_filt_fft_2 /= np.max(scale_filt_fft_2)
+        max_idx_2 = np.squeeze(np.argwhere(
+            scale_filt_fft_2 == np.max(scale_filt_fft_2)))
+        if scale_type == 'lowpass':
+            scale_filt_fft_1[0:max_idx_1] = 1
+            scale_filt_fft_2[max_idx_2 + 1:] = 1
+        else:
+            scale_filt_fft_1[max_idx_1 + 1:] = 1
+            scale_filt_fft_2[0:max_idx_2] = 1
+        scale_filt_fft = np.append(scale_filt_fft_1, scale_filt_fft_2)
+
+    rate_filt_fft = fft(rate_filt, n=rate_filt_len)
+    if rate_type != 'bandpass':
+        rate_filt_phase = np.unwrap(np.angle(rate_filt_fft))
+        if correct_rate_phase:
+            rate_filt_phase[0] = 0
+        rate_filt_mag = np.abs(rate_filt_fft)
+        rate_filt_mag_1 = rate_filt_mag[0:half_rate + 1]
+        rate_filt_mag_1 /= np.max(rate_filt_mag_1)
+        max_idx_1 = np.squeeze(np.argwhere(
+            rate_filt_mag_1 == np.max(rate_filt_mag_1)))
+        rate_filt_mag_2 = rate_filt_mag[half_rate + 1:]
+        rate_filt_mag_2 /= np.max(rate_filt_mag_2)
+        max_idx_2 = np.squeeze(np.argwhere(
+            rate_filt_mag_2 == np.max(rate_filt_mag_2)))
+        if rate_type == 'lowpass':
+            rate_filt_mag_1[0:max_idx_1] = 1
+            rate_filt_mag_2[max_idx_2 + 1:] = 1
+        else:
+            rate_filt_mag_1[max_idx_1 + 1:] = 1
+            rate_filt_mag_2[0:max_idx_2 + 1] = 1
+        rate_filt_mag = np.append(rate_filt_mag_1, rate_filt_mag_2)
+        rate_filt_fft = rate_filt_mag * np.exp(1j * rate_filt_phase)
+
+    # Normalized, quadrant separable scale-rate response
+    filt_sr = np.matmul(
+        np.expand_dims(scale_filt_fft, axis=1),
+        np.expand_dims(rate_filt_fft, axis=0))
+    filt_sr_mag = np.abs(filt_sr)
+    filt_sr_mag /= np.max(filt_sr_mag)
+    filt_sr = filt_sr_mag * np.exp(1j * np.angle(filt_sr))
+
+    if filt_dir == 'up':
+        filt_sr[1:half_scale + 1, 1:half_rate + 1] = 0
+        filt_sr[half_scale + 1:, half_rate + 1:] = 0
+    else:
+        filt_sr[1:half_scale + 1, half_rate + 1:] = 0
+        filt_sr[half_scale + 1:, 1:half_rate + 1] = 0
+
+    filt_tf = ifft2(filt_sr)
+    if np.max(np.imag(filt_tf)) < 1e-8:
+        filt_tf = np.real(filt_tf)
+    return filt_tf
+
+
+class TestMCFTToolbox(unittest.TestCase):
+    '''
+    Test cases for the batched MCFT toolbox functions
+    '''
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.sig_cqt = np.abs(random.randn(36, 20))
+        self.fbank = (
+            random.randn(3, 4, 36, 20) + 1j * random.randn(3, 4, 36, 20))
+
+    def _reference_mcft(self):
+        # One inverse transform per (scale, rate) filter
+        sig_cqt_2dft = fft2(self.sig_cqt)
+        mcft_out = np.zeros(self.fbank.shape, dtype='complex128')
+        for i in range(self.fbank.shape[0]):
+            for j in range(self.fbank.shape[1]):
+                mcft_out[i, j] = ifft2(sig_cqt_2dft * self.fbank[i, j])
+        return mcft_out
+
+    def test_cqt_to_mcft(self):
+        '''
+        Test that the batched transform matches the per-filter transform
+        '''
+        mcft_out = cqt_to_mcft(self.sig_cqt, self.fbank, chunk_size=2)
+        np.testing.assert_allclose(mcft_out, self._reference_mcft())
+
+    def test_cqt_to_mcft_pooled(self):
+        '''
+        Test that the pooled transform matches the mean magnitude
+        '''
+        mcft_pooled = cqt_to_mcft_pooled(self.sig_cqt, self.fbank)
+        self.assertEqual(mcft_pooled.dtype, np.float32)
+        np.testing.assert_allclose(
+            mcft_pooled,
+            np.mean(np.abs(self._reference_mcft()), axis=(2, 3)),
+            rtol=1e-4)
+
+    def test_apply_filterbank(self):
+        '''
+        Test that the planned filter bank matches the per-filter application
+        '''
+        sig_len = 4000
+        filter_bank, shift, bw_bins = gen_filterbank(
+            27.5, 4000, 24, 8000, sig_len)
+        num_filters = int(len(bw_bins) / 2 - 1)
+        bw_bins[1:num_filters + 1] = bw_bins[num_filters]
+        bw_bins[num_filters + 2:] = bw_bins[num_filters:0:-1]
+        signal = np.random.RandomState(0).randn(sig_len, 1)
+
+        plan = plan_filterbank(filter_bank, shift, 'global', sig_len, bw_bins)
+        cqt, _ = apply_filterbank(
+            signal, filter_bank, shift, 'global', bw_bins, plan=plan)
+
+        # Filter by filter, as in the MATLAB toolbox
+        spectrum = np.fft.fft(signal[:, 0])
+        ctr_freqs = np.cumsum(shift) - shift[0]
+        self.assertEqual(len(cqt), plan['num_filters'] + 1)
+        for i, coefficients in enumerate(cqt):
+            filter_len = len(filter_bank[i])
+            half = filter_len // 2
+            num_bins = int(bw_bins[i])
+            temp = np.zeros(num_bins, dtype='complex128')
+            for k in range(filter_len):
+                temp[(k - half) % num_bins] = (
+                    spectrum[int(ctr_freqs[i] + k - half) % sig_len] *
+                    filter_bank[i][(k - half) % filter_len])
+            temp = np.roll(temp, int(ctr_freqs[i] % num_bins))
+            np.testing.assert_allclose(
+                coefficients[:, 0], np.fft.ifft(temp), atol=1e-12)
+
+    def test_cqt_plan_batch(self):
+        '''
+        Test that a batch of windows has the CQTs of the separate windows
+        '''
+        signals = np.random.RandomState(0).randn(3, 4000)
+        plan = CQTPlan(24, 8000, 27.5, 4000, 4000)
+
+        cqts = plan.apply_batch(signals)
+        self.assertEqual(cqts.shape[0], 3)
+        for signal, batch_cqt in zip(signals, cqts):
+            np.testing.assert_allclose(
+                batch_cqt, cqt(signal, 24, 8000, 27.5, 4000)['cqt'])
+
+    def test_gen_fbank_scale_rate(self):
+        '''
+        Test that the filter bank matches the original per-filter filters
+        '''
+        scale_ctrs, rate_ctrs = filt_default_centers((1, 40, 24), (2, 30, 16))
+        filt_params = {
+            'samprate_spec': 24, 'samprate_temp': 16, 'time_const': 1}
+        comp_specgram = (
+            np.random.RandomState(0).randn(36, 28) +
+            1j * np.random.RandomState(1).randn(36, 28))
+        filt_mod_factor = np.exp(
+            1j * np.angle(ifft2(fft2(comp_specgram, [40, 30]))))
+
+        fbank_tf, fbank_sr = gen_fbank_scale_rate(
+            scale_ctrs, rate_ctrs, 40, 30, filt_params)
+        _, fbank_sr_only = gen_fbank_scale_rate(
+            scale_ctrs, rate_ctrs, 40, 30, filt_params, comp_tf_domain=False)
+        fbank_tf_mod, fbank_sr_mod = gen_fbank_scale_rate(
+            scale_ctrs, rate_ctrs, 40, 30, filt_params,
+            comp_specgram=comp_specgram)
+
+        num_rate_ctrs = len(rate_ctrs)
+        for i, scale_ctr in enumerate(scale_ctrs):
+            scale_type = filt_type(i, len(scale_ctrs))
+            for j, rate_ctr in enumerate(rate_ctrs):
+                rate_type = filt_type(j, num_rate_ctrs)
+                for k, filt_dir in [
+                        (num_rate_ctrs - j - 1, 'up'),
+                        (num_rate_ctrs + j, 'down')]:
+                    filt_tf = _reference_filt_tf(
+                        scale_ctr, rate_ctr, 40, 30, 24, 16, 1, scale_type,
+                        rate_type, filt_dir)
+                    np.testing.assert_allclose(
+                        fbank_tf[i, k], filt_tf, atol=1e-12)
+                    np.testing.assert_allclose(
+                        fbank_sr[i, k], fft2(filt_tf), atol=1e-12)
+                    np.testing.assert_allclose(
+                        fbank_sr_only[i, k], fft2(filt_tf), atol=1e-12)
+                    np.testing.assert_allclose(
+                        fbank_tf_mod[i, k], filt_tf * filt_mod_factor,
+                        atol=1e-12)
+                    np.testing.assert_allclose(
+                        fbank_sr_mod[i, k], fft2(filt_tf * filt_mod_factor),
+                        atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+from scipy.io import wavfile
+from data.TestDataset import TestDataset
+from model.QueryByVoiceModel import QueryByVoiceModel
+from voogle import TopMatches
+
+
+class FrameModel(QueryByVoiceModel):
+    '''
+    A windowed model whose windows are consecutive frames of the audio
+    '''
+
+    def __init__(self):
+        super().__init__(
+            'frames', False, uses_windowing=True, window_length=None,
+            hop_length=None)
+
+    def construct_representation(self, audio_list, sampling_rates, is_query):
+        return [audio[:len(audio) // 4 * 4].reshape(-1, 4)
+                for audio in audio_list]
+
+    def measure_similarity(self, query, items):
+        return np.sum(query * items, axis=-1)
+
+    def _load_model(self):
+        pass
+
+
+class TestPairwiseBatchGenerator(unittest.TestCase):
+    '''
+    Test cases for pairing the windows of a query and the dataset
+    '''
+
+    def setUp(self):
+        self.dataset_directory = tempfile.mkdtemp()
+        self.representation_directory = tempfile.mkdtemp()
+        wavfile.write(
+            os.path.join(self.dataset_directory, 'a.wav'),
+            8000,
+            np.zeros(16, dtype='float32'))
+        self.dataset = TestDataset(
+            self.dataset_directory,
+            self.representation_directory,
+            FrameModel())
+
+        random = np.random.RandomState(0)
+        self.representations = [
+            random.randn(n, 4) for n in (3, 1, 5, 2, 4)]
+        self.handles = ['{}.wav'.format(i) for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.dataset_directory)
+        shutil.rmtree(self.representation_directory)
+
+    def _ranking(self, query):
+        top_matches = TopMatches(len(self.handles))
+        generator = self.dataset._pairwise_batch_generator(
+            query, self.representations, self.handles)
+        for batch_query, batch_items, file_tracker in generator:
+            self.assertEqual(len(batch_query), len(batch_items))
+            top_matches.push(
+                self.dataset.model.measure_similarity(
+                    batch_query, batch_items),
+                file_tracker)
+        return top_matches.matches()
+
+    def test_ranking(self):
+        '''
+        Test that every batch size ranks the dataset like the Cartesian
+        product of the query and representation windows
+        '''
+        for num_query_windows in (1, 3):
+            query = np.random.RandomState(1).randn(num_query_windows, 4)
+
+            # The best score of each file over all pairs of windows
+            expected = sorted(
+                [(max(np.dot(w, q) for w in r for q in query), h)
+                 for (r, h) in zip(self.representations, self.handles)],
+                reverse=True)
+
+            for batch_size in (None, 1, 4, 7, 100):
+                self.dataset.construct_representation_batch_size = batch_size
+                ranking = self._ranking(query)
+                self.assertEqual(
+                    [h for (h, _) in ranking], [h for (_, h) in expected])
+                np.testing.assert_allclose(
+                    [s for (_, s) in ranking], [s for (s, _) in expected])
+
+    def test_views(self):
+        '''
+        Test that batches within one representation are not copied
+        '''
+        self.dataset.construct_representation_batch_size = 2
+        query = np.ones((1, 4))
+        batches = list(self.dataset._pairwise_batch_generator(
+            query, self.representations, self.handles))
+        self.assertEqual(len(batches), 8)
+
+        # The first batch holds the first two windows of the first file
+        _, batch_items, file_tracker = batches[0]
+        self.assertTrue(np.shares_memory(batch_items, self.representations[0]))
+        self.assertEqual(file_tracker, {0: '0.wav'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from query_archiver import QueryArchiver
+
+
+class TestQueryArchiver(unittest.TestCase):
+    '''
+    Test cases for the QueryArchiver class
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_raw(self):
+        '''
+        Test that raw queries are written in the background
+        '''
+        archiver = QueryArchiver(self.directory, raw=True)
+        query = np.random.rand(100).astype('float32')
+        self.assertTrue(archiver.save(query, 16000, 'dog'))
+        archiver.close()
+
+        filenames = os.listdir(self.directory)
+        self.assertEqual(len(filenames), 1)
+        self.assertTrue(filenames[0].endswith('_dog.16000.f32'))
+        saved = np.fromfile(
+            os.path.join(self.directory, filenames[0]), dtype='float32')
+        np.testing.assert_array_equal(saved, query)
+
+    def test_drop_policy(self):
+        '''
+        Test that queries arriving at a full queue are dropped
+        '''
+        archiver = QueryArchiver(self.directory, queue_size=1, raw=True)
+
+        # Hold the writer thread until the queue has been filled
+        release = threading.Event()
+        write = archiver._write
+        archiver._write = lambda *item: release.wait() or write(*item)
+
+        query = np.zeros(10, dtype='float32')
+        archiver.save(query, 16000, 'a')
+        while not archiver.queue.empty():
+            # Wait for the writer thread to take the first query
+            pass
+        self.assertTrue(archiver.save(query, 16000, 'b'))
+        self.assertFalse(archiver.save(query, 16000, 'c'))
+        self.assertEqual(archiver.num_dropped, 1)
+
+        release.set()
+        archiver.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import numpy as np
+import time
+import unittest
+from query_cache import QueryCache, hash_audio
+
+
+class TestQueryCache(unittest.TestCase):
+    '''
+    Test cases for the QueryCache class
+    '''
+
+    def test_lru_eviction(self):
+        '''
+        Test that the least recently used entry is evicted
+        '''
+        cache = QueryCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl(self):
+        '''
+        Test that entries expire
+        '''
+        cache = QueryCache(2, ttl=0.01)
+        cache.put('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_hash_audio(self):
+        '''
+        Test that the audio key depends on the samples and sampling rate
+        '''
+        audio = np.random.rand(1000).astype('float32')
+        self.assertEqual(
+            hash_audio(audio, 16000), hash_audio(audio.copy(), 16000))
+        self.assertNotEqual(
+            hash_audio(audio, 16000), hash_audio(audio, 44100))
+        self.assertNotEqual(
+            hash_audio(audio, 16000), hash_audio(audio[:-1], 16000))
+
+
+if __name__ == '__main__':
+    unittest.main()
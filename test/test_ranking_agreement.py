@@ -0,0 +1,76 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+from ranking_agreement import load_queries, ranking_agreement
+
+
+class FixedRanking(object):
+    '''
+    A stand-in for Voogle that returns the same ranking for every query
+    '''
+
+    def __init__(self, ranking):
+        self.ranking = ranking
+        self.matches = len(ranking)
+
+    def search(self, query, sampling_rate, text_input=''):
+        matches = self.ranking[:self.matches]
+        return matches, matches, [False] * len(matches), [1.0] * len(matches)
+
+
+class TestRankingAgreement(unittest.TestCase):
+    '''
+    Test cases for the ranking agreement report
+    '''
+
+    def test_identical(self):
+        '''
+        Test that identical rankings agree fully
+        '''
+        system = FixedRanking(['a', 'b', 'c'])
+        report = ranking_agreement(system, system, [(None, 16000)] * 2, k=3)
+        self.assertEqual(report['queries'], 2)
+        self.assertEqual(report['overlap'], 1.0)
+        self.assertEqual(report['top1'], 1.0)
+        self.assertEqual(report['rank_displacement'], 0.0)
+
+    def test_partial(self):
+        '''
+        Test the agreement of rankings sharing some matches
+        '''
+        reference = FixedRanking(['a', 'b', 'c', 'd'])
+        candidate = FixedRanking(['b', 'a', 'e', 'f'])
+        report = ranking_agreement(reference, candidate, [(None, 16000)], k=4)
+        self.assertEqual(report['overlap'], 0.5)
+        self.assertEqual(report['top1'], 0.0)
+        self.assertEqual(report['rank_displacement'], 1.0)
+
+    def test_load_raw_queries(self):
+        '''
+        Test that archived raw queries are loaded with their sampling rate
+        '''
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        query = np.arange(4, dtype='float32')
+        query.tofile(os.path.join(directory, '1546300800_a.car.16000.f32'))
+        open(os.path.join(directory, 'notes.txt'), 'w').close()
+
+        queries = load_queries(directory)
+        self.assertEqual(len(queries), 1)
+        np.testing.assert_array_equal(queries[0][0], query)
+        self.assertEqual(queries[0][1], 16000)
+
+    def test_load_no_queries(self):
+        '''
+        Test that a directory without queries is an error
+        '''
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.assertRaises(ValueError):
+            load_queries(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,283 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from data.RepresentationStore import RepresentationStore
+
+
+class TestRepresentationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = RepresentationStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_load(self):
+        embeddings = [np.random.rand(8) for _ in range(5)]
+        keys = ['{}.wav'.format(i) for i in range(5)]
+
+        # Batches appended before a commit form one store
+        self.store.append(keys[:3], embeddings[:3])
+        self.assertFalse(self.store.exists())
+        self.store.append(keys[3:], embeddings[3:])
+        self.store.commit()
+        self.assertTrue(self.store.exists())
+
+        # A new store reading the same directory sees every representation
+        store = RepresentationStore(self.directory)
+        self.assertEqual(len(store), 5)
+        for key, embedding in zip(keys, store.load(keys)):
+            self.assertTrue(key in store)
+            self.assertEqual(embedding.dtype, np.float32)
+        for expected, loaded in zip(embeddings, store.load(keys)):
+            self.assertTrue(np.allclose(expected, loaded))
+
+        # Contiguous single-row representations are served without a copy
+        matrix = store.load_matrix(keys[1:4])
+        self.assertEqual(matrix.shape, (3, 8))
+        self.assertIsInstance(matrix, np.memmap)
+        self.assertTrue(np.allclose(matrix, np.array(embeddings[1:4])))
+
+        # Out-of-order keys are gathered
+        matrix = store.load_matrix([keys[4], keys[0]])
+        self.assertTrue(
+            np.allclose(matrix, np.array([embeddings[4], embeddings[0]])))
+
+    def test_windowed_representations(self):
+        windows = [np.random.rand(n, 2, 3) for n in (1, 4, 2)]
+        keys = ['a', 'b', 'c']
+        self.store.append(keys, windows)
+        self.store.commit()
+
+        for expected, loaded in zip(windows, self.store.load(keys)):
+            self.assertEqual(expected.shape, loaded.shape)
+            self.assertTrue(np.allclose(expected, loaded))
+
+        # Every row of a store must have the same shape
+        with self.assertRaises(ValueError):
+            self.store.append(
+                ['d', 'e'], [np.random.rand(2, 2, 3), np.random.rand(2, 3, 3)])
+
+    def test_commit_replaces_store(self):
+        self.store.append(['a', 'b'], [np.ones(4), np.zeros(4)])
+        self.store.commit()
+        self.assertEqual(len(self.store), 2)
+
+        self.store.append(['c'], [np.ones(4)])
+        self.store.commit()
+        self.assertEqual(len(self.store), 1)
+        self.assertFalse('a' in self.store)
+        self.assertFalse(os.path.exists(self.store.partial_filename))
+
+    def test_copy(self):
+        self.store.append(['a', 'b', 'c'], [np.full(2, i) for i in range(3)])
+        self.store.commit()
+
+        # Keep a and c, replace b and add d
+        self.store.copy(['a', 'c'])
+        self.store.append(['b', 'd'], [np.full(2, 4), np.full(2, 5)])
+        self.store.commit()
+
+        self.assertEqual(self.store.keys(), ['a', 'c', 'b', 'd'])
+        matrix = self.store.load_matrix(['a', 'b', 'c', 'd'])
+        self.assertTrue(np.array_equal(matrix[:, 0], [0, 4, 2, 5]))
+
+    def test_resume(self):
+        windows = [np.random.rand(n, 3) for n in (2, 1, 3)]
+        self.store.append(['a', 'b'], windows[:2])
+
+        # Simulate an interrupted build with rows written past the checkpoint
+        self.store._writer['file'].write(b'\x00' * 7)
+        self.store._writer['file'].close()
+        self.store._writer['checkpoint'].close()
+
+        store = RepresentationStore(self.directory)
+        self.assertTrue(store.interrupted())
+        self.assertEqual(store.resume(), {'a', 'b'})
+        store.append(['c'], windows[2:])
+        store.commit()
+        self.assertFalse(store.interrupted())
+
+        for expected, loaded in zip(windows, store.load(['a', 'b', 'c'])):
+            self.assertTrue(np.allclose(expected, loaded))
+
+    def test_extend(self):
+        self.store.append(['a', 'b', 'c'], [np.full(2, i) for i in range(3)])
+        self.store.commit()
+        inode = os.stat(self.store.matrix_filename).st_ino
+
+        # Drop b, replace c and add d without rewriting the matrix
+        store = RepresentationStore(self.directory, compaction_threshold=0.5)
+        self.assertEqual(store.extend(), set())
+        store.drop(['b'])
+        store.append(['d', 'c'], [np.full(2, 3), np.full(2, 4)])
+        store.commit()
+        self.assertEqual(os.stat(store.matrix_filename).st_ino, inode)
+        self.assertEqual(
+            np.load(store.matrix_filename, mmap_mode='r').shape, (5, 2))
+
+        store = RepresentationStore(self.directory)
+        self.assertEqual(store.keys(), ['a', 'd', 'c'])
+        self.assertFalse('b' in store)
+        matrix = store.load_matrix(['a', 'c', 'd'])
+        self.assertTrue(np.array_equal(matrix[:, 0], [0, 4, 3]))
+
+        # Once more than the threshold of rows are unindexed, the matrix is
+        # rewritten with only the indexed rows
+        store.extend()
+        store.drop(['a'])
+        store.commit()
+        self.assertEqual(store.keys(), ['d', 'c'])
+        self.assertEqual(
+            np.load(store.matrix_filename, mmap_mode='r').shape, (2, 2))
+        self.assertTrue(
+            np.array_equal(store.load_matrix(['c', 'd'])[:, 0], [4, 3]))
+
+    def test_extend_quantized(self):
+        windows = [np.random.randn(n, 4) for n in (2, 1, 3)]
+        store = RepresentationStore(self.directory, dtype='int8')
+        store.append(['a', 'b'], windows[:2])
+        store.commit()
+
+        # Stores committed with the default .npy header are extended too
+        np.save(store.scales_filename, np.load(store.scales_filename))
+        store.extend()
+        store.append(['c'], windows[2:])
+        store.commit()
+        for expected, loaded in zip(windows, store.load(['a', 'b', 'c'])):
+            self.assertTrue(np.allclose(expected, loaded, atol=0.05))
+
+    def test_resume_extension(self):
+        self.store.append(['a', 'b'], [np.full(2, 0), np.full(2, 1)])
+        self.store.commit()
+
+        store = RepresentationStore(self.directory)
+        store.extend()
+        store.drop(['a'])
+        store.append(['c'], [np.full(2, 2)])
+        store._writer['file'].close()
+        store._writer['checkpoint'].close()
+
+        # An interrupted extension is only resumed by extend
+        store = RepresentationStore(self.directory)
+        self.assertFalse(store.resumable())
+        self.assertTrue(store.resumable(extends=True))
+        self.assertEqual(store.extend(), {'c'})
+        store.append(['d'], [np.full(2, 3)])
+        store.commit()
+        self.assertEqual(store.keys(), ['b', 'c', 'd'])
+        self.assertTrue(np.array_equal(
+            store.load_matrix(['b', 'c', 'd'])[:, 0], [1, 2, 3]))
+
+    def test_drop(self):
+        self.store.append(['a', 'b', 'c'], [np.full(2, i) for i in range(3)])
+        self.store.drop(['b'])
+        self.store._writer['file'].close()
+        self.store._writer['checkpoint'].close()
+
+        # A dropped representation stays dropped when the build is resumed
+        store = RepresentationStore(self.directory)
+        self.assertEqual(store.resume(), {'a', 'c'})
+        store.append(['b'], [np.full(2, 4)])
+        store.commit()
+
+        self.assertEqual(store.keys(), ['a', 'c', 'b'])
+        self.assertEqual(len(store), 3)
+        matrix = store.load_matrix(['a', 'b', 'c'])
+        self.assertTrue(np.array_equal(matrix[:, 0], [0, 4, 2]))
+
+    def test_resume_other_build(self):
+        store = RepresentationStore(self.directory, model='a@1')
+        store.append(['a', 'b'], [np.ones(3), np.zeros(3)])
+        store._writer['file'].close()
+        store._writer['checkpoint'].close()
+
+        # A build of another model or type is discarded instead of resumed
+        for other in (RepresentationStore(self.directory, model='a@2'),
+                      RepresentationStore(
+                          self.directory, dtype='float16', model='a@1')):
+            self.assertTrue(other.interrupted())
+            self.assertFalse(other.resumable())
+
+        # So is a checkpoint without a header
+        with open(store.checkpoint_filename, 'r') as file:
+            lines = file.readlines()
+        with open(store.checkpoint_filename, 'w') as file:
+            file.writelines(lines[1:])
+        store = RepresentationStore(self.directory, model='a@1')
+        self.assertFalse(store.resumable())
+        self.assertEqual(store.resume(), set())
+        store.append(['c'], [np.full(3, 2)])
+        store.commit()
+        self.assertEqual(store.keys(), ['c'])
+
+    def test_concurrent_open(self):
+        keys = [str(i) for i in range(1000)]
+        self.store.append(keys, [np.full(2, i) for i in range(1000)])
+        self.store.commit()
+
+        # Threads opening the store at once each see a complete index
+        store = RepresentationStore(self.directory)
+        errors = []
+
+        def load():
+            try:
+                matrix = store.load_matrix(keys[-2:])
+                self.assertTrue(np.array_equal(matrix[:, 0], [998, 999]))
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=load) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_reduced_precision(self):
+        windows = [np.random.randn(n, 16) for n in (2, 1, 3)]
+        keys = ['a', 'b', 'c']
+
+        store = RepresentationStore(self.directory, dtype='float16')
+        store.append(keys, windows)
+        store.commit()
+        for expected, loaded in zip(windows, store.load(keys)):
+            self.assertEqual(loaded.dtype, np.float16)
+            self.assertTrue(np.allclose(expected, loaded, atol=1e-2))
+
+        # float32 matrices are served from one converted copy of the store
+        matrix = store.load_matrix(['b'], dtype='float32')
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertTrue(np.shares_memory(
+            matrix, store.load_matrix(['b'], dtype='float32')))
+        self.assertTrue(np.array_equal(matrix, store.load(['b'])[0]))
+
+        # Each int8 row is dequantized with its own scale
+        store = RepresentationStore(self.directory, dtype='int8')
+        self.assertTrue(store.dtype_changed())
+        store.append(keys[:2], windows[:2])
+        store._writer['file'].close()
+        store._writer['checkpoint'].close()
+        store._writer['scales'].close()
+
+        store = RepresentationStore(self.directory, dtype='int8')
+        self.assertEqual(store.resume(), {'a', 'b'})
+        store.append(keys[2:], windows[2:])
+        store.commit()
+        self.assertFalse(store.dtype_changed())
+        self.assertEqual(np.load(store.matrix_filename).dtype, np.int8)
+        for expected, loaded in zip(windows, store.load(keys)):
+            self.assertEqual(loaded.dtype, np.float32)
+            tolerance = np.max(np.abs(expected), axis=1, keepdims=True) / 254
+            self.assertTrue(np.all(np.abs(expected - loaded) <= tolerance))
+
+        with self.assertRaises(ValueError):
+            RepresentationStore(self.directory, dtype='int16')
+
+
+if __name__ == '__main__':
+    unittest.main()
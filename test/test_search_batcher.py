@@ -0,0 +1,134 @@
+import threading
+import time
+import unittest
+from search_batcher import SearchBatcher
+
+
+class RecordingVoogle(object):
+    '''
+    A stand-in for Voogle that records the size of each batch of queries
+    '''
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def search_many(self, queries, sampling_rates, text_inputs):
+        self.batch_sizes.append(len(queries))
+        if 'fail' in text_inputs:
+            raise ValueError('Search failed')
+        return [(q, s, t) for (q, s, t) in zip(
+            queries, sampling_rates, text_inputs)]
+
+    def search(self, query, sampling_rate, text_input):
+        if text_input == 'fail':
+            raise ValueError('Search failed')
+        return query, sampling_rate, text_input
+
+
+class TestSearchBatcher(unittest.TestCase):
+    '''
+    Test cases for the SearchBatcher class
+    '''
+
+    def test_coalesce(self):
+        '''
+        Test that concurrent queries are searched together
+        '''
+        voogle = RecordingVoogle()
+        batcher = SearchBatcher(voogle, max_wait=0.2, max_batch_size=3)
+
+        results = {}
+
+        def search(i):
+            results[i] = batcher.search(i, 16000, str(i))
+
+        threads = [threading.Thread(target=search, args=(i,)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {i: (i, 16000, str(i)) for i in range(5)})
+        self.assertEqual(sum(voogle.batch_sizes), 5)
+        self.assertLess(len(voogle.batch_sizes), 5)
+        self.assertLessEqual(max(voogle.batch_sizes), 3)
+
+    def test_no_wait(self):
+        '''
+        Test that without a wait only the queued queries are searched together
+        '''
+        voogle = RecordingVoogle()
+        batcher = SearchBatcher(voogle, max_wait=0, max_batch_size=3)
+        batcher._start()
+
+        # Queries queued while the dispatcher is busy form one batch
+        started = threading.Event()
+        release = threading.Event()
+        search_many = voogle.search_many
+
+        def blocking_search_many(*args):
+            started.set()
+            release.wait()
+            return search_many(*args)
+
+        voogle.search_many = blocking_search_many
+        results = {}
+
+        def search(i):
+            results[i] = batcher.search(i, 16000, str(i))
+
+        threads = [threading.Thread(target=search, args=(0,))]
+        threads[0].start()
+        started.wait()
+        threads += [threading.Thread(target=search, args=(i,)) for i in (1, 2)]
+        for thread in threads[1:]:
+            thread.start()
+        while batcher.queue.qsize() < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(voogle.batch_sizes, [1, 2])
+        self.assertEqual(results, {i: (i, 16000, str(i)) for i in range(3)})
+
+    def test_error(self):
+        '''
+        Test that a failed search raises in the requesting thread
+        '''
+        batcher = SearchBatcher(RecordingVoogle(), max_wait=0)
+        with self.assertRaises(ValueError):
+            batcher.search(0, 16000, 'fail')
+        self.assertEqual(batcher.search(1, 16000, 'cat'), (1, 16000, 'cat'))
+
+    def test_error_in_batch(self):
+        '''
+        Test that a failed query does not fail the queries batched with it
+        '''
+        voogle = RecordingVoogle()
+        batcher = SearchBatcher(voogle, max_wait=0.2, max_batch_size=3)
+
+        results = {}
+        errors = {}
+
+        def search(text):
+            try:
+                results[text] = batcher.search(0, 16000, text)
+            except ValueError as error:
+                errors[text] = error
+
+        texts = ['cat', 'fail', 'dog']
+        threads = [threading.Thread(target=search, args=(t,)) for t in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(voogle.batch_sizes, [3])
+        self.assertEqual(sorted(errors), ['fail'])
+        self.assertEqual(
+            results, {'cat': (0, 16000, 'cat'), 'dog': (0, 16000, 'dog')})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -69,7 +69,7 @@ class TestTestDataset(unittest.TestCase):
         # Every audio file should have a representation
         self.assertEqual(
             len(os.listdir(self.dataset_directory)),
-            len(self.dataset.data_dict))
+            len(self.dataset.store))
 
         # Each audio file should map to a unique representation
         for filename in filenames:
@@ -0,0 +1,50 @@
+import shutil
+import tempfile
+import unittest
+from data.TextIndex import TextIndex
+from model.text.ContainsText import ContainsText
+
+
+class TestTextIndex(unittest.TestCase):
+    '''
+    Test cases for the TextIndex class
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.handles = ['Cat.wav', 'dog_bark.wav', 'cattle.wav', 'bird.mp3']
+        self.index = TextIndex(self.directory)
+        self.index.build(self.handles, self.handles)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_search(self):
+        '''
+        Test that the candidates match a brute-force substring search
+        '''
+        index = TextIndex(self.directory)
+        for query in ['cat', 'CAT', 'bark', 'wav', '.mp3', 'horse', 'ttle']:
+            candidates = index.search(query)
+            expected = [h for h in self.handles if query.lower() in h.lower()]
+            self.assertEqual(candidates, expected)
+
+    def test_short_query(self):
+        '''
+        Test that queries shorter than n return every handle
+        '''
+        self.assertEqual(self.index.search('d'), self.handles)
+        self.assertEqual(self.index.search(''), self.handles)
+
+    def test_text_handler(self):
+        '''
+        Test that ContainsText looks its candidates up in the index
+        '''
+        text_handler = ContainsText()
+        text_handler.set_query_text('Dog')
+        self.assertEqual(
+            text_handler.candidate_handles(self.index), ['dog_bark.wav'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from log import tracing
+
+
+class TestTracing(unittest.TestCase):
+    '''
+    Test cases for the tracing spans and metrics
+    '''
+
+    def test_trace(self):
+        '''
+        Test that spans are collected by the active trace only
+        '''
+        with tracing.span('test_untraced'):
+            pass
+
+        with tracing.trace() as timings:
+            with tracing.span('test_stage'):
+                pass
+            with tracing.span('test_stage'):
+                pass
+            tracing.add('test_handed_over', 0.5)
+
+        self.assertEqual(
+            sorted(timings), ['test_handed_over', 'test_stage'])
+        self.assertEqual(timings['test_handed_over'], 0.5)
+
+    def test_prometheus_text(self):
+        '''
+        Test the exposition of the stage histograms
+        '''
+        for _ in range(3):
+            with tracing.span('test_metrics'):
+                pass
+        tracing.add('test_not_exported', 1.0)
+
+        text = tracing.prometheus_text()
+        self.assertIn(
+            'voogle_stage_duration_seconds_count{stage="test_metrics"} 3',
+            text)
+        self.assertIn(
+            'voogle_stage_duration_seconds_bucket{stage="test_metrics",'
+            'le="+Inf"} 3', text)
+        self.assertNotIn('test_not_exported', text)
+
+    def test_metrics_directory(self):
+        '''
+        Test that the metrics of all processes sharing a directory are merged
+        '''
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(tracing.set_metrics_directory, None)
+        tracing.set_metrics_directory(directory)
+
+        # The metrics saved by another worker process
+        counts = [0] * len(tracing.BUCKETS)
+        counts[-1] = 2
+        with open(os.path.join(directory, '1.json'), 'w') as file:
+            json.dump({'test_merged': [counts, 60.0, 2]}, file)
+
+        with tracing.span('test_merged'):
+            pass
+        text = tracing.prometheus_text()
+        self.assertIn(
+            'voogle_stage_duration_seconds_count{stage="test_merged"} 3',
+            text)
+        self.assertIn(
+            'voogle_stage_duration_seconds_bucket{stage="test_merged",'
+            'le="30.0"} 1', text)
+        filename = os.path.join(directory, '{}.json'.format(os.getpid()))
+        self.assertTrue(os.path.exists(filename))
+
+        # Observations made since the last save are written by flush
+        with tracing.span('test_flushed'):
+            pass
+        tracing.flush()
+        with open(filename) as file:
+            self.assertIn('test_flushed', json.load(file))
+
+        tracing.clear_metrics_directory(directory)
+        self.assertEqual(os.listdir(directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
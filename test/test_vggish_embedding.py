@@ -0,0 +1,148 @@
+import librosa
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+from data.RepresentationStore import RepresentationStore
+from data.TestDataset import TestDataset
+from model.QuantizedVGGishEmbedding import (
+    QuantizedVGGishEmbedding, dequantize_per_channel, quantize_per_channel)
+from model.VGGishEmbedding import VGGishEmbedding
+from ranking_agreement import ranking_agreement
+from scipy import spatial
+from voogle import Voogle
+
+
+class TestVGGishEmbedding(unittest.TestCase):
+    '''
+    Test cases for the float and int8 VGGish models
+    '''
+
+    def setUp(self):
+        self.dataset_directory = os.path.realpath('data/audio/test_dataset')
+        self.model_filepath = os.path.realpath(
+            'model/weights/vggish_pretrained_convs.pth')
+
+        # The int8 weights are derived next to a copy of the float weights
+        self.weights_directory = tempfile.mkdtemp()
+        self.quantized_model_filepath = os.path.join(
+            self.weights_directory, os.path.basename(self.model_filepath))
+        shutil.copy(self.model_filepath, self.quantized_model_filepath)
+
+        self.cat, self.sr_cat = librosa.load(
+            os.path.join(self.dataset_directory, 'cat.wav'), sr=None)
+        self.dog, self.sr_dog = librosa.load(
+            os.path.join(self.dataset_directory, 'dog_barking.wav'), sr=None)
+
+    def tearDown(self):
+        shutil.rmtree(self.weights_directory)
+
+    def _voogle(self, model, model_name):
+        dataset = TestDataset(
+            self.dataset_directory,
+            os.path.realpath(
+                'data/representations/test_dataset/' + model_name),
+            model)
+        return Voogle(model, dataset, False)
+
+    def test_cosine_similarity(self):
+        '''
+        Test that the dot product of normalized embeddings, stored as float32
+        or float16, ranks items like the cosine similarity of the embeddings
+        '''
+        model = VGGishEmbedding(self.model_filepath)
+        random = np.random.RandomState(0)
+        query = random.randn(1, 128)
+        items = random.randn(50, 128)
+        expected = [1 - spatial.distance.cosine(query[0], i) for i in items]
+
+        def normalize(x):
+            return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+        keys = [str(i) for i in range(len(items))]
+        for dtype in ('float32', 'float16'):
+            store = RepresentationStore(self.weights_directory, dtype=dtype)
+            store.append(keys, normalize(items))
+            store.commit()
+            scores = model.measure_similarity(
+                normalize(query), store.load_matrix(keys, dtype='float32'))
+            np.testing.assert_allclose(scores, expected, atol=1e-3)
+            np.testing.assert_array_equal(
+                np.argsort(scores)[::-1][:10], np.argsort(expected)[::-1][:10])
+
+    def test_trace(self):
+        '''
+        Test that the traced model embeds a batch like the eager model
+        '''
+        model = VGGishEmbedding(self.model_filepath)
+        traced_model = VGGishEmbedding(self.model_filepath, trace=True)
+
+        audio_list = [self.cat, self.dog]
+        sampling_rates = [self.sr_cat, self.sr_dog]
+        embeddings = model.construct_representation(
+            audio_list, sampling_rates, is_query=False)
+        traced_embeddings = traced_model.construct_representation(
+            audio_list, sampling_rates, is_query=False)
+        for embedding, traced_embedding in zip(embeddings, traced_embeddings):
+            np.testing.assert_allclose(
+                embedding, traced_embedding, rtol=1e-5, atol=1e-6)
+
+    def test_quantize_per_channel(self):
+        '''
+        Test that each output channel is rounded to within half its scale
+        '''
+        weight = np.random.RandomState(0).randn(8, 4, 3, 3).astype('float32')
+        weight[3] *= 100
+        weight[5] = 0
+
+        values, scales = quantize_per_channel(weight)
+        self.assertEqual(values.dtype, np.int8)
+        self.assertEqual(scales.shape, (8,))
+        restored = dequantize_per_channel(values, scales)
+        self.assertEqual(restored.dtype, np.float32)
+        error = np.abs(restored - weight).reshape(8, -1).max(axis=1)
+        self.assertTrue(np.all(error <= scales / 2 + 1e-6))
+        np.testing.assert_array_equal(restored[5], 0)
+
+    def test_quantized_embeddings(self):
+        '''
+        Test that the int8 weights are saved and give close embeddings
+        '''
+        model = VGGishEmbedding(self.model_filepath)
+        quantized_model = QuantizedVGGishEmbedding(
+            self.quantized_model_filepath)
+
+        embeddings = model.construct_representation(
+            [self.cat, self.dog], [self.sr_cat, self.sr_dog], is_query=False)
+        quantized_embeddings = quantized_model.construct_representation(
+            [self.cat, self.dog], [self.sr_cat, self.sr_dog], is_query=False)
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.weights_directory, 'vggish_pretrained_convs_int8.npz')))
+
+        for embedding, quantized_embedding in zip(
+                embeddings, quantized_embeddings):
+            self.assertGreater(
+                float(embedding.reshape(-1).dot(
+                    quantized_embedding.reshape(-1))), 0.99)
+
+    def test_quantized_ranking_agreement(self):
+        '''
+        Test that the int8 model ranks the dataset like the float model
+        '''
+        reference = self._voogle(
+            VGGishEmbedding(self.model_filepath), 'VGGish-embedding')
+        candidate = self._voogle(
+            QuantizedVGGishEmbedding(self.quantized_model_filepath),
+            'VGGish-embedding-int8')
+
+        report = ranking_agreement(
+            reference,
+            candidate,
+            [(self.cat, self.sr_cat), (self.dog, self.sr_dog)])
+        self.assertEqual(report['top1'], 1.0)
+        self.assertGreaterEqual(report['overlap'], 0.8)
+
+
+if __name__ == '__main__':
+    unittest.main()
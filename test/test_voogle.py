@@ -1,9 +1,10 @@
 import librosa
+import numpy as np
 import os
 import unittest
 from model.SiameseStyle import SiameseStyle
 from data.TestDataset import TestDataset
-from voogle import Voogle
+from voogle import TopMatches, Voogle
 
 
 class TestVoogle(unittest.TestCase):
@@ -38,5 +39,63 @@ class TestVoogle(unittest.TestCase):
         for i in range(len(similarity_scores) - 1):
             self.assertGreater(similarity_scores[i], similarity_scores[i + 1])
 
+    def test_search_progressive(self):
+        '''
+        Test that the last progressive results match a full search
+        '''
+        updates = list(self.voogle.search_progressive(
+            self.query, self.sr_query))
+        self.assertTrue(updates[-1][1])
+        self.assertFalse(any(done for _, done in updates[:-1]))
+        self.assertEqual(
+            updates[-1][0], self.voogle.search(self.query, self.sr_query))
+
+        # A time budget that is exhausted immediately stops after one batch
+        updates = list(self.voogle.search_progressive(
+            self.query, self.sr_query, time_budget=0))
+        self.assertEqual(len(updates), 1)
+        self.assertTrue(updates[0][1])
+
+    def test_search_progressive_parts(self):
+        '''
+        Test that a dataset searched in one batch still gives several updates
+        '''
+        self.voogle.progressive_batch_size = 16
+        updates = list(self.voogle.search_progressive(
+            self.query, self.sr_query))
+        self.assertGreater(len(updates), 2)
+        self.assertFalse(any(done for _, done in updates[:-1]))
+        self.assertEqual(
+            updates[-1][0], self.voogle.search(self.query, self.sr_query))
+
+    def test_query_text_handler(self):
+        '''
+        Test that each search seeds its own copy of the text handler
+        '''
+        cat = self.voogle._query_text_handler('Cat')
+        dog = self.voogle._query_text_handler('dog')
+        self.assertTrue(cat.is_match(['A cat meowing']))
+        self.assertFalse(dog.is_match(['A cat meowing']))
+        self.assertIsNone(self.voogle.text_handler.query_text)
+
+
+class TestTopMatches(unittest.TestCase):
+    '''
+    Test cases for streaming top-k selection
+    '''
+
+    def test_push(self):
+        top_matches = TopMatches(3)
+        top_matches.push(
+            np.array([0.1, 0.5, 0.2, 0.9, 0.3]), {0: 'a', 2: 'b', 3: 'c'})
+        # The first score continues file c from the previous batch
+        top_matches.push(np.array([0.95, 0.1, 0.4]), {1: 'd'})
+        top_matches.push(np.array([0.6]), {0: 'e'})
+
+        matches = top_matches.matches()
+        self.assertEqual([handle for handle, _ in matches], ['c', 'e', 'a'])
+        self.assertEqual([score for _, score in matches], [0.95, 0.6, 0.5])
+
+
 if __name__ == '__main__':
     unittest.main()
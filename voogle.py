@@ -1,7 +1,12 @@
+import copy
+import heapq
 import numpy as np
 import os
+import time
 from model.text.ContainsText import ContainsText
 from log import get_logger
+from log.tracing import span
+from query_cache import hash_audio
 
 
 class Voogle(object):
@@ -15,7 +20,10 @@ class Voogle(object):
         dataset,
         require_text_match,
         text_handler=ContainsText(),
-        matches=15):
+        matches=15,
+        cache=None,
+        cache_results=False,
+        progressive_batch_size=1024):
         '''
         Voogle constructor
 
@@ -29,6 +37,15 @@ class Voogle(object):
             text_handler: A TextHandler object. The model for determining if
                 the user's text matches the audio text description.
             matches: An int. The number of matches to return during search.
+            cache: A QueryCache or None. Caches the representations of
+                queries, keyed by a hash of the query audio and sampling rate.
+            cache_results: A boolean. If true, the search results are also
+                cached, keyed by the query audio, text and require_text_match.
+                Unused if cache is None.
+            progressive_batch_size: An int or None. The maximum number of
+                dataset items, or pairs of windows, scored between two updates
+                of search_progressive. Larger dataset batches are scored in
+                parts. If None, each dataset batch gives one update.
         '''
         self.logger = get_logger('Voogle')
 
@@ -39,6 +56,9 @@ class Voogle(object):
         self.require_text_match = require_text_match
         self.text_handler = text_handler
         self.matches = matches
+        self.cache = cache
+        self.cache_results = cache_results
+        self.progressive_batch_size = progressive_batch_size
 
         self.logger.debug('Initialization complete')
 
@@ -62,41 +82,327 @@ class Voogle(object):
                     similarity score of the audio file located at the same
                     index.
         '''
-        # Construct query representation
-        query = self.model.construct_representation(
-            [query], [sampling_rate], is_query=True)
+        # Reuse the results of a repeated query
+        results = self._cached_results(query, sampling_rate, text_input)
+        if results is not None:
+            return results
 
-        # Seed the text handler with the user's text query
-        self.text_handler.set_query_text(text_input)
+        for top_matches, _ in self._scan(query, sampling_rate, text_input):
+            pass
+        with span('ranking'):
+            results = self._results(top_matches, text_input)
 
-        # Retrieve the similarity measure between query and each dataset entry
-        model_output = {}
-        previous_handle = ''
-        previous_index = 0
+        self._cache_results(query, sampling_rate, text_input, results)
+        return results
+
+    def search_many(self, queries, sampling_rates, text_inputs):
+        '''
+        Search the dataset for several vocal queries at once. If the model
+        scores a query against a whole batch of items and no query-dependent
+        filtering of the dataset applies, the queries are embedded together
+        and share a single scan of the dataset. Otherwise they are searched
+        one after the other.
+
+        Arguments:
+            queries: A python list of 1D numpy arrays. The vocal queries.
+            sampling_rates: A python list of integers. The sampling rate of
+                each query.
+            text_inputs: A python list of strings. The text input of each
+                query.
+
+        Returns:
+            A python list with the results of each query, in the format
+                returned by search.
+        '''
+        if not self.batches_queries():
+            return [self.search(q, s, t) for (q, s, t) in zip(
+                queries, sampling_rates, text_inputs)]
+
+        results = [
+            self._cached_results(q, s, t) for (q, s, t) in zip(
+                queries, sampling_rates, text_inputs)]
+        pending = [i for i, r in enumerate(results) if r is None]
+        if not pending:
+            return results
+
+        with span('query_representation'):
+            representations = self._construct_queries(
+                [queries[i] for i in pending],
+                [sampling_rates[i] for i in pending])
+
+        # Score every pending query against each batch of the dataset with
+        # one product
+        top_matches = [TopMatches(self.matches) for _ in pending]
         generator = self.dataset.data_generator(
-            query, self.text_handler, self.require_text_match)
-        for batch_query, batch_items, file_tracker in generator:
+            np.array(representations), self.text_handler, False)
+        while True:
+            with span('dataset_batch_load'):
+                batch = next(generator, None)
+            if batch is None:
+                break
+            batch_queries, batch_items, file_tracker = batch
+
+            with span('similarity'):
+                ranks = self.model.measure_similarity_many(
+                    batch_queries, batch_items)
+            with span('ranking'):
+                for matches, query_ranks in zip(top_matches, ranks):
+                    matches.push(query_ranks, file_tracker)
+
+        for i, matches in zip(pending, top_matches):
+            with span('ranking'):
+                results[i] = self._results(matches, text_inputs[i])
+            self._cache_results(
+                queries[i], sampling_rates[i], text_inputs[i], results[i])
+
+        return results
+
+    def batches_queries(self):
+        '''
+        Returns True if search_many shares one scan of the dataset between
+        queries. This requires a model that scores a query against a whole
+        batch of items, and no query-dependent filtering of the dataset.
+        '''
+        return (self.model.broadcasts_query and
+                not self.model.uses_windowing and
+                not self.dataset.index and
+                not self.require_text_match)
+
+    def search_progressive(
+        self, query, sampling_rate, text_input='', time_budget=None):
+        '''
+        Search the dataset for the closest match to the given vocal query,
+        reporting the best matches found so far after every batch of the
+        dataset.
+
+        Arguments:
+            query: A 1D numpy array. The vocal query.
+            sampling_rate: An integer. The sampling rate of the query.
+            text_input: A string. Optional text input describing the target
+                sound.
+            time_budget: A float or None. The number of seconds after which
+                the search stops and the best matches so far are final. If
+                None, the whole dataset is searched.
+
+        Returns:
+            A python generator yielding tuples of
+                - The results of the dataset searched so far, in the format
+                    returned by search.
+                - A boolean. True if the results are final, either because
+                    the whole dataset was searched or the time budget ran out.
+        '''
+        for top_matches, done in self._scan(
+                query,
+                sampling_rate,
+                text_input,
+                time_budget,
+                self.progressive_batch_size):
+            yield self._results(top_matches, text_input), done
+
+    def _scan(self, query, sampling_rate, text_input, time_budget=None,
+              part_size=None):
+        '''
+        Scores the query against the dataset batch by batch.
+
+        Arguments:
+            query: A 1D numpy array. The vocal query.
+            sampling_rate: An integer. The sampling rate of the query.
+            text_input: A string. The user's text query.
+            time_budget: A float or None. The number of seconds after which
+                the scan stops.
+            part_size: An int or None. The maximum number of items scored at
+                once. Larger dataset batches are split.
+
+        Returns:
+            A python generator yielding the TopMatches of the batches scanned
+                so far and a boolean that is True for the last item.
+        '''
+        start = time.monotonic()
+        with span('query_representation'):
+            query = self._construct_query(query, sampling_rate)
+
+        # Retrieve the similarity measure between query and each dataset entry,
+        # keeping only the best matches
+        top_matches = TopMatches(self.matches)
+        generator = self.dataset.data_generator(
+            query,
+            self._query_text_handler(text_input),
+            self.require_text_match)
+        batches = self._split_batches(generator, part_size)
+        while True:
+            with span('dataset_batch_load'):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            batch_query, batch_items, file_tracker = batch
 
             # Run inference on this batch
-            ranks = self.model.measure_similarity(batch_query, batch_items)
+            with span('similarity'):
+                ranks = self.model.measure_similarity(batch_query, batch_items)
 
             # Determine the best score for each audio file
-            for index, handle in file_tracker.items():
-                if index != 0 and previous_handle != '':
-                    max_file_rank = np.max(ranks[previous_index:index])
-                    model_output = self._update_model_output(
-                        model_output, previous_handle, max_file_rank)
+            with span('ranking'):
+                top_matches.push(ranks, file_tracker)
+
+            if (time_budget is not None and
+                    time.monotonic() - start > time_budget):
+                self.logger.info(
+                    'Search stopped after its time budget of {} seconds'.format(
+                        time_budget))
+                generator.close()
+                break
+
+            yield top_matches, False
+
+        yield top_matches, True
 
-                previous_handle = handle
-                previous_index = index
+    def _split_batches(self, generator, part_size):
+        '''
+        Splits the batches of a dataset generator into parts of at most
+        part_size items.
+
+        Arguments:
+            generator: A python generator. The dataset generator.
+            part_size: An int or None. The maximum number of items in a part.
+                If None, batches are not split.
 
-            max_file_rank = np.max(ranks[previous_index:])
-            model_output = self._update_model_output(
-                model_output, previous_handle, max_file_rank)
+        Returns:
+            A python generator yielding batches in the format of the dataset
+                generator.
+        '''
+        for batch_query, batch_items, file_tracker in generator:
+            if not part_size or len(batch_items) <= part_size:
+                yield batch_query, batch_items, file_tracker
+                continue
+
+            # A query broadcast against the batch is shared by every part
+            repeats_query = len(batch_query) == len(batch_items)
+            for start in range(0, len(batch_items), part_size):
+                end = min(start + part_size, len(batch_items))
+
+                # A file continuing from the previous part is carried over
+                # by TopMatches
+                part_tracker = {
+                    i - start: handle for (i, handle) in file_tracker.items()
+                    if start <= i < end}
+                part_query = (
+                    batch_query[start:end] if repeats_query else batch_query)
+                yield part_query, batch_items[start:end], part_tracker
+
+    def _construct_query(self, query, sampling_rate):
+        '''
+        Constructs the representation of a vocal query, reusing the cached
+        representation of a repeated query.
+
+        Arguments:
+            query: A 1D numpy array. The vocal query.
+            sampling_rate: An integer. The sampling rate of the query.
+
+        Returns:
+            A python list holding the query representation, as defined by the
+                model.
+        '''
+        return self._construct_queries([query], [sampling_rate])
 
+    def _construct_queries(self, queries, sampling_rates):
+        '''
+        Constructs the representations of vocal queries in one call to the
+        model, reusing the cached representations of repeated queries.
+
+        Arguments:
+            queries: A python list of 1D numpy arrays. The vocal queries.
+            sampling_rates: A python list of integers. The sampling rate of
+                each query.
+
+        Returns:
+            A python list of query representations, as defined by the model.
+        '''
+        representations = [None] * len(queries)
+        keys = [None] * len(queries)
+        if self.cache is not None:
+            for i, (query, sampling_rate) in enumerate(
+                    zip(queries, sampling_rates)):
+                keys[i] = ('representation', hash_audio(query, sampling_rate))
+                representations[i] = self.cache.get(keys[i])
+
+        missing = [i for i, r in enumerate(representations) if r is None]
+        if missing:
+            constructed = self.model.construct_representation(
+                [queries[i] for i in missing],
+                [sampling_rates[i] for i in missing],
+                is_query=True)
+            for i, representation in zip(missing, constructed):
+                representations[i] = representation
+                if self.cache is not None:
+                    self.cache.put(keys[i], representation)
+
+        return representations
+
+    def _cached_results(self, query, sampling_rate, text_input):
+        '''
+        Retrieves the cached results of a repeated query.
+
+        Returns:
+            The results, in the format returned by search, or None.
+        '''
+        if self.cache is None or not self.cache_results:
+            return None
+
+        results = self.cache.get(
+            self._results_key(query, sampling_rate, text_input))
+        if results is None:
+            return None
+
+        self.logger.debug('Returning cached search results')
+        return tuple(list(r) for r in results)
+
+    def _cache_results(self, query, sampling_rate, text_input, results):
+        '''
+        Caches the results of a query, if result caching is enabled.
+        '''
+        if self.cache is None or not self.cache_results:
+            return
+
+        self.cache.put(
+            self._results_key(query, sampling_rate, text_input),
+            tuple(list(r) for r in results))
+
+    def _results_key(self, query, sampling_rate, text_input):
+        return (
+            'results', hash_audio(query, sampling_rate), text_input,
+            self.require_text_match, self.matches)
+
+    def _query_text_handler(self, text_input):
+        '''
+        Seeds a copy of the text handler with the user's text query. Each
+        search uses its own copy, as searches run concurrently in the server
+        threads.
+
+        Arguments:
+            text_input: A string. The user's text query.
+
+        Returns:
+            A TextHandler object.
+        '''
+        text_handler = copy.copy(self.text_handler)
+        text_handler.set_query_text(text_input)
+        return text_handler
+
+    def _results(self, top_matches, text_input):
+        '''
+        Formats the current best matches of a search.
+
+        Arguments:
+            top_matches: A TopMatches object. The best matches of the search.
+            text_input: A string. The user's text query.
+
+        Returns:
+            A tuple of four lists, as returned by search.
+        '''
         # Retrieve the top audio filenames
-        match_list = sorted(model_output, key=model_output.get)[-self.matches:]
-        match_list.reverse()
+        best_matches = top_matches.matches()
+        model_output = {handle: float(score) for handle, score in best_matches}
+        match_list = [handle for handle, _ in best_matches]
         filenames = [self.dataset.handle_to_filename(m) for m in match_list]
         display_names = [os.path.basename(f) for f in filenames]
 
@@ -104,21 +410,95 @@ class Voogle(object):
         if self.require_text_match or not text_input:
             text_matches = [False] * len(match_list)
         else:
+            text_handler = self._query_text_handler(text_input)
             text_features = [
                 self.dataset.handle_to_text_features(m) for m in match_list]
-            text_matches = [
-                self.text_handler.is_match([t]) for t in text_features]
+            text_matches = [text_handler.is_match([t]) for t in text_features]
 
         # Retrieve the normalized similarity scores of the matches
-        max_score = model_output[match_list[0]]
-        similarity_scores = [model_output[m] / max_score for m in match_list]
+        if match_list:
+            max_score = model_output[match_list[0]]
+            similarity_scores = [
+                model_output[m] / max_score for m in match_list]
+        else:
+            similarity_scores = []
 
         return display_names, filenames, text_matches, similarity_scores
 
-    def _update_model_output(self, model_output, handle, max_file_rank):
-        if handle in model_output:
-            model_output[handle] = max(
-                model_output[handle], max_file_rank)
-        else:
-            model_output[handle] = max_file_rank
-        return model_output
+
+class TopMatches(object):
+    '''
+    Streaming top-k selection over the similarity scores of a search. Only the
+    k best-scoring audio files are kept, so memory does not grow with the size
+    of the dataset.
+    '''
+
+    def __init__(self, k):
+        '''
+        TopMatches constructor.
+
+        Arguments:
+            k: An int. The number of matches to keep.
+        '''
+        self.k = k
+        self.heap = []
+        self.pending_handle = None
+        self.pending_score = None
+        self.count = 0
+
+    def push(self, ranks, file_tracker):
+        '''
+        Adds the scores of one batch yielded by a dataset generator. The scores
+        of an audio file may continue from the previous batch, in which case
+        its best score is carried over.
+
+        Arguments:
+            ranks: A 1D numpy array. The similarity scores of the batch.
+            file_tracker: A dict. Maps the starting index of each audio file
+                within the batch to its representation handle.
+        '''
+        ranks = np.asarray(ranks).reshape(-1)
+        if not len(ranks):
+            return
+
+        starts = sorted(file_tracker)
+        handles = [file_tracker[i] for i in starts]
+        if not starts or starts[0] != 0:
+            # The batch begins with the remaining scores of the last file
+            starts = [0] + starts
+            handles = [self.pending_handle] + handles
+
+        # Best score of each file in a single pass over the batch
+        scores = np.maximum.reduceat(ranks, starts)
+        for handle, score in zip(handles, scores):
+            if handle == self.pending_handle:
+                self.pending_score = max(self.pending_score, score)
+            else:
+                self._flush()
+                self.pending_handle = handle
+                self.pending_score = score
+
+    def matches(self):
+        '''
+        Returns the current best matches.
+
+        Returns:
+            A python list of (handle, score) tuples sorted in descending order
+                of score.
+        '''
+        entries = list(self.heap)
+        if self.pending_handle is not None:
+            entries.append((self.pending_score, self.count, self.pending_handle))
+        best = heapq.nlargest(self.k, entries)
+        return [(handle, score) for (score, _, handle) in best]
+
+    def _flush(self):
+        if self.pending_handle is None:
+            return
+
+        entry = (self.pending_score, self.count, self.pending_handle)
+        self.count += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
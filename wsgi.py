@@ -0,0 +1,4 @@
+from app import create_app
+
+# WSGI entry point, e.g., gunicorn -c gunicorn.conf.py wsgi:app
+app = create_app()